@@ -0,0 +1,137 @@
+#!python3
+
+"""
+Defines a class Allocation - the per-trader outcome of a double-auction mechanism.
+
+An Allocation is the same tuple of aggregates that the mechanisms in doubleauction have always returned,
+so existing code can keep unpacking and comparing it;
+in addition, it keeps the per-trader allocation that the mechanism calculated on the way, in numpy arrays.
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import numpy as np
+
+from markets import exactArray, exactSum, fitsInt64
+
+
+class Allocation(tuple):
+	"""
+	A tuple of aggregates, with the per-trader allocation in arrays with an entry per trader (in the order of the input list):
+	  * isBuyer  - True for buyers, False for sellers.
+	  * units    - the number of units that the trader buys/sells.
+	  * payments - the money that the trader pays to the market manager (negative for the money that a seller receives).
+	The units and payments are numbers of the same kind as the aggregates: int64 or float64,
+	or Python integers (in an object array) if they do not fit in int64.
+
+	>>> allocation = Allocation((4, 900), isBuyer=[True,False], units=[4,4], payments=[600,-600])
+	>>> allocation
+	(4, 900)
+	>>> (units, gain) = allocation
+	>>> allocation == (4, 900)
+	True
+	>>> allocation.units.tolist(), allocation.managerGain()
+	([4, 4], 0)
+	>>> Allocation((3,), [True,False], [3,3], [3*10**20+5, -3*10**20]).managerGain()
+	5
+	"""
+
+	def __new__(cls, aggregates:tuple, isBuyer:np.ndarray, units:np.ndarray, payments:np.ndarray):
+		allocation = super().__new__(cls, aggregates)
+		allocation.isBuyer = np.asarray(isBuyer, dtype=bool)
+		allocation.units = _numbers(units)
+		allocation.payments = _numbers(payments)
+		return allocation
+
+	@staticmethod
+	def empty(isBuyer:np.ndarray, aggregates:tuple=()):
+		"""
+		An allocation in which nobody trades.
+		"""
+		isBuyer = np.asarray(isBuyer, dtype=bool)
+		return Allocation(aggregates, isBuyer, np.zeros(len(isBuyer), dtype=np.int64), np.zeros(len(isBuyer), dtype=np.int64))
+
+	@staticmethod
+	def combine(aggregates:tuple, numOfTraders:int, parts:list):
+		"""
+		Combine allocations of disjoint sub-markets into an allocation of the whole market.
+		INPUT: parts - a list of pairs (indices, allocation), where indices are the positions of the traders of the sub-market in the whole market.
+
+		>>> left = Allocation((), [True], [3], [300])
+		>>> right = Allocation((), [False,True], [3,0], [-300,0])
+		>>> Allocation.combine((3,), 3, [([2],left), ([0,1],right)]).payments.tolist()
+		[-300, 0, 300]
+		"""
+		isBuyer = np.zeros(numOfTraders, dtype=bool)
+		units = np.zeros(numOfTraders, dtype=np.result_type(np.int64, *(allocation.units for (indices, allocation) in parts)))
+		payments = np.zeros(numOfTraders, dtype=np.result_type(np.int64, *(allocation.payments for (indices, allocation) in parts)))
+		for (indices, allocation) in parts:
+			indices = np.asarray(indices, dtype=np.int64)
+			isBuyer[indices] = allocation.isBuyer
+			units[indices] = allocation.units
+			payments[indices] = allocation.payments
+		return Allocation(aggregates, isBuyer, units, payments)
+
+	def asTuple(self)->tuple:
+		"""
+		The aggregates as a plain tuple.
+		"""
+		return tuple(self)
+
+	def managerGain(self)->float:
+		"""
+		The total money that the market manager collects (summed exactly, see markets.exactSum).
+		"""
+		return exactSum(self.payments)
+
+
+def _numbers(numbers)->np.ndarray:
+	"""
+	The given array, or an array of the given list of numbers (see markets.exactArray).
+	"""
+	return numbers if isinstance(numbers, np.ndarray) else exactArray(list(numbers))
+
+
+def paymentsAtPrice(isBuyer:np.ndarray, units:np.ndarray, price:float)->np.ndarray:
+	"""
+	OUTPUT: the payments when each buyer pays, and each seller receives, the given price per unit:
+	        in int64 for an integer price (or in Python integers if they might overflow int64), and in float64 otherwise.
+
+	>>> paymentsAtPrice(np.array([True,False,True]), np.array([2,2,0]), 100).tolist()
+	[200, -200, 0]
+	>>> paymentsAtPrice(np.array([True,False]), np.array([2,2]), 10**20).tolist()
+	[200000000000000000000, -200000000000000000000]
+	>>> paymentsAtPrice(np.array([True,False]), np.array([2,0]), 2.5).tolist()
+	[5.0, 0.0]
+	"""
+	if isinstance(price, (int, np.integer)) and units.dtype.kind in "iuO":
+		dtype = np.int64 if fitsInt64(np.append(units, 1), np.array([price], dtype=object)) else object   # the price itself must fit too
+		price = int(price)
+	else:
+		dtype = float
+	payments = np.zeros(len(units), dtype=dtype)
+	traded = units>0   # the price may be infinite when nobody trades
+	payments[traded] = np.where(isBuyer[traded], units[traded], -units[traded]).astype(dtype)*price
+	return payments
+
+
+class MUDAOutcome(tuple):
+	"""
+	The tuple returned by doubleauction.MUDA, with the allocations of the whole market:
+	  * lottery - the Allocation of the lottery variant (None if it was not calculated).
+	  * vickrey - the Allocation of the Vickrey variant (None if it was not calculated).
+	"""
+
+	def __new__(cls, aggregates:tuple, lottery:Allocation=None, vickrey:Allocation=None):
+		outcome = super().__new__(cls, aggregates)
+		outcome.lottery = lottery
+		outcome.vickrey = vickrey
+		return outcome
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
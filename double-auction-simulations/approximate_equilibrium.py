@@ -0,0 +1,228 @@
+#!python3
+
+"""
+Approximate Walrasian equilibrium of huge markets, using histograms of the marginal values.
+
+The virtual traders are scanned once, in any order, into fixed-width histograms of the buyers' and the sellers' values.
+The bin in which the demand curve crosses the supply curve contains the equilibrium price,
+so the width of that bin (the range of the values observed in it) bounds the error of the price;
+the other outputs are bounded in the same way.
+Optionally, a second pass collects only the virtual traders in the crossing bin and calculates the exact equilibrium.
+The estimate is the backend "approximate" of doubleauction.walrasianEquilibrium (and so of WALRAS, MUDA and simulations.simulateAuctions).
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import math
+import numpy as np
+
+from markets import Crossing
+from streaming import StreamingMarket
+
+
+class ValueHistogram:
+	"""
+	Fixed-width histograms of the units of virtual buyers and sellers, by their values.
+	Values outside [minValue,maxValue] are counted in the extreme bins.
+	Each bin also keeps the minimum and maximum value observed in it, so the error bounds are valid even in this case.
+
+	>>> histogram = ValueHistogram(100, 400, numOfBins=3)
+	>>> histogram.add(np.array([5,4,3]), np.array([250,150,350]), np.array([True,True,True]))
+	>>> histogram.add(np.array([5,4,3]), np.array([200,100,300]), np.array([False,False,False]))
+	>>> histogram.buyerUnits.tolist(), histogram.sellerUnits.tolist()
+	([4, 5, 3], [4, 5, 3])
+	>>> histogram.binMin.tolist(), histogram.binMax.tolist()
+	([100.0, 200.0, 300.0], [150.0, 250.0, 350.0])
+	"""
+
+	def __init__(self, minValue:float, maxValue:float, numOfBins:int=1000):
+		self.minValue = minValue
+		self.numOfBins = numOfBins
+		self.binWidth = (maxValue-minValue)/numOfBins if maxValue>minValue else 1
+		(self.buyerUnits, self.buyerCounts, self.sellerUnits, self.sellerCounts) = (np.zeros(numOfBins, dtype=np.int64) for i in range(4))
+		(self.buyerValue, self.sellerValue) = (np.zeros(numOfBins), np.zeros(numOfBins))
+		self.binMin = np.full(numOfBins, math.inf)
+		self.binMax = np.full(numOfBins, -math.inf)
+
+	def binOf(self, values:np.ndarray)->np.ndarray:
+		bins = np.floor((values-self.minValue)/self.binWidth).astype(np.int64)
+		return np.clip(bins, 0, self.numOfBins-1)
+
+	def add(self, quantities:np.ndarray, values:np.ndarray, isBuyer:np.ndarray):
+		"""
+		Add a block of virtual traders (in any order).
+		"""
+		bins = self.binOf(values)
+		isSeller = ~isBuyer
+		for (side, units, counts, value) in ((isBuyer, self.buyerUnits, self.buyerCounts, self.buyerValue), (isSeller, self.sellerUnits, self.sellerCounts, self.sellerValue)):
+			(sideBins, sideQuantities, sideValues) = (bins[side], quantities[side], values[side])
+			units  += np.bincount(sideBins, weights=sideQuantities, minlength=self.numOfBins).astype(np.int64)
+			counts += np.bincount(sideBins, minlength=self.numOfBins)
+			value  += np.bincount(sideBins, weights=sideQuantities*sideValues, minlength=self.numOfBins)
+		np.minimum.at(self.binMin, bins, values)
+		np.maximum.at(self.binMax, bins, values)
+
+	def _crossing(self)->dict:
+		"""
+		Find the crossing bin: walrasianEquilibrium processes the bins by descending value,
+		and the demand reaches the supply in the first bin whose buyers' units, together with those of the bins above it,
+		are at least the sellers' units in the bins below it.
+		OUTPUT: None if there is no supply; otherwise, a dict with the bin and the state of walrasianEquilibrium before it.
+		"""
+		(buyerUnits, sellerUnits) = (self.buyerUnits[::-1], self.sellerUnits[::-1])   # descending order of bins
+		totalSupply = int(sellerUnits.sum())
+		if totalSupply <= 0:
+			return None
+		demand = np.cumsum(buyerUnits)
+		supply = totalSupply - np.cumsum(sellerUnits)
+		j = int(np.argmax(demand >= supply))
+		above = slice(self.numOfBins-j, None)   # the bins above the crossing bin, in ascending order
+		below = slice(0, self.numOfBins-j-1)
+		return dict(bin = self.numOfBins-1-j,
+			demand = int(demand[j]-buyerUnits[j]), supply = int(supply[j]+sellerUnits[j]), supplyBelow = int(supply[j]),
+			numOfBuyers = int(self.buyerCounts[above].sum()), numOfSellersExited = int(self.sellerCounts[above].sum()),
+			buyersValue = float(self.buyerValue[above].sum()), sellersValue = float(self.sellerValue[:self.numOfBins-j].sum()),
+			sellersValueBelow = float(self.sellerValue[below].sum()))
+
+	def equilibrium(self)->tuple:
+		"""
+		Estimate the output of walrasianEquilibrium, assuming that the values in the crossing bin are uniformly distributed.
+		OUTPUT: (estimate, lowerBound, upperBound), where each of them is a tuple
+		        (equilibriumPrice, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade).
+		        The outputs of walrasianEquilibrium are guaranteed to be within the bounds.
+
+		>>> histogram = ValueHistogram(0, 1000, numOfBins=10)
+		>>> histogram.add(np.array([5,4,3]), np.array([250,150,350]), np.array([True,True,True]))
+		>>> histogram.add(np.array([5,4,3]), np.array([200,100,300]), np.array([False,False,False]))
+		>>> (estimate, lowerBound, upperBound) = histogram.equilibrium()
+		>>> lowerBound
+		(200.0, 1, 1, 4, 650.0)
+		>>> upperBound
+		(250.0, 2, 2, 8, 1100.0)
+		"""
+		numOfVirtualSellers = int(self.sellerCounts.sum())
+		state = self._crossing()
+		if state is None:
+			result = (math.inf, 0, numOfVirtualSellers, 0, 0)
+			return (result, result, result)
+		b = state["bin"]
+		(low, high) = (float(self.binMin[b]), float(self.binMax[b]))
+		(buyerUnits, sellerUnits) = (int(self.buyerUnits[b]), int(self.sellerUnits[b]))
+		(demand, supply, supplyBelow) = (state["demand"], state["supply"], state["supplyBelow"])
+		fraction = (supply-demand) / (buyerUnits+sellerUnits)   # the fraction of the bin, from its top, that is processed until the crossing
+
+		numOfBuyers = (state["numOfBuyers"], state["numOfBuyers"]+int(self.buyerCounts[b]))
+		numOfSellersRemaining = numOfVirtualSellers - state["numOfSellersExited"]
+		numOfSellers = (numOfSellersRemaining-int(self.sellerCounts[b]), numOfSellersRemaining)
+		units = (max(demand, supplyBelow), min(demand+buyerUnits, supply))
+		unitsEstimate = min(max(round(demand + fraction*buyerUnits), units[0]), units[1])
+
+		# The traded units in the bin are those of the entering buyers and the remaining sellers:
+		gainOutside = state["buyersValue"] - state["sellersValueBelow"]
+		def gainBounds(totalUnitsTraded:int)->tuple:
+			(buyersIn, sellersIn) = (totalUnitsTraded-demand, totalUnitsTraded-supplyBelow)
+			return (gainOutside + buyersIn*low - sellersIn*high, gainOutside + buyersIn*high - sellersIn*low)
+		gains = gainBounds(units[0]) + gainBounds(units[1])
+		width = high-low
+		gainEstimate = gainOutside + (unitsEstimate-demand)*(high-fraction*width/2) - (unitsEstimate-supplyBelow)*(low+(1-fraction)*width/2)
+
+		estimate = (high-fraction*width,
+			numOfBuyers[0]+round(fraction*int(self.buyerCounts[b])),
+			numOfSellers[1]-round(fraction*int(self.sellerCounts[b])),
+			unitsEstimate, min(max(gainEstimate, min(gains)), max(gains)))
+		lowerBound = (low, numOfBuyers[0], numOfSellers[0], units[0], min(gains))
+		upperBound = (high, numOfBuyers[1], numOfSellers[1], units[1], max(gains))
+		return (estimate, lowerBound, upperBound)
+
+	def refine(self, blocks)->tuple:
+		"""
+		Calculate the exact equilibrium, using a second pass over the same virtual traders, in which only the virtual traders
+		in the crossing bin are kept.
+		INPUT: an iterable of blocks (quantities, values, isBuyer, order), where 'order' breaks ties
+		       between virtual traders with the same value and side (in ascending order).
+		OUTPUT: (equilibriumPrice, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade)
+		"""
+		numOfVirtualSellers = int(self.sellerCounts.sum())
+		state = self._crossing()
+		if state is None:
+			return (math.inf, 0, numOfVirtualSellers, 0, 0)
+		inBin = []
+		for (quantities, values, isBuyer, order) in blocks:
+			selected = self.binOf(values)==state["bin"]
+			inBin.append((quantities[selected], values[selected], isBuyer[selected], order[selected]))
+		(quantities, values, isBuyer, order) = (np.concatenate(column) for column in zip(*inBin))
+		sortOrder = np.lexsort((order, ~isBuyer, -values))
+		crossing = Crossing(numOfVirtualSellers, state["supply"], state["sellersValue"], state["demand"], state["buyersValue"],
+			state["numOfBuyers"], state["numOfSellersExited"])
+		crossing.consume(quantities[sortOrder], values[sortOrder], np.zeros(len(sortOrder), dtype=np.int64), isBuyer[sortOrder])
+		return crossing.result
+
+
+def virtualTraderBlocks(traders, blockSize:int=2**16):
+	"""
+	A generator of blocks (quantities, values, isBuyer, order) of the virtual traders of the given market
+	(a list of traders, a Market, or a StreamingMarket), in any order.
+	'order' breaks ties between virtual traders with the same value and side, as in walrasianEquilibrium
+	(in a list of traders, the last one is processed first; in a StreamingMarket, the first one in the merged runs).
+	"""
+	if isinstance(traders, StreamingMarket):
+		offset = 0
+		for (quantities, values, owners, isBuyer) in traders.blocks(blockSize):
+			yield (quantities, values, isBuyer, np.arange(offset, offset+len(values)))
+			offset += len(values)
+		return
+	traders = list(traders)
+	position = 0
+	for start in range(0, len(traders), blockSize):
+		block = traders[start:start+blockSize]
+		quantities = np.array([v[0] for t in block for v in t.valuations], dtype=np.int64)
+		values = np.array([v[1] for t in block for v in t.valuations], dtype=float)
+		isBuyer = np.array([t.isBuyer for t in block for v in t.valuations], dtype=bool)
+		yield (quantities, values, isBuyer, -np.arange(position, position+len(values)))
+		position += len(values)
+
+
+def approximateEquilibrium(traders, numOfBins:int=1000, refine:bool=False, valueRange:tuple=None)->tuple:
+	"""
+	Approximate walrasianEquilibrium in a single pass over the virtual traders, in O(n + numOfBins) time and O(numOfBins) memory.
+	INPUT: a list of Trader objects, a Market, or a StreamingMarket (whose runs are read without merging them).
+	       numOfBins - the number of bins in each histogram; the error bounds shrink as it grows.
+	       refine - if True, the exact equilibrium is calculated in a second pass, that keeps only the virtual traders in the crossing bin.
+	       valueRange - (minValue, maxValue) of the histograms. Default: the range of the StreamingMarket,
+	                    or, for a list of traders, the range found in a preliminary pass.
+	OUTPUT: (estimate, lowerBound, upperBound), where each of them is a tuple
+	        (equilibriumPrice, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade).
+	        With refine=True, all three are the exact equilibrium (up to the order of floating-point additions).
+
+	>>> from traders import Trader
+	>>> b1 = Trader.Buyer([[5,250]])
+	>>> b2 = Trader.Buyer([[4,150],[3,350]])
+	>>> s1 = Trader.Seller([[5,200]])
+	>>> s2 = Trader.Seller([[4,100],[3,300]])
+	>>> (estimate, lowerBound, upperBound) = approximateEquilibrium([b1,b2,s1,s2], numOfBins=4)
+	>>> lowerBound[0] <= 200 <= upperBound[0]
+	True
+	>>> approximateEquilibrium([b1,b2,s1,s2], numOfBins=4, refine=True)[0]
+	(200.0, 2, 2, 8, 1100.0)
+	"""
+	if valueRange is None:
+		if isinstance(traders, StreamingMarket):
+			valueRange = traders.valueRange()
+		else:
+			values = [v[1] for t in traders for v in t.valuations]
+			valueRange = (min(values), max(values)) if values else (0, 0)
+	histogram = ValueHistogram(valueRange[0], valueRange[1], numOfBins)
+	for (quantities, values, isBuyer, order) in virtualTraderBlocks(traders):
+		histogram.add(quantities, values, isBuyer)
+	if refine:
+		result = histogram.refine(virtualTraderBlocks(traders))
+		return (result, result, result)
+	return histogram.equilibrium()
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
@@ -13,12 +13,27 @@ import math
 import random
 from collections import defaultdict
 from traders import *
+from allocations import Allocation, MUDAOutcome, paymentsAtPrice
+from markets import Market, equilibriumBand, equilibriumGain, exactArray, fitsInt64, selectEquilibrium, tickEquilibrium, toTicks, vickreyOrder, SELECTION_CUTOFF, TICK_SIZE
+import numpy as np
+import jit_backend
+from jit_backend import VirtualTraderArrays, resolveBackend
 
+MECHANISM_VERSION = 5   # increase whenever the results of the mechanisms change, to invalidate the stored results (see result_store)
 
-def walrasianEquilibrium(traders:list):
+
+def walrasianEquilibrium(traders:list, backend:str=None):
 	"""
 	Calculate a Walrasian equilibrium (aka competitive equilibrium) in a single-type multi-unit market.
 	INPUT: a list of Trader objects, each of which represents valuations with decreasing marginal returns.
+	       It can also be a Market, in which case the equilibrium is calculated on its pre-sorted arrays.
+	       backend - "python", or "numba" for the JIT-compiled loop of jit_backend (if numba is not installed, "python" is used),
+	                 or "approximate" for the estimate of approximate_equilibrium.approximateEquilibrium, in one pass without sorting
+	                 (for huge random markets, whose results are averaged anyway),
+	                 or "ticks" for walrasianEquilibriumByTicks with markets.TICK_SIZE, which counts the virtual traders per price level
+	                 instead of sorting them (for TORQ prices; if some value is not a multiple of the tick size,
+	                 or the values span too many price levels, "python" is used).
+	                 Default: jit_backend.DEFAULT_BACKEND, from the environment variable DOUBLE_AUCTION_BACKEND.
 	OUTPUT: (equilibriumPrice, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade)
 
 	>>> b1 = Trader.Buyer([[5,250]])
@@ -37,21 +52,54 @@ def walrasianEquilibrium(traders:list):
 	(1, 1, 4, 600)
 	>>> walrasianEquilibrium([b1,b2,s1,s2])[1:5]
 	(2, 2, 8, 1100)
+	>>> walrasianEquilibrium([b1,b2,s1,s2], backend="numba")
+	(200, 2, 2, 8, 1100)
+	>>> walrasianEquilibrium([Trader.Buyer([[10**20,50]]), Trader.Seller([[10**20,10]])])   # beyond int64, in Python integers
+	(50, 1, 1, 100000000000000000000, 4000000000000000000000)
+	>>> walrasianEquilibrium([b1,b2,s1,s2], backend="approximate")
+	(200.0, 2, 2, 8, 1100.0)
+	>>> walrasianEquilibrium([Trader.Buyer([[5,10.25],[2,10.5]]), Trader.Seller([[4,10.125],[3,10.375]])], backend="ticks")
+	(10.25, 2, 1, 4, 1.0)
 	"""
+	if isinstance(traders, Market):
+		return traders.walrasianEquilibrium()   # already sorted
+	if isinstance(traders, VirtualTraderArrays):
+		return jit_backend.walrasianEquilibrium(traders)
+	backend = resolveBackend(backend)
+	if backend=="approximate":
+		from approximate_equilibrium import approximateEquilibrium   # it imports this module (through streaming)
+		return approximateEquilibrium(traders)[0]
+	if backend=="ticks":
+		try:
+			return walrasianEquilibriumByTicks(traders, TICK_SIZE)
+		except ValueError:   # the values are not multiples of TICK_SIZE, or they have too many price levels
+			pass
+	if backend=="numba":
+		arrays = VirtualTraderArrays(traders)
+		if arrays.fitsInt64():   # otherwise, the units or values might overflow the int64 arrays of the kernel
+			return jit_backend.walrasianEquilibrium(arrays)
 	(virtualBuyers,virtualSellers) = virtualTraders(traders)
+	band = None
+	if virtualBuyers and virtualSellers:   # equilibriumBand decides whether the market is large enough for a band
+		(buyerQuantities, buyerValues) = (exactArray(column) for column in zip(*virtualBuyers))
+		(sellerQuantities, sellerValues) = (exactArray(column) for column in zip(*virtualSellers))
+		band = equilibriumBand(buyerQuantities, buyerValues, sellerQuantities, sellerValues)
+	if band is None:
+		(demand, numOfBuyers, supply, numOfSellers) = (0, 0, 0, 0)
+	else:   # only the virtual traders in the band are sorted; the others enter, exit or remain together
+		(buyers, sellers, demand, numOfBuyers, supply, numOfSellers) = band
+		virtualBuyers  = [virtualBuyers[i] for i in buyers.tolist()]
+		virtualSellers = [virtualSellers[i] for i in sellers.tolist()]
 	virtualBuyers.sort(key=itemgetter(1), reverse=False)   # last buyer has highest value
 	virtualSellers.sort(key=itemgetter(1), reverse=False)  # last seller has highest value
+	sortedBuyers = list(virtualBuyers)   # the loop pops the buyers that enter
 	price = math.inf  # the price decreases until equilibrium is found
-	demand = 0
-	buyersValue = 0
-	numOfBuyers = 0
-	supply = sum ([s[0] for s in virtualSellers])
-	sellersValue = sum([s[0]*s[1]for s in virtualSellers])
-	numOfSellers = len(virtualSellers)
-	totalUnitsTraded = 0
+	supply += sum ([s[0] for s in virtualSellers])
+	numOfSellers += len(virtualSellers)
+	totalUnitsTraded = demand
 	while demand < supply:
-		(currentDemand,currentDemandValue) = virtualBuyers[-1] if virtualBuyers else (0,0)
-		(currentSupply,currentSupplyValue) = virtualSellers[-1] if virtualSellers else (0,0)
+		(currentDemand,currentDemandValue) = virtualBuyers[-1] if virtualBuyers else (0,-math.inf)
+		(currentSupply,currentSupplyValue) = virtualSellers[-1] if virtualSellers else (0,-math.inf)
 		if currentDemandValue >= currentSupplyValue:  # a buyer enters the room
 			numOfBuyers += 1
 			price = currentDemandValue
@@ -59,7 +107,6 @@ def walrasianEquilibrium(traders:list):
 				units = supply-demand
 			else:
 				units = currentDemand
-			buyersValue += units*currentDemandValue
 			demand += units
 			totalUnitsTraded += units
 			virtualBuyers.pop()
@@ -70,39 +117,140 @@ def walrasianEquilibrium(traders:list):
 			else:
 				units = currentSupply
 				numOfSellers -= 1
-			sellersValue -= units*currentSupplyValue
 			supply -= units
 			virtualSellers.pop()
 
-	return (price, numOfBuyers, numOfSellers, totalUnitsTraded, buyersValue-sellersValue)
+	if band is not None:
+		isBuyer = np.arange(len(buyerValues)+len(sellerValues)) < len(buyerValues)
+		return (price, numOfBuyers, numOfSellers, totalUnitsTraded, equilibriumGain(np.concatenate((buyerQuantities, sellerQuantities)),
+			np.concatenate((buyerValues, sellerValues)), isBuyer, price, totalUnitsTraded))
+	# Only the buyers that entered and the sellers that remained can trade:
+	trading = sortedBuyers[len(virtualBuyers):] + virtualSellers
+	(quantities, values) = zip(*trading) if trading else ((), ())
+	isBuyer = np.arange(len(trading)) < len(sortedBuyers)-len(virtualBuyers)
+	return (price, numOfBuyers, numOfSellers, totalUnitsTraded, equilibriumGain(exactArray(quantities), exactArray(values), isBuyer, price, totalUnitsTraded))
 walrasianEquilibrium.LOG=False
 
 
-def randomPartition(theList:list)->(list,list):
+def walrasianEquilibriumBySelection(traders:list)->tuple:
+	"""
+	Calculate the same output as walrasianEquilibrium, in expected linear time:
+	instead of sorting the virtual buyers and sellers, only the units near the crossing are selected (see markets.selectEquilibrium).
+
+	>>> b1 = Trader.Buyer([[5,250]])
+	>>> b2 = Trader.Buyer([[4,150],[3,350]])
+	>>> s1 = Trader.Seller([[5,200]])
+	>>> s2 = Trader.Seller([[4,100],[3,300]])
+	>>> walrasianEquilibriumBySelection([b1,b2,s1,s2])
+	(200, 2, 2, 8, 1100)
+	>>> walrasianEquilibriumBySelection([b1])
+	(inf, 0, 0, 0, 0)
+	>>> random.seed(1)
+	>>> traders = [Trader(random.random()<0.5, [(random.randint(1,5),random.randint(1,50)) for j in range(3)]) for i in range(1000)]
+	>>> walrasianEquilibriumBySelection(traders) == walrasianEquilibrium(traders)
+	True
+	>>> from random_datasets import randomAuction   # float values: both sum the gain by markets.equilibriumGain
+	>>> all(walrasianEquilibriumBySelection(traders) == walrasianEquilibrium(traders)
+	...     for traders in (randomAuction(300, 1, 5, 100, 50, rng=np.random.default_rng(seed)) for seed in range(20)))
+	True
+	"""
+	virtualTraders = [(v[0],v[1],t.isBuyer) for t in traders for v in t.valuations]
+	quantities = np.array([v[0] for v in virtualTraders], dtype=np.int64)
+	values = np.array([v[1] for v in virtualTraders])
+	isBuyer = np.array([v[2] for v in virtualTraders], dtype=bool)
+	return equilibriumBySelection(quantities, values, isBuyer)
+
+
+def equilibriumBySelection(quantities:np.ndarray, values:np.ndarray, isBuyer:np.ndarray)->tuple:
+	"""
+	The same as walrasianEquilibriumBySelection, for virtual traders in columns (e.g, the orders of a TORQ dataset),
+	in the order of the traders and of their valuations.
+
+	>>> equilibriumBySelection(np.array([5,4,3,5,4,3]), np.array([250,150,350,200,100,300]), np.array([True,True,True,False,False,False]))
+	(200, 2, 2, 8, 1100)
+	"""
+	order = -np.arange(len(values))   # walrasianEquilibrium processes the last of the ties first
+	return selectEquilibrium(quantities, values, isBuyer, order)
+
+
+def walrasianEquilibriumByTicks(traders:list, tickSize:float=1)->tuple:
+	"""
+	Calculate the same output as walrasianEquilibrium, in O(n+P) time (where P is the number of price levels),
+	for traders whose values are multiples of tickSize - e.g, integers (tickSize=1), or TORQ prices (tickSize=1/8):
+	the virtual traders are counted per price level instead of sorted (see markets.tickEquilibrium).
+	The values are added in exact integer ticks, so the gain might differ from that of walrasianEquilibrium
+	in the floating-point rounding of its additions.
+	Raises ValueError if some value is not a multiple of tickSize, if there are too many price levels (see markets.tickEquilibrium),
+	or if the units or the ticks might overflow int64.
+
+	>>> b1 = Trader.Buyer([[5,250]])
+	>>> b2 = Trader.Buyer([[4,150],[3,350]])
+	>>> s1 = Trader.Seller([[5,200]])
+	>>> s2 = Trader.Seller([[4,100],[3,300]])
+	>>> walrasianEquilibriumByTicks([b1,b2,s1,s2])
+	(200, 2, 2, 8, 1100)
+	>>> walrasianEquilibriumByTicks([b1])
+	(inf, 0, 0, 0, 0)
+	>>> random.seed(1)
+	>>> traders = [Trader(random.random()<0.5, [(random.randint(1,5),random.randint(1,400)/8) for j in range(3)]) for i in range(1000)]
+	>>> walrasianEquilibriumByTicks(traders, tickSize=1/8) == walrasianEquilibrium(traders)
+	True
 	"""
-	INPUT: one list.
+	quantities = exactArray([v[0] for t in traders for v in t.valuations])
+	values = exactArray([v[1] for t in traders for v in t.valuations])
+	isBuyer = np.array([t.isBuyer for t in traders for v in t.valuations], dtype=bool)
+	if "O" in (quantities.dtype.kind, values.dtype.kind):
+		raise ValueError("the units or values of the traders do not fit in int64")
+	ticks = toTicks(values, tickSize)
+	if not fitsInt64(quantities, ticks):
+		raise ValueError("the gain of the traders might overflow int64 ticks")
+	return tickEquilibrium(quantities, ticks, isBuyer, tickSize)
+
+
+def randomPartition(theList:list, rng:np.random.Generator=None)->(list,list):
+	"""
+	INPUT: one list, and a numpy random Generator (default: the global random module).
 	OUTPUT: two lists. Each item in input goes to each list in output with probabaility 1/2.
+
+	>>> randomPartition(range(6), np.random.default_rng(1))
+	([2, 4, 5], [0, 1, 3])
 	"""
+	if rng is not None:
+		goesLeft = (rng.random(len(theList))<0.5).tolist()
+	else:
+		goesLeft = [random.random()<0.5 for item in theList]
 	left  = []
 	right = []
-	for item in theList:
-		if random.random()<0.5:
+	for (item,isLeft) in zip(theList, goesLeft):
+		if isLeft:
 			left.append(item)
 		else:
 			right.append(item)
 	return (left,right)
 
 
+def shuffled(items:list, rng:np.random.Generator=None)->list:
+	"""
+	OUTPUT: the items in a random order, drawn from the given numpy random Generator (default: random.shuffle).
+	jit_backend draws its permutations in the same way, so both backends give the same results.
+	"""
+	if rng is None:
+		items = list(items)
+		random.shuffle(items)
+		return items
+	return [items[i] for i in rng.permutation(len(items))]
+
+
 
 ############## RANDOM TRADE #################	
 
-def randomTradeWithExogeneousPrice(traders:list, price:float)->tuple:
+def randomTradeWithExogeneousPrice(traders:list, price:float, rng:np.random.Generator=None)->tuple:
 	"""
 	Calculates the trade in the given market, when the price is determined exogeneously.
 	Excess demand/supply is settled using a random permutation.
 
-	INPUT: a list of Trader objects, and an exogeneous price.
-	OUTPUT: (totalUnitsTraded, gainFromTrade)
+	INPUT: a list of Trader objects, an exogeneous price, and a numpy random Generator for the permutation (default: the global random module).
+	OUTPUT: an Allocation (totalUnitsTraded, gainFromTrade), with the units and payments of each trader.
 
 	TODO: if a trader's value exactly equals the price,
 	we should choose for him how many units he trades, to improve gain-from-trade.
@@ -119,13 +267,16 @@ def randomTradeWithExogeneousPrice(traders:list, price:float)->tuple:
 	(4, 800)
 	>>> randomTradeWithExogeneousPrice([b1,b2,s1,s2],151)
 	(4, 900)
-	>>> randomTradeWithExogeneousPrice([b1,b2,s1,s2],201)
+	>>> allocation = randomTradeWithExogeneousPrice([b1,b2,s1,s2],201)
+	>>> allocation
 	(8, 1100)
+	>>> allocation.units.tolist(), allocation.payments.tolist()
+	([5, 3, 4, 4], [1005, 603, -804, -804])
 	"""
-	activeBuyers =  [t.abovePrice(price) for t in traders if t.isBuyer]
-	random.shuffle(activeBuyers)
-	activeSellers = [t.belowPrice(price) for t in traders if not t.isBuyer]
-	random.shuffle(activeSellers)
+	buyerPositions = shuffled([i for (i,t) in enumerate(traders) if t.isBuyer], rng)
+	activeBuyers =  [traders[i].abovePrice(price) for i in buyerPositions]
+	sellerPositions = shuffled([i for (i,t) in enumerate(traders) if not t.isBuyer], rng)
+	activeSellers = [traders[i].belowPrice(price) for i in sellerPositions]
 
 	virtualBuyers  = virtualTradersWithIndices(activeBuyers)
 	virtualSellers = virtualTradersWithIndices(activeSellers)
@@ -151,7 +302,12 @@ def randomTradeWithExogeneousPrice(traders:list, price:float)->tuple:
 		buyersGain = sum([v[0]*(v[1]-price) for v in winners])
 		totalGain = buyersGain+sellersGain
 
-	return (totalUnitsTraded, totalGain)
+	isBuyer = np.array([t.isBuyer for t in traders], dtype=bool)
+	if totalDemand < totalSupply:
+		units = unitsPerPosition(virtualBuyers, buyerPositions, len(isBuyer)) + unitsPerPosition(winners, sellerPositions, len(isBuyer))
+	else:
+		units = unitsPerPosition(virtualSellers, sellerPositions, len(isBuyer)) + unitsPerPosition(winners, buyerPositions, len(isBuyer))
+	return Allocation((totalUnitsTraded, totalGain), isBuyer, units, paymentsAtPrice(isBuyer, units, price))
 randomTradeWithExogeneousPrice.LOG = False
 
 
@@ -167,6 +323,20 @@ def unitsByIndex(traders:list)->dict:
 	return units
 
 
+def unitsPerPosition(virtualTraders:list, positions:list, numOfTraders:int):
+	"""
+	INPUT: a list of triplets (quantity, value, index), and the position in the market of the trader with each index.
+	OUTPUT: an array with the total quantity of each position.
+
+	>>> unitsPerPosition([(5, 100, 0), (3, 300, 0), (4, 200, 1)], [2, 0], 3).tolist()
+	[4, 0, 8]
+	"""
+	units = [0]*numOfTraders
+	for (quantity,value,index) in virtualTraders:
+		units[positions[index]] += quantity
+	return exactArray(units)   # Python integers if they do not fit in int64
+
+
 def winnerPayment(winnerIndex:int, winnerUnits:int, losers:list)->float:
 	"""
 	Calculate Vickrey payments for a single winner in a multi-unit auction.
@@ -189,6 +359,22 @@ def winnerPayment(winnerIndex:int, winnerUnits:int, losers:list)->float:
 			return payment
 
 
+def vickreyCandidates(virtualTraders:list, quota:int, reverse:bool)->list:
+	"""
+	INPUT: a list of triplets (quantity, value, index) - the long side of a Vickrey auction, and the number of units to win.
+	OUTPUT: the triplets sorted by value (descending if reverse), as by a stable sort, but only the prefix with the winners
+	        and the losers that their payments need (see markets.vickreyOrder); the rest of the losers are not sorted.
+
+	>>> vickreyCandidates([(5, 100, 0), (3, 300, 0), (4, 200, 1), (6, 400, 1)], 4, reverse=False)
+	[(5, 100, 0), (4, 200, 1), (3, 300, 0), (6, 400, 1)]
+	"""
+	if len(virtualTraders) <= SELECTION_CUTOFF:
+		return sorted(virtualTraders, key=itemgetter(1), reverse=reverse)
+	values = np.array([v[1] for v in virtualTraders])
+	order = vickreyOrder(-values if reverse else values, np.array([v[0] for v in virtualTraders]), np.array([v[2] for v in virtualTraders]), quota)
+	return [virtualTraders[i] for i in order.tolist()]
+
+
 RESERVE_AGENT = -1
 def VickreyTradeWithExogeneousPrice(traders:list, price:float)->tuple:
 	"""
@@ -196,7 +382,7 @@ def VickreyTradeWithExogeneousPrice(traders:list, price:float)->tuple:
 	Excess demand/supply is settled using a Vickrey auction.
 
 	INPUT: a list of Trader objects, and an exogeneous price.
-	OUTPUT: (numOfBuyers, numOfSellers, totalUnitsTraded, tradersGain, totalGain)
+	OUTPUT: an Allocation (totalUnitsTraded, tradersGain, managerGain, totalGain), with the units and payments of each trader.
 
 	>>> b1 = Trader.Buyer([[5,250]])
 	>>> b2 = Trader.Buyer([[4,150],[3,350]])
@@ -208,11 +394,17 @@ def VickreyTradeWithExogeneousPrice(traders:list, price:float)->tuple:
 	(4, 404, 496, 900)
 	>>> VickreyTradeWithExogeneousPrice([b1,b2,s1,s2],151) # supply=4
 	(4, 603, 297, 900)
-	>>> VickreyTradeWithExogeneousPrice([b1,b2,s1,s2],201) # supply=9
+	>>> allocation = VickreyTradeWithExogeneousPrice([b1,b2,s1,s2],201) # supply=9
+	>>> allocation
 	(8, 1099, 1, 1100)
+	>>> allocation.units.tolist(), allocation.payments.tolist()
+	([5, 3, 4, 4], [1005, 603, -804, -803])
 	"""
-	activeBuyers =  [t.abovePrice(price) for t in traders if t.isBuyer]
-	activeSellers = [t.belowPrice(price) for t in traders if not t.isBuyer]
+	buyerPositions  = [i for (i,t) in enumerate(traders) if t.isBuyer]
+	sellerPositions = [i for (i,t) in enumerate(traders) if not t.isBuyer]
+	activeBuyers =  [traders[i].abovePrice(price) for i in buyerPositions]
+	activeSellers = [traders[i].belowPrice(price) for i in sellerPositions]
+	isBuyer = np.array([t.isBuyer for t in traders], dtype=bool)
 	if (VickreyTradeWithExogeneousPrice.LOG):
 		print("activeBuyers",activeBuyers)
 		print("activeSellers",activeSellers)
@@ -226,7 +418,7 @@ def VickreyTradeWithExogeneousPrice(traders:list, price:float)->tuple:
 	if totalDemand < totalSupply:    # buyers are short
 		totalUnitsTraded = totalDemand
 		buyersGain = sum([v[0]*(v[1]-price) for v in virtualBuyers])
-		virtualSellers = sorted(virtualSellers, key=itemgetter(1), reverse=False)   # sort virtual-sellers in ascending order
+		virtualSellers = vickreyCandidates(virtualSellers, totalUnitsTraded, reverse=False)   # sort virtual-sellers in ascending order, up to the needed losers
 		if (VickreyTradeWithExogeneousPrice.LOG):
 			print("virtualSellers",virtualSellers)
 		(winners,losers) = winningAndLosingTraders(virtualSellers, totalUnitsTraded)
@@ -237,16 +429,19 @@ def VickreyTradeWithExogeneousPrice(traders:list, price:float)->tuple:
 			print("\tlosers",losers)
 			print("\tunitsPerWinner",unitsPerWinner)
 			print("\tbuyers gain",buyersGain)
+		units = unitsPerPosition(virtualBuyers, buyerPositions, len(isBuyer)) + unitsPerPosition(winners, sellerPositions, len(isBuyer))
+		payments = paymentsAtPrice(isBuyer, units, price).tolist()   # a Vickrey payment might not fit in their array
 		managerGain = 0
 		for winnerIndex,winnerUnits in unitsPerWinner.items():  # calculate the payment per winners
 			payment = winnerPayment(winnerIndex,winnerUnits,losers)
 			managerGain += (price*winnerUnits - payment)
+			payments[sellerPositions[winnerIndex]] = -payment
 		totalGain = buyersGain + sum([v[0]*(price-v[1]) for v in winners])
 
 	else:    # sellers are short
 		totalUnitsTraded = totalSupply
 		sellersGain = sum([v[0]*(price-v[1]) for v in virtualSellers])
-		virtualBuyers = sorted(virtualBuyers, key=itemgetter(1), reverse=True)   # sort virtual-buyers in descending order
+		virtualBuyers = vickreyCandidates(virtualBuyers, totalUnitsTraded, reverse=True)   # sort virtual-buyers in descending order, up to the needed losers
 		if (VickreyTradeWithExogeneousPrice.LOG):
 			print("virtualBuyers",virtualBuyers)
 		(winners,losers) = winningAndLosingTraders(virtualBuyers, totalUnitsTraded)
@@ -257,27 +452,36 @@ def VickreyTradeWithExogeneousPrice(traders:list, price:float)->tuple:
 			print("\tlosers",losers)
 			print("\tunitsPerWinner",unitsPerWinner)
 			print("\tsellers gain",sellersGain)
+		units = unitsPerPosition(virtualSellers, sellerPositions, len(isBuyer)) + unitsPerPosition(winners, buyerPositions, len(isBuyer))
+		payments = paymentsAtPrice(isBuyer, units, price).tolist()
 		managerGain = 0
 		for winnerIndex,winnerUnits in unitsPerWinner.items():  # calculate the payment per winners
 			payment = winnerPayment(winnerIndex,winnerUnits,losers)
 			managerGain += (payment - price*winnerUnits)
+			payments[buyerPositions[winnerIndex]] = payment
 		totalGain = sellersGain + sum([v[0]*(v[1]-price) for v in winners])
 
 	tradersGain = totalGain - managerGain
-	return (totalUnitsTraded, tradersGain, managerGain, totalGain)
+	return Allocation((totalUnitsTraded, tradersGain, managerGain, totalGain), isBuyer, units, payments)
 VickreyTradeWithExogeneousPrice.LOG = False
 
 
 
 #### Implementation of mechanisms
 
-def MUDA(traders:list, Lottery=True, Vickrey=False) -> (int,float):
+def MUDA(traders:list, Lottery=True, Vickrey=False, backend:str=None, rng:np.random.Generator=None) -> (int,float):
 	"""
 	Run the Multi-Item-Double-Auction mechanism.
 	INPUT: a list of Trader objects, each of which represents valuations with decreasing marginal returns.
 		* Lottery - handle excess demand/supply using a lottery.
 		* Vickrey - handle excess demand/supply using a Vickrey auction.
-	OUTPUT: (totalUnitsTraded, tradersGain, totalGain)
+		* backend - "python", or "numba" for the JIT-compiled loops of jit_backend, with the same outputs
+		  (if numba is not installed, "python" is used), or "approximate" for approximate prices of the two halves.
+		  Default: see walrasianEquilibrium.
+		* rng - a numpy random Generator for the partition and the lottery (default: the global random module).
+		  With a Generator, the outcome depends only on its state, so seeded runs can be replayed in any process.
+	OUTPUT: a MUDAOutcome - a tuple with (totalUnitsTraded, tradersGain, totalGain) for each of the variants,
+	        whose attributes 'lottery' and 'vickrey' are the Allocations of the traders (in the order of the input list).
 
 	>>> b1 = Trader.Buyer([[5,250]])
 	>>> b2 = Trader.Buyer([[4,150],[3,350]])
@@ -285,37 +489,63 @@ def MUDA(traders:list, Lottery=True, Vickrey=False) -> (int,float):
 	>>> s2 = Trader.Seller([[4,100],[3,300]])
 	>>> MUDA.LOG = randomTradeWithExogeneousPrice.LOG = False
 	>>> random.seed(7)
-	>>> MUDA([b1,b2,s1,s2], Lottery=True, Vickrey=True)
+	>>> outcome = MUDA([b1,b2,s1,s2], Lottery=True, Vickrey=True)
+	>>> outcome
+	(4, 900, 900, 4, 750, 900)
+	>>> outcome.vickrey.units.tolist(), outcome.vickrey.payments.tolist()
+	([1, 3, 0, 4], [200, 750, 0, -800])
+	>>> random.seed(7)
+	>>> MUDA([b1,b2,s1,s2], Lottery=True, Vickrey=True, backend="numba")
 	(4, 900, 900, 4, 750, 900)
+	>>> random.seed(1)   # beyond int64, in Python integers
+	>>> outcome = MUDA([Trader.Buyer([[3,10**20]]), Trader.Seller([[2,10**19]]), Trader.Buyer([[3,10**20+5]]), Trader.Seller([[2,7]])], Vickrey=True)
+	>>> outcome[:2], outcome.vickrey.payments.tolist()
+	((2, 180000000000000000010), [0, -200000000000000000000, 200000000000000000000, 0])
+	>>> MUDA([b1,b2,s1,s2], Lottery=True, Vickrey=True, rng=np.random.default_rng(1))
+	(4, 600, 600, 4, 750, 900)
+	>>> MUDA([b1,b2,s1,s2], Lottery=True, Vickrey=True, backend="numba", rng=np.random.default_rng(1))
+	(4, 600, 600, 4, 750, 900)
 	"""
-	(tradersLeft,tradersRight) = randomPartition(traders)
-	priceLeft  = walrasianEquilibrium(tradersLeft)[0]
-	priceRight = walrasianEquilibrium(tradersRight)[0]
+	(positionsLeft,positionsRight) = randomPartition(range(len(traders)), rng)
+	tradersLeft  = [traders[i] for i in positionsLeft]
+	tradersRight = [traders[i] for i in positionsRight]
+	if resolveBackend(backend)=="numba":
+		(marketLeft, marketRight) = (VirtualTraderArrays(tradersLeft), VirtualTraderArrays(tradersRight))
+		(randomTrade, VickreyTrade) = (jit_backend.randomTradeWithExogeneousPrice, jit_backend.VickreyTradeWithExogeneousPrice)
+	if resolveBackend(backend)!="numba" or not (marketLeft.fitsInt64() and marketRight.fitsInt64()):
+		(marketLeft, marketRight) = (tradersLeft, tradersRight)
+		(randomTrade, VickreyTrade) = (randomTradeWithExogeneousPrice, VickreyTradeWithExogeneousPrice)
+	priceLeft  = walrasianEquilibrium(marketLeft, backend)[0]
+	priceRight = walrasianEquilibrium(marketRight, backend)[0]
 	result = ()
+	lottery = vickrey = None
 	if Lottery:
 		if MUDA.LOG:
 			print ("Left sub-market: pR=", priceRight, "traders=",tradersLeft)
-		(sizeLeft, gainLeft) = randomTradeWithExogeneousPrice(tradersLeft, priceRight)
+		allocationLeft = (sizeLeft, gainLeft) = randomTrade(marketLeft, priceRight, rng)
 		if MUDA.LOG:
 			print ("Right sub-market: pL=", priceLeft, "traders=",tradersRight)
-		(sizeRight, gainRight) = randomTradeWithExogeneousPrice(tradersRight, priceLeft)
+		allocationRight = (sizeRight, gainRight) = randomTrade(marketRight, priceLeft, rng)
 		result += (sizeRight+sizeLeft, gainRight+gainLeft, gainRight+gainLeft)
+		lottery = Allocation.combine(result[-3:], len(traders), [(positionsLeft,allocationLeft), (positionsRight,allocationRight)])
 	if Vickrey:
-		(sizeLeft, tradersGainLeft, managerGainLeft, totalGainLeft) = VickreyTradeWithExogeneousPrice(tradersLeft, priceRight)
-		(sizeRight, tradersGainRight, managerGainRight, totalGainRight) = VickreyTradeWithExogeneousPrice(tradersRight, priceLeft)
+		allocationLeft = (sizeLeft, tradersGainLeft, managerGainLeft, totalGainLeft) = VickreyTrade(marketLeft, priceRight)
+		allocationRight = (sizeRight, tradersGainRight, managerGainRight, totalGainRight) = VickreyTrade(marketRight, priceLeft)
 		result += (sizeRight+sizeLeft, tradersGainRight+tradersGainLeft, totalGainRight+totalGainLeft)
+		vickrey = Allocation.combine(result[-3:], len(traders), [(positionsLeft,allocationLeft), (positionsRight,allocationRight)])
 	if MUDA.LOG:
 		print(result)
-	return result
+	return MUDAOutcome(result, lottery, vickrey)
 MUDA.LOG = False
 
-def WALRAS(traders:list) -> (int, int, int, float):
+def WALRAS(traders:list, backend:str=None) -> (int, int, int, float):
 	"""
 	Run the Walrasian-equilibrium mechanism.
 	INPUT: a list of Trader objects, each of which represents valuations with decreasing marginal returns.
+	       backend - "python", "numba", "approximate" or "ticks" (see walrasianEquilibrium).
 	OUTPUT: (numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade)
 	"""
-	(price, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade) = walrasianEquilibrium(traders)
+	(price, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade) = walrasianEquilibrium(traders, backend)
 	return (numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade)
 
 
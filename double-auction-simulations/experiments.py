@@ -0,0 +1,307 @@
+#!python3
+
+"""
+An experiment runner: runs a sweep of simulations that is described in a spec file (JSON or YAML), instead of a hard-coded main program.
+
+A spec is an experiment (or a list of experiments), e.g.:
+
+	{
+		"name": "random-traders-10units-250noise",
+		"generator": "random",
+		"parameters": {
+			"numOfAuctions": 100,
+			"numOfTraders": [200, 400, 600],
+			"minNumOfUnitsPerTrader": 1,
+			"maxNumOfUnitsPerTrader": 10,
+			"meanValue": 500,
+			"maxNoiseSize": 250
+		},
+		"bins": {"xColumn": "Total traders", "numOfBins": 20}
+	}
+
+Each parameter is a value or a list of values; the experiment has a point for each combination of values (the cartesian product).
+The results of each point are written to results/<name>/<point>.csv, and points whose file exists are skipped,
+so a sweep can be extended or resumed. At the end, the results of all points are combined to results/<name>.csv,
+and its bins (see results_aggregation) are written to results/<name>.csv.bins.
+The "queue" executor runs the sweep on any number of nodes: it splits the points into shards
+(a shard per point of a random experiment, and a shard per symbol of each point of a TORQ experiment),
+and puts them in a work queue in results/<name>.queue (see work_queue), from which the workers on this node and on other nodes take them.
+The results of the shards of each point are merged when all of them are done.
+If the parameters include a "seed", the auctions are reproducible, and the results of each auction are kept
+in a ResultStore in results/store, so auctions that were simulated in any experiment
+(e.g. the same numOfTraders in another sweep) are not simulated again.
+
+Usage: python experiments.py <spec-file> [--executor serial|pool|chunked|queue] [--workers N] [--chunk-size K] [--timeout T] [--dry-run]
+       python experiments.py --join results/<name>.queue [--timeout T]     (a worker on another node, in the same working directory)
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import socket
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+from random_datasets import randomAuctions, DEFAULT_MEMORY_LIMIT
+from result_store import ResultStore, SeededAuction
+from simulations import sampleAuctions, simulateAuctions
+import torq_datasets_read as torq
+from work_queue import WorkQueue, runQueue, runWorker, DEFAULT_TIMEOUT
+
+EXECUTORS = ("serial", "pool", "chunked", "queue")
+RESULTS_DIRECTORY = "results"
+
+
+def simulateRandomPoint(resultsFilename:str, numOfAuctions:int, numOfTraders:int, minNumOfUnitsPerTrader:int, maxNumOfUnitsPerTrader:int,
+	meanValue:float, maxNoiseSize:float, fixedNumOfVirtualTraders:bool=False, streamingThreshold:int=None, memoryLimit:int=DEFAULT_MEMORY_LIMIT, seed:int=None):
+	"""
+	Simulate numOfAuctions random auctions (see random_datasets.randomAuctions).
+	"""
+	simulateAuctions(randomAuctions(numOfAuctions, [numOfTraders], minNumOfUnitsPerTrader, [maxNumOfUnitsPerTrader], meanValue, [maxNoiseSize],
+		fixedNumOfVirtualTraders=fixedNumOfVirtualTraders, streamingThreshold=streamingThreshold, memoryLimit=memoryLimit, seed=seed),
+		resultsFilename, keyColumns=("numOfTraders","minNumOfUnitsPerTrader","maxNumOfUnitsPerTrader","maxNoiseSize"),
+		store=ResultStore(os.path.join(RESULTS_DIRECTORY, "store")) if seed is not None else None)
+
+
+def simulateTorqPoint(resultsFilename:str, filename:str, agentNum:int, combineByOrderDate:bool=False, seed:int=None, symbol:str=None):
+	"""
+	Simulate an auction of agentNum traders sampled from the orders of each symbol in a TORQ dataset (as in simulations.torqSimulateBySymbol).
+	seed - if given, the auction of each symbol is a SeededAuction, whose sample and mechanisms use random Generators spawned from the seed
+	       and the index of the symbol, so they do not depend on the other symbols; its results are kept in the ResultStore in results/store,
+	       keyed by the modification time of the dataset too.
+	symbol - if given, only the auction of this symbol is simulated (a shard of the point).
+	"""
+	datasetFilename = "datasets/"+filename+".CSV"
+	if seed is None:
+		auctions = sampleAuctions([agentNum], torq.auctionsBySymbol(datasetFilename, combineByOrderDate, lazy=True))
+	else:
+		arrays = torq.TorqArrays.open(datasetFilename)
+		auctions = [((s,), SeededAuction("torq", torq.sampledAuctionOfSymbol, dict(filename=datasetFilename, combineByOrderDate=combineByOrderDate, symbol=s, agentNum=agentNum,
+				modificationTime=arrays.modificationTime), seed, i))   # the results of a modified dataset are not taken from the store
+			for (i,s) in enumerate(arrays.symbols)]
+	if symbol is not None:
+		auctions = [(auctionID,auction) for (auctionID,auction) in auctions if auctionID[0]==symbol]
+	simulateAuctions(auctions, resultsFilename, keyColumns=("symbol",),
+		store=ResultStore(os.path.join(RESULTS_DIRECTORY, "store")) if seed is not None else None)
+
+
+def torqShards(point:dict)->list:
+	"""
+	The shards of a point of a TORQ experiment: a shard per symbol.
+	"""
+	return [{"symbol": symbol} for symbol in torq.TorqArrays.open("datasets/"+point["filename"]+".CSV").symbols]
+
+
+GENERATORS = {
+	"random": simulateRandomPoint,
+	"torq": simulateTorqPoint,
+}
+
+SHARDS = {   # generator -> a function that returns the shards of a point (by default, the point is a single shard)
+	"torq": torqShards,
+}
+
+
+def loadSpec(specFilename:str)->list:
+	"""
+	Read a spec file. YAML specs require the (optional) yaml package.
+	OUTPUT: a list of experiments.
+	"""
+	with open(specFilename) as file:
+		if specFilename.endswith((".yaml",".yml")):
+			import yaml
+			spec = yaml.safe_load(file)
+		else:
+			spec = json.load(file)
+	return spec if isinstance(spec, list) else [spec]
+
+
+def parameterPoints(parameters:dict)->list:
+	"""
+	OUTPUT: the cartesian product of the parameter values, as a list of dicts.
+
+	>>> parameterPoints({"numOfTraders": [10,20], "meanValue": 500, "maxNoiseSize": [50,100]})
+	[{'numOfTraders': 10, 'meanValue': 500, 'maxNoiseSize': 50}, {'numOfTraders': 10, 'meanValue': 500, 'maxNoiseSize': 100}, {'numOfTraders': 20, 'meanValue': 500, 'maxNoiseSize': 50}, {'numOfTraders': 20, 'meanValue': 500, 'maxNoiseSize': 100}]
+	"""
+	names = list(parameters.keys())
+	values = [value if isinstance(value, list) else [value] for value in parameters.values()]
+	return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def pointFilename(name:str, point:dict)->str:
+	"""
+	The results file of a single point of an experiment; it depends on all the parameters of the point,
+	so a point whose parameters did not change has the same file.
+
+	>>> pointFilename("random-traders", {"numOfTraders": 10, "meanValue": 500})
+	'results/random-traders/meanValue=500,numOfTraders=10.csv'
+	"""
+	key = ",".join("{}={}".format(parameter, point[parameter]) for parameter in sorted(point))
+	return os.path.join(RESULTS_DIRECTORY, name, key+".csv")
+
+
+def planExperiment(experiment:dict)->list:
+	"""
+	OUTPUT: a list of (point, resultsFilename, done) for the points of the experiment, where done is True if the results already exist.
+	"""
+	if experiment["generator"] not in GENERATORS:
+		raise ValueError("generator should be one of {}, not {}".format(tuple(GENERATORS), experiment["generator"]))
+	plan = []
+	for point in parameterPoints(experiment["parameters"]):
+		resultsFilename = pointFilename(experiment["name"], point)
+		plan.append((point, resultsFilename, os.path.exists(resultsFilename)))
+	return plan
+
+
+def _simulatePoint(task:tuple):
+	(generator, point, resultsFilename) = task
+	GENERATORS[generator](resultsFilename, **point)
+	return resultsFilename
+
+
+def shardFilename(resultsFilename:str, shard:dict)->str:
+	"""
+	The results file of a shard of a point.
+
+	>>> shardFilename('results/torq/agentNum=10.csv', {"symbol": "AC "})
+	'results/torq/agentNum=10/symbol=AC%20.csv'
+	>>> shardFilename('results/random/numOfTraders=10.csv', {})
+	'results/random/numOfTraders=10.csv'
+	"""
+	if not shard:
+		return resultsFilename
+	key = ",".join("{}={}".format(parameter, quote(str(shard[parameter]), safe='')) for parameter in sorted(shard))
+	return os.path.join(resultsFilename[:-len(".csv")], key+".csv")
+
+
+def planShards(experiment:dict, plan:list)->list:
+	"""
+	OUTPUT: a list of (resultsFilename, shardFilenames) for the points of the plan that are not done,
+	        and a list of queue tasks for their shards that are not done.
+	"""
+	shardsOf = SHARDS.get(experiment["generator"], lambda point: [{}])
+	(points, tasks) = ([], [])
+	for (point, resultsFilename, done) in plan:
+		if done:
+			continue
+		shards = shardsOf(point)
+		points.append((resultsFilename, [shardFilename(resultsFilename, shard) for shard in shards]))
+		for shard in shards:
+			if not os.path.exists(shardFilename(resultsFilename, shard)):
+				tasks.append({"generator": experiment["generator"], "point": point, "shard": shard, "resultsFilename": shardFilename(resultsFilename, shard)})
+	return (points, tasks)
+
+
+def _simulateShard(task:dict):
+	"""
+	Simulate a shard into a file of this process, and rename it to the results file of the shard,
+	so a shard that was requeued and run by two workers at once is written in full by one of them.
+	"""
+	resultsFilename = task["resultsFilename"]
+	if os.path.exists(resultsFilename):   # it was requeued after its worker had finished it
+		return
+	os.makedirs(os.path.dirname(resultsFilename), exist_ok=True)
+	partFilename = "{}.{}-{}.part".format(resultsFilename, socket.gethostname(), os.getpid())
+	GENERATORS[task["generator"]](partFilename, **task["point"], **task["shard"])
+	os.replace(partFilename, resultsFilename)
+
+
+def mergeShards(points:list):
+	"""
+	Merge the results of the shards of each point to the results file of the point.
+	"""
+	import pandas as pd
+	for (resultsFilename, shardFilenames) in points:
+		if shardFilenames!=[resultsFilename]:
+			results = pd.concat([pd.read_csv(filename, index_col=0) for filename in shardFilenames], ignore_index=True)
+			results.to_csv(resultsFilename)
+
+
+def combineResults(experiment:dict, plan:list)->str:
+	"""
+	Combine the results of all points of the experiment to a single results file, and write its bins if the experiment has "bins".
+	OUTPUT: the name of the combined file.
+	"""
+	import pandas as pd
+	from results_aggregation import binnedResults
+	combinedFilename = os.path.join(RESULTS_DIRECTORY, experiment["name"]+".csv")
+	results = pd.concat([pd.read_csv(resultsFilename, index_col=0) for (point, resultsFilename, done) in plan], ignore_index=True)
+	results.to_csv(combinedFilename)
+	if "bins" in experiment:
+		bins = experiment["bins"]
+		binnedResults(combinedFilename, bins["xColumn"], bins.get("numOfBins"))
+	return combinedFilename
+
+
+def runExperiment(experiment:dict, executor:str="serial", numOfWorkers:int=None, chunkSize:int=1, dryRun:bool=False, timeout:float=DEFAULT_TIMEOUT):
+	"""
+	Simulate the points of the experiment whose results do not exist yet, and combine the results.
+	executor - "serial" simulates the points one after the other in this process;
+	           "pool" simulates each point in a worker process;
+	           "chunked" sends the points to the worker processes in chunks of chunkSize (less overhead for many small points);
+	           "queue" puts the shards of the points in a work queue, and runs numOfWorkers local workers
+	                   (0 means that only workers on other nodes, started with --join, run the shards).
+	                   A shard whose worker does not send a heartbeat for timeout seconds is requeued.
+	                   If the queue exists (e.g. the coordinator was restarted), its shards are kept, and its failed shards are retried.
+	"""
+	if executor not in EXECUTORS:
+		raise ValueError("executor should be one of {}, not {}".format(EXECUTORS, executor))
+	plan = planExperiment(experiment)
+	tasks = [(experiment["generator"], point, resultsFilename) for (point, resultsFilename, done) in plan if not done]
+	print("Experiment {}: {} points, {} done, {} to simulate".format(experiment["name"], len(plan), len(plan)-len(tasks), len(tasks)))
+	if dryRun:
+		for (generator, point, resultsFilename) in tasks:
+			print("\t{}".format(resultsFilename))
+		return None
+	os.makedirs(os.path.join(RESULTS_DIRECTORY, experiment["name"]), exist_ok=True)
+	if executor=="queue":
+		(points, shardTasks) = planShards(experiment, plan)
+		queueDirectory = os.path.join(RESULTS_DIRECTORY, experiment["name"]+".queue")
+		queue = WorkQueue(queueDirectory)   # a queue of a previous coordinator is kept, so the workers that run its shards keep their claims
+		retried = queue.retryFailed()
+		queued = {task["resultsFilename"] for task in queue.tasks()}
+		shardTasks = [task for task in shardTasks if task["resultsFilename"] not in queued]
+		queue.put(shardTasks)
+		print("Queue {}: {} new shards, {} queued shards, {} retried".format(queueDirectory, len(shardTasks), len(queued), retried))
+		failed = runQueue(queueDirectory, _simulateShard, numOfWorkers, timeout)
+		if failed:
+			raise RuntimeError("{} shards failed: {}".format(len(failed), failed))
+		mergeShards(points)
+		shutil.rmtree(queueDirectory)
+	elif executor=="serial":
+		for task in tasks:
+			_simulatePoint(task)
+	elif tasks:
+		with ProcessPoolExecutor(max_workers=numOfWorkers) as pool:
+			for resultsFilename in pool.map(_simulatePoint, tasks, chunksize=chunkSize if executor=="chunked" else 1):
+				print("Done: {}".format(resultsFilename))
+	return combineResults(experiment, plan)
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Run the simulations of the experiments in a spec file.")
+	parser.add_argument("spec", nargs="?", help="a JSON or YAML file with an experiment or a list of experiments")
+	parser.add_argument("--executor", choices=EXECUTORS, default="serial")
+	parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: the number of CPUs)")
+	parser.add_argument("--chunk-size", type=int, default=1, help="number of points per task of the chunked executor")
+	parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds without a heartbeat after which a shard of the queue executor is requeued")
+	parser.add_argument("--join", metavar="QUEUE", help="run a worker of the queue in the given directory, instead of an experiment")
+	parser.add_argument("--dry-run", action="store_true", help="only print the points that would be simulated")
+	args = parser.parse_args(args)
+	if args.join is not None:
+		print("Done {} shards".format(runWorker(args.join, _simulateShard, args.timeout)))
+		return
+	if args.spec is None:
+		parser.error("either a spec file or --join is required")
+	for experiment in loadSpec(args.spec):
+		runExperiment(experiment, args.executor, args.workers, args.chunk_size, args.dry_run, args.timeout)
+
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,382 @@
+#!python3
+
+"""
+A JIT-compiled backend for the inner loops of the mechanisms in doubleauction.
+
+The virtual traders are kept in flat numpy arrays, and the scalar loops of walrasianEquilibrium,
+winningAndLosingTraders, unitsByIndex and winnerPayment run as kernels compiled by numba.
+The kernels follow the loops of the pure-Python mechanisms step by step (including the order of additions),
+so both backends return the same outputs.
+numba is imported, and each kernel is compiled, only on the first call of the kernel (i.e, on the first use of the "numba" backend),
+so importing this module (e.g, through doubleauction) is fast.
+If numba is not installed, JIT_AVAILABLE is False, and doubleauction falls back to the pure-Python mechanisms
+(the kernels can still run as plain Python, which is useful only for testing them).
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import functools
+import importlib.util
+import math
+import os
+import random
+import numpy as np
+
+from allocations import Allocation, paymentsAtPrice
+from markets import equilibriumBand, equilibriumGain, exactArray, fitsInt64, vickreyOrder
+
+JIT_AVAILABLE = importlib.util.find_spec("numba") is not None   # without importing it
+
+
+def jit(function):
+	"""
+	A decorator of a kernel, which is compiled by numba on its first call (or runs as plain Python, if numba is not installed).
+	"""
+	compiled = None
+	@functools.wraps(function)
+	def kernel(*args):
+		nonlocal compiled
+		if compiled is None:
+			if JIT_AVAILABLE:
+				import numba
+				compiled = numba.njit(cache=True)(function)
+			else:
+				compiled = function
+		return compiled(*args)
+	return kernel
+
+BACKENDS = ("python", "numba", "approximate", "ticks")   # "approximate" and "ticks": other engines of doubleauction.walrasianEquilibrium
+DEFAULT_BACKEND = os.environ.get("DOUBLE_AUCTION_BACKEND", "python")   # e.g, to run all doctests with the JIT
+
+
+def resolveBackend(backend:str=None)->str:
+	"""
+	INPUT: the name of a backend, or None for DEFAULT_BACKEND.
+	OUTPUT: the backend that will actually be used - "python" if the JIT is not available.
+
+	>>> resolveBackend("python")
+	'python'
+	>>> resolveBackend("numba") == ("numba" if JIT_AVAILABLE else "python")
+	True
+	"""
+	if backend is None:
+		backend = DEFAULT_BACKEND
+	if backend not in BACKENDS:
+		raise ValueError("backend should be one of {}, not {}".format(BACKENDS, backend))
+	if backend=="numba" and not JIT_AVAILABLE:
+		return "python"
+	return backend
+
+
+def _native(number):
+	return number.item() if isinstance(number, np.generic) else number
+
+
+class VirtualTraderArrays:
+	"""
+	The virtual traders of a list of traders, in flat arrays:
+	the valuations of each trader in his own order, and the traders in the order of the list.
+
+	>>> from traders import Trader
+	>>> arrays = VirtualTraderArrays([Trader.Buyer([[5,250]]), Trader.Seller([[4,100],[3,300]])])
+	>>> arrays.owners.tolist(), arrays.quantities.tolist(), arrays.values.tolist(), arrays.isBuyer.tolist()
+	([0, 1, 1], [5, 4, 3], [250, 100, 300], [True, False, False])
+	"""
+
+	def __init__(self, traders:list):
+		traders = list(traders)
+		self.numOfTraders = len(traders)
+		self.isTraderBuyer = np.array([t.isBuyer for t in traders], dtype=bool)
+		sizes = np.array([len(t.valuations) for t in traders], dtype=np.int64)
+		self.owners = np.repeat(np.arange(self.numOfTraders), sizes)
+		self.quantities = exactArray([v[0] for t in traders for v in t.valuations])   # Python integers if they do not fit in int64
+		self.values = exactArray([v[1] for t in traders for v in t.valuations])
+		self.isBuyer = self.isTraderBuyer[self.owners]
+
+	def fitsInt64(self)->bool:
+		"""
+		OUTPUT: True if the kernels can accumulate the quantities and gains of these traders in int64 without overflow
+		        (otherwise, use the python path, which accumulates them in Python integers).
+
+		>>> from traders import Trader
+		>>> VirtualTraderArrays([Trader.Buyer([[10**20,50]]), Trader.Seller([[10**20,10]])]).fitsInt64()
+		False
+		>>> VirtualTraderArrays([Trader.Buyer([[10**20,0.5]]), Trader.Seller([[3,10**20]])]).fitsInt64()
+		False
+		"""
+		if self.quantities.dtype.kind not in "iub" or self.values.dtype.kind=="O":   # Python integers beyond int64
+			return False
+		return self.values.dtype.kind not in "iub" or fitsInt64(self.quantities, self.values)
+
+	def side(self, isBuyer:bool)->np.ndarray:
+		"""
+		OUTPUT: the indices of the virtual traders of the given side, in their original order.
+		"""
+		return np.flatnonzero(self.isBuyer==isBuyer)
+
+
+
+### Kernels ###
+
+@jit
+def _walrasianEquilibriumKernel(buyerQuantities, buyerValues, sellerQuantities, sellerValues, demand, numOfBuyers, supply, numOfSellers):
+	"""
+	The loop of walrasianEquilibrium, on virtual buyers and sellers sorted by ascending value (they are popped from the end),
+	starting from the given demand and number of buyers (above them), and supply and number of sellers (below them).
+	OUTPUT: (priceSide, priceIndex, numOfBuyers, numOfSellers, totalUnitsTraded),
+	        where priceSide is 0 if the price is infinite, 1 if it is the value of buyer priceIndex, 2 if of seller priceIndex.
+	"""
+	b = len(buyerQuantities)-1
+	s = len(sellerQuantities)-1
+	priceSide = 0
+	priceIndex = -1
+	for i in range(len(sellerQuantities)):
+		supply += sellerQuantities[i]
+	numOfSellers += len(sellerQuantities)
+	totalUnitsTraded = demand
+	while demand < supply:
+		if b>=0 and (s<0 or buyerValues[b] >= sellerValues[s]):  # a buyer enters the room
+			numOfBuyers += 1
+			(priceSide, priceIndex) = (1, b)
+			currentDemand = buyerQuantities[b]
+			if demand+currentDemand > supply:
+				units = supply-demand
+			else:
+				units = currentDemand
+			demand += units
+			totalUnitsTraded += units
+			b -= 1
+		else:  # a seller exits the room
+			(priceSide, priceIndex) = (2, s)
+			currentSupply = sellerQuantities[s]
+			if demand > supply-currentSupply:
+				units = supply-demand
+			else:
+				units = currentSupply
+				numOfSellers -= 1
+			supply -= units
+			s -= 1
+	return (priceSide, priceIndex, numOfBuyers, numOfSellers, totalUnitsTraded)
+
+
+@jit
+def _gainKernel(quantities, values, price, isBuyer):
+	"""
+	The gain of the given virtual traders in the given price, summed in their order.
+	"""
+	gain = 0
+	for i in range(len(quantities)):
+		if quantities[i]==0:   # not a winner
+			continue
+		if isBuyer:
+			gain += quantities[i]*(values[i]-price)
+		else:
+			gain += quantities[i]*(price-values[i])
+	return gain
+
+
+@jit
+def _winningUnitsKernel(quantities, quota):
+	"""
+	The loop of winningAndLosingTraders: the winners are selected from the beginning, until the quota is filled.
+	OUTPUT: the number of winning units of each virtual trader (the rest of its units are losing).
+	"""
+	winning = np.zeros(len(quantities), dtype=np.int64)
+	for i in range(len(quantities)):
+		if quota >= quantities[i]:
+			winning[i] = quantities[i]
+			quota -= quantities[i]
+		elif quota > 0:
+			winning[i] = quota
+			quota = 0
+	return winning
+
+
+@jit
+def _vickreyKernel(quantities, values, owners, winning, price, isBuyer, paymentPerWinner):
+	"""
+	The loops of unitsByIndex and winnerPayment, for virtual traders sorted as in VickreyTradeWithExogeneousPrice.
+	paymentPerWinner - an array of zeros with an entry per owner, in the dtype of the values, into which the payments are written.
+	OUTPUT: (winnersGain, managerGain, unitsPerWinner, paymentPerWinner), where the last two are arrays with an entry per owner.
+	"""
+	winnersGain = 0
+	for i in range(len(quantities)):
+		if winning[i] > 0:
+			if isBuyer:
+				winnersGain += winning[i]*(values[i]-price)
+			else:
+				winnersGain += winning[i]*(price-values[i])
+
+	# unitsByIndex - the winners are kept in the order of their first appearance:
+	numOfOwners = len(paymentPerWinner)
+	unitsPerWinner = np.zeros(numOfOwners, dtype=np.int64)
+	winnerOrder = np.empty(numOfOwners, dtype=np.int64)
+	numOfWinners = 0
+	for i in range(len(quantities)):
+		if winning[i] > 0:
+			if unitsPerWinner[owners[i]]==0:
+				winnerOrder[numOfWinners] = owners[i]
+				numOfWinners += 1
+			unitsPerWinner[owners[i]] += winning[i]
+
+	# winnerPayment - the losers are the losing units in order, followed by the reserve agent:
+	managerGain = 0
+	for w in range(numOfWinners):
+		winnerIndex = winnerOrder[w]
+		winnerUnits = unitsPerWinner[winnerIndex]
+		totalWinnerUnits = winnerUnits
+		payment = 0
+		paid = False
+		for i in range(len(quantities)):
+			loserUnits = quantities[i]-winning[i]
+			if loserUnits==0 or owners[i]==winnerIndex:
+				continue
+			if winnerUnits >= loserUnits:
+				payment += loserUnits*values[i]
+				winnerUnits -= loserUnits
+			else:
+				payment += winnerUnits*values[i]
+				paid = True
+				break
+		if not paid:   # the reserve agent
+			payment += winnerUnits*price
+		paymentPerWinner[winnerIndex] = payment
+		if isBuyer:
+			managerGain += (payment - price*totalWinnerUnits)
+		else:
+			managerGain += (price*totalWinnerUnits - payment)
+	return (winnersGain, managerGain, unitsPerWinner, paymentPerWinner)
+
+
+
+### Mechanisms on arrays ###
+
+def walrasianEquilibrium(arrays:VirtualTraderArrays)->tuple:
+	"""
+	The same as doubleauction.walrasianEquilibrium.
+
+	>>> from traders import Trader
+	>>> b1 = Trader.Buyer([[5,250]])
+	>>> b2 = Trader.Buyer([[4,150],[3,350]])
+	>>> s1 = Trader.Seller([[5,200]])
+	>>> s2 = Trader.Seller([[4,100],[3,300]])
+	>>> walrasianEquilibrium(VirtualTraderArrays([b1,b2,s1,s2]))
+	(200, 2, 2, 8, 1100)
+	>>> walrasianEquilibrium(VirtualTraderArrays([b1]))
+	(inf, 0, 0, 0, 0)
+	"""
+	buyers = arrays.side(True)
+	sellers = arrays.side(False)
+	band = equilibriumBand(arrays.quantities[buyers], arrays.values[buyers], arrays.quantities[sellers], arrays.values[sellers])
+	(demand, numOfBuyers, supply, numOfSellers) = (0, 0, 0, 0)
+	if band is not None:   # as in doubleauction.walrasianEquilibrium
+		(buyers, sellers, demand, numOfBuyers, supply, numOfSellers) = (buyers[band[0]], sellers[band[1]], *band[2:])
+	buyers = buyers[np.argsort(arrays.values[buyers], kind='stable')]     # last buyer has highest value
+	sellers = sellers[np.argsort(arrays.values[sellers], kind='stable')]  # last seller has highest value
+	(priceSide, priceIndex, numOfBuyers, numOfSellers, totalUnitsTraded) = _walrasianEquilibriumKernel(
+		arrays.quantities[buyers], arrays.values[buyers], arrays.quantities[sellers], arrays.values[sellers], demand, numOfBuyers, supply, numOfSellers)
+	price = math.inf if priceSide==0 else arrays.values[(buyers if priceSide==1 else sellers)[priceIndex]].item()
+	totalUnitsTraded = _native(totalUnitsTraded)
+	gain = equilibriumGain(arrays.quantities, arrays.values, arrays.isBuyer, price, totalUnitsTraded)   # as in doubleauction.walrasianEquilibrium
+	return (price, _native(numOfBuyers), _native(numOfSellers), totalUnitsTraded, gain)
+
+
+def _unitsPerOwner(arrays:VirtualTraderArrays, indices:np.ndarray, units:np.ndarray)->np.ndarray:
+	return np.bincount(arrays.owners[indices], weights=units, minlength=arrays.numOfTraders).astype(np.int64)
+
+
+def _active(arrays:VirtualTraderArrays, price:float)->tuple:
+	"""
+	OUTPUT: the indices of the active virtual buyers and sellers in the given price, in their original order.
+	"""
+	active = np.where(arrays.isBuyer, arrays.values>price, arrays.values<price)
+	return (np.flatnonzero(active & arrays.isBuyer), np.flatnonzero(active & ~arrays.isBuyer))
+
+
+def _shuffledOrder(arrays:VirtualTraderArrays, indices:np.ndarray, isBuyer:bool, rng:np.random.Generator=None)->np.ndarray:
+	"""
+	Reorder the given virtual traders by a random permutation of the traders of their side, as doubleauction.shuffled does in
+	randomTradeWithExogeneousPrice (with the same consumption of random numbers), keeping the order of the valuations of each trader.
+	"""
+	traderIndices = np.flatnonzero(arrays.isTraderBuyer==isBuyer)
+	if rng is None:
+		permutation = list(range(len(traderIndices)))
+		random.shuffle(permutation)
+	else:
+		permutation = rng.permutation(len(traderIndices))
+	rank = np.zeros(arrays.numOfTraders, dtype=np.int64)
+	rank[traderIndices[permutation]] = np.arange(len(traderIndices))
+	return indices[np.argsort(rank[arrays.owners[indices]], kind='stable')]
+
+
+def randomTradeWithExogeneousPrice(arrays:VirtualTraderArrays, price:float, rng:np.random.Generator=None)->tuple:
+	"""
+	The same as doubleauction.randomTradeWithExogeneousPrice, including the random permutations.
+
+	>>> from traders import Trader
+	>>> b1 = Trader.Buyer([[5,250]])
+	>>> b2 = Trader.Buyer([[4,150],[3,350]])
+	>>> s1 = Trader.Seller([[5,200]])
+	>>> s2 = Trader.Seller([[4,100],[3,300]])
+	>>> random.seed(2)
+	>>> [randomTradeWithExogeneousPrice(VirtualTraderArrays([b1,b2,s1,s2]),price) for price in (51,101,151,201)]
+	[(0, 0), (4, 800), (4, 900), (8, 1100)]
+	"""
+	(buyers, sellers) = _active(arrays, price)
+	buyers = _shuffledOrder(arrays, buyers, True, rng)
+	sellers = _shuffledOrder(arrays, sellers, False, rng)
+	totalDemand = _native(arrays.quantities[buyers].sum())
+	totalSupply = _native(arrays.quantities[sellers].sum())
+	if totalDemand < totalSupply:    # buyers are short
+		(short, long, totalUnitsTraded, isLongBuyer) = (buyers, sellers, totalDemand, False)
+	else:    # sellers are short
+		(short, long, totalUnitsTraded, isLongBuyer) = (sellers, buyers, totalSupply, True)
+	shortGain = _gainKernel(arrays.quantities[short], arrays.values[short], price, not isLongBuyer)
+	winning = _winningUnitsKernel(arrays.quantities[long], totalUnitsTraded)
+	longGain = _gainKernel(winning, arrays.values[long], price, isLongBuyer)
+	units = _unitsPerOwner(arrays, short, arrays.quantities[short]) + _unitsPerOwner(arrays, long, winning)
+	return Allocation((totalUnitsTraded, _native(shortGain+longGain)), arrays.isTraderBuyer, units, paymentsAtPrice(arrays.isTraderBuyer, units, price))
+
+
+def VickreyTradeWithExogeneousPrice(arrays:VirtualTraderArrays, price:float)->tuple:
+	"""
+	The same as doubleauction.VickreyTradeWithExogeneousPrice.
+
+	>>> from traders import Trader
+	>>> b1 = Trader.Buyer([[5,250]])
+	>>> b2 = Trader.Buyer([[4,150],[3,350]])
+	>>> s1 = Trader.Seller([[5,200]])
+	>>> s2 = Trader.Seller([[4,100],[3,300]])
+	>>> [VickreyTradeWithExogeneousPrice(VirtualTraderArrays([b1,b2,s1,s2]),price) for price in (51,101,151,201)]
+	[(0, 0, 0, 0), (4, 404, 496, 900), (4, 603, 297, 900), (8, 1099, 1, 1100)]
+	"""
+	(buyers, sellers) = _active(arrays, price)
+	totalDemand = _native(arrays.quantities[buyers].sum())
+	totalSupply = _native(arrays.quantities[sellers].sum())
+	if totalDemand < totalSupply:    # buyers are short
+		(short, long, totalUnitsTraded, isLongBuyer) = (buyers, sellers, totalDemand, False)
+		keys = arrays.values[long]    # sort virtual-sellers in ascending order
+	else:    # sellers are short
+		(short, long, totalUnitsTraded, isLongBuyer) = (sellers, buyers, totalSupply, True)
+		keys = -arrays.values[long]   # sort virtual-buyers in descending order
+	long = long[vickreyOrder(keys, arrays.quantities[long], arrays.owners[long], totalUnitsTraded)]   # up to the needed losers
+	shortGain = _gainKernel(arrays.quantities[short], arrays.values[short], price, not isLongBuyer)
+	quantities = arrays.quantities[long]
+	winning = _winningUnitsKernel(quantities, totalUnitsTraded)
+	(winnersGain, managerGain, unitsPerWinner, paymentPerWinner) = _vickreyKernel(quantities, arrays.values[long], arrays.owners[long], winning,
+		price, isLongBuyer, np.zeros(arrays.numOfTraders, dtype=arrays.values.dtype))
+	totalGain = shortGain + winnersGain
+	units = _unitsPerOwner(arrays, short, arrays.quantities[short]) + unitsPerWinner
+	payments = paymentsAtPrice(arrays.isTraderBuyer, units, price)
+	winners = unitsPerWinner>0
+	payments[winners] = paymentPerWinner[winners] if isLongBuyer else -paymentPerWinner[winners]
+	return Allocation((totalUnitsTraded, _native(totalGain - managerGain), _native(managerGain), _native(totalGain)),
+		arrays.isTraderBuyer, units, payments)
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
@@ -8,100 +8,12 @@ Since : 2017-07
 """
 
 import numpy as np
-import pandas as pd
-from pandas import DataFrame
-from pandas.tools import plotting
-import matplotlib.pyplot as plt
 import math
 import os
-import random
 
 from doubleauction import MUDA,WALRAS,walrasianEquilibrium,randomTradeWithExogeneousPrice
-import torq_datasets_read as torq
-from random_datasets import randomAuctions
-
-COLUMNS=(
-	'Total buyers', 'Total sellers', 'Total traders', 'Min total traders', 'Total units', 
-	'Max units per trader', 'Min units per trader', 'Normalized max units per trader', 'stddev',
-	'Optimal buyers', 'Optimal sellers', 'Optimal units',
-	'Optimal gain', 'MUDA-lottery gain', 'MUDA-Vickrey traders gain', 'MUDA-Vickrey total gain')
-
-def replicaAuctions(replicaNums:list, auctions:list):
-	"""
-	INPUT: auctions - list of m auctions;  
-	       replicaNums - list of n integers.
-	OUTPUT: generator of m*n auctions, where in each auction, each agent is replicated i times.
-	"""
-	for auctionID,auctionTraders in auctions:
-		for replicas in replicaNums:
-			traders = replicas * auctionTraders 
-			yield auctionID,traders
-
-def sampleAuctions(agentNums:list, auctions:list):
-	"""
-	INPUT: auctions - list of m auctions;  
-	       agentNums - list of n integers.
-	OUTPUT: generator of m*n auctions, where in each auction, i agents are sampled from the empirical distribution
-	"""
-	for auctionID,auctionTraders in auctions:
-		for agentNum in agentNums:
-			traders = [random.choice(auctionTraders) for i in range(agentNum)]
-			yield auctionID,traders
-
-
-def simulateAuctions(auctions:list, resultsFilename:str, keyColumns:list):
-	"""
-	Simulate the auctions in the given generator.
-	"""
-	columns = keyColumns+COLUMNS
-	results = DataFrame(columns=columns)
-	print("\t{}".format(columns))
-	resultsFilenameTemp = resultsFilename+".temp"
-	for auctionID,traders in auctions:
-		if not traders:
-			raise ValueError("traders for auction {} is empty", auctionID)
-		print("Simulating auction {} with {} traders".format(auctionID,len(traders)))
-		totalBuyers = sum([t.isBuyer for t in traders])
-		totalSellers = len(traders)-totalBuyers
-		unitsPerTrader = [t.totalUnits() for t in traders]
-		maxUnitsPerTrader = max(unitsPerTrader)
-		minUnitsPerTrader = min(unitsPerTrader)
-		stddev = np.sqrt(sum([t.totalUnits()**2 for t in traders]))
-		(buyersWALRAS, sellersWALRAS, sizeWALRAS, gainWALRAS) = WALRAS(traders)
-		(sizeMUDALottery, gainMUDALottery, gainMUDALottery, sizeMUDAVickrey, tradersGainMUDAVickrey, totalGainMUDAVickrey) = MUDA(traders, Lottery=True, Vickrey=True)
-		resultsRow = [
-			*auctionID,
-			totalBuyers, totalSellers, totalBuyers+totalSellers, min(totalBuyers,totalSellers), sum(unitsPerTrader),
-			maxUnitsPerTrader, minUnitsPerTrader, maxUnitsPerTrader/max(1,minUnitsPerTrader), stddev,
-			buyersWALRAS, sellersWALRAS, sizeWALRAS,
-			gainWALRAS, gainMUDALottery, tradersGainMUDAVickrey, totalGainMUDAVickrey]
-		print("\t{}".format(resultsRow))
-		results.loc[len(results)] = resultsRow
-		results.to_csv(resultsFilenameTemp)
-	results.to_csv(resultsFilename)
-	os.remove(resultsFilenameTemp)
-	return results
-
-def torqSimulationBySymbolDate(filename, combineByOrderDate=False, replicaNums=[1]):
-	"""
-	Treat each (symbol,date) combination as a separate auction.
-	"""
-	datasetFilename = "datasets/"+filename+".CSV"
-	resultsFilename = "results/"+filename+("-combined" if combineByOrderDate else "")+"-x"+str(max(replicaNums))+".csv" 
-	return simulateAuctions(replicaAuctions(replicaNums,
-		torq.auctionsBySymbolDate(datasetFilename, combineByOrderDate)),
-		resultsFilename, keyColumns=("symbol","date"))
-
-def torqSimulateBySymbol(filename, combineByOrderDate=False, agentNums=[100]):
-	"""
-	Treat all bidders for the same symbol, in ALL dates, as a distribution of values for that symbol.
-	"""
-	datasetFilename = "datasets/"+filename+".CSV"
-	resultsFilename = "results/"+filename+("-combined" if combineByOrderDate else "")+"-s"+str(max(agentNums))+".csv" 
-	return simulateAuctions(sampleAuctions(agentNums,
-		torq.auctionsBySymbol(datasetFilename, combineByOrderDate)),
-		resultsFilename, keyColumns=("symbol",))
-
+from experiments import loadSpec, runExperiment
+from simulations import COLUMNS, replicaAuctions, sampleAuctions, torqSimulationBySymbolDate
 
 ### PLOTS ###
 
@@ -136,27 +48,15 @@ def plotTorq(filename, resultsFilename=None, combineByOrderDate=False, replicaNu
 
 
 def plotResults(resultsFilename=None, xColumn='Min total traders', numOfBins=10, ax=None, title=None):
+	import matplotlib.pyplot as plt
+	from results_aggregation import binnedResults
 	if not ax:
 		ax = plt.subplot(1, 1, 1)
 	if not title:
 		title = resultsFilename
 	print("plotting",resultsFilename)
 
-	results = pd.read_csv(resultsFilename)
-	results['Optimal market size'] = (results['Optimal buyers']+results['Optimal sellers']) / 2
-	results['Normalized market size'] = results['Optimal units'] / (results['Max units per trader'])
-	results['log10(M)'] = np.log(results['Max units per trader'])/np.log(10)
-	print(len(results), " auctions")
-	results = results[results['Optimal gain']>0]
-	print(len(results), " auctions with positive optimal gain")
-	
-	for field in ['MUDA-lottery', 'MUDA-Vickrey traders', 'MUDA-Vickrey total']:
-		results[field+' ratio'] = results[field+' gain'] / results['Optimal gain']
-		
-	if numOfBins:
-		results_bins = results.groupby(pd.cut(results[xColumn],numOfBins)).mean()
-	else:
-		results_bins = results.groupby(results[xColumn]).mean()
+	results_bins = binnedResults(resultsFilename, xColumn, numOfBins)
 	
 	results_bins.plot(x=xColumn, y='MUDA-Vickrey total ratio', style=['b^-'], ax=ax, markersize=markerSize)
 	results_bins.plot(x=xColumn, y='MUDA-Vickrey traders ratio', style=['gv-'], ax=ax, markersize=markerSize)
@@ -175,15 +75,21 @@ def plotResults(resultsFilename=None, xColumn='Min total traders', numOfBins=10,
 
 MUDA.LOG = randomTradeWithExogeneousPrice.LOG = False
 
+def simulateSpec(specFilename, **parameters):
+	"""
+	Simulate the experiments in the given spec file (see experiments.py), with the given parameters instead of those in the spec.
+	"""
+	for experiment in loadSpec(specFilename):
+		experiment["parameters"].update(parameters)
+		runExperiment(experiment)
+
 def torqSimulation():
+	import matplotlib.pyplot as plt
 	numOfBins = 100
 	numOfTraderss=list(range(10,1000,10))*1
 	filename = "901101-910131-SOD" #"910121-910121-IBM-SOD" #  "901101-910131-SOD" #   "901101-910131- SOD-NORM" # 
-	if createResults:
-		torqSimulateBySymbol(filename, combineByOrderDate=True, agentNums=numOfTraderss)
-		torqSimulateBySymbol(filename, combineByOrderDate=False, agentNums=numOfTraderss)
-		#torqSimulateBySymbol(filename+"-NORM", combineByOrderDate=False, agentNums=numOfTraderss)
-		#torqSimulateBySymbol(filename+"-NORM", combineByOrderDate=True, agentNums=numOfTraderss)
+	if createResults:   # the results files are those of the experiments in the spec
+		simulateSpec("specs/AAAI18-torq.json")
 	#plotTorq(filename=filename, combineByOrderDate=False, agentNums=numOfTraderss, numOfBins=numOfBins)
 	# plotTorq(filename=filename, combineByOrderDate=True, agentNums=numOfTraderss, numOfBins=numOfBins,
 	# 		ax = plt.subplot(1,1,1), title="Auctions based on TORQ database", xColumn="Optimal units")
@@ -215,7 +121,8 @@ def torqSimulation():
 	# 		ax = plt.subplot(2,1,2))
 	# plt.show()
 
-def randomSimulation(numOfAuctions = 100):
+def randomSimulation(numOfAuctions = 100, streamingThreshold = 1000000, memoryLimit = 8*2**30):
+	import matplotlib.pyplot as plt
 	numOfTraderss = range(2000000, 42000000, 2000000)
 	minNumOfUnitsPerTrader = 10
 	maxNumOfUnitsPerTraders = [100,1000,10000,1000000,10000000,100000000,100000]
@@ -227,42 +134,14 @@ def randomSimulation(numOfAuctions = 100):
 	filenameTraders = "results/random-traders-{}units-{}noise.csv".format(maxNumOfUnitsPerTraders[-1],maxNoiseSizes[-1])
 	filenameUnitsFixedTraders   = "results/random-units-{}traders-{}noise.csv".format(numOfTraderss[-1],maxNoiseSizes[-1])
 	filenameUnitsFixedVirtual   = "results/random-units-{}virtual-{}noise.csv".format(numOfTraderss[-1],maxNoiseSizes[-1])
-	filenameNoise   = "results/random-noise-{}traders-{}units.csv".format(numOfTraderss[-1],maxNumOfUnitsPerTraders[3])
+	filenameNoise   = "results/random-noise-{}traders-{}units.csv".format(numOfTraderss[-1],maxNumOfUnitsPerTraders[-1])
 	
 	# additive
 	filenameTradersAdd = "results/random-traders-{}units-{}noise-additive.csv".format(maxNumOfUnitsPerTraders[3],maxNoiseSizes[-1])
 	filenameUnitsAdd   = "results/random-units-{}traders-{}noise-additive.csv".format(numOfTraderss[-1],maxNoiseSizes[-1])
 	filenameNoiseAdd   = "results/random-noise-{}traders-{}units-additive.csv".format(numOfTraderss[-1],maxNumOfUnitsPerTraders[3])
-	if createResults:
-		keyColumns=("numOfTraders","minNumOfUnitsPerTrader","maxNumOfUnitsPerTrader","maxNoiseSize")
-
-		### non-additive
-		simulateAuctions(randomAuctions(     ### as function of #traders
-			numOfAuctions, numOfTraderss, minNumOfUnitsPerTrader, maxNumOfUnitsPerTraders[-1:], meanValue, maxNoiseSizes[-1:], fixedNumOfVirtualTraders=True),
-			filenameTraders, keyColumns=keyColumns)
-		simulateAuctions(randomAuctions(     ### as function of m - fixed total units
-			numOfAuctions, numOfTraderss[-1:], minNumOfUnitsPerTrader, maxNumOfUnitsPerTraders, meanValue, maxNoiseSizes[-1:], fixedNumOfVirtualTraders=True),
-			filenameUnitsFixedVirtual, keyColumns=keyColumns)
-		# simulateAuctions(randomAuctions(   ### as function of m - fixed total traders - TOO LONG
-		# 	numOfAuctions, [100], minNumOfUnitsPerTrader, maxNumOfUnitsPerTraders, meanValue, maxNoiseSizes[-1:], fixedNumOfVirtualTraders=False),
-		# 	filenameUnitsFixedTraders, keyColumns=keyColumns)
-		simulateAuctions(randomAuctions(     ### as function of noise
-			numOfAuctions, numOfTraderss[-1:], minNumOfUnitsPerTrader, maxNumOfUnitsPerTraders[-1:], meanValue, maxNoiseSizes, fixedNumOfVirtualTraders=True),
-			filenameNoise, keyColumns=keyColumns)
-
-		### additive
-		# simulateAuctions(randomAuctions(  ### as function of #traders
-		# 	numOfAuctions, numOfTraderss, maxNumOfUnitsPerTraders[3], maxNumOfUnitsPerTraders[-1:], meanValue, maxNoiseSizes[-1:], fixedNumOfVirtualTraders=True),
-		# 	filenameTradersAdd, keyColumns=keyColumns)
-		# # simulateAuctions(randomAuctions(   ### as function of m - fixed total units
-		# # 	numOfAuctions, numOfTraderss[-1:], maxNumOfUnitsPerTraders, meanValue, maxNoiseSizes[-1:],isAdditive=True, fixedNumOfVirtualTraders=True),
-		# # 	filenameUnitsAdd, keyColumns=keyColumns)
-		# simulateAuctions(randomAuctions(    ### as function of noise
-		# 	numOfAuctions, numOfTraderss[-1:],  maxNumOfUnitsPerTraders[3], maxNumOfUnitsPerTraders[-1:], meanValue, maxNoiseSizes, fixedNumOfVirtualTraders=True),
-		# 	filenameNoiseAdd, keyColumns=keyColumns)
-		# # simulateAuctions(randomAuctions(   ### as function of m - fixed total traders
-		# # 	numOfAuctions, [100], maxNumOfUnitsPerTraders, meanValue, maxNoiseSizes[-1:], isAdditive=True, fixedNumOfVirtualTraders=False),
-		# # 	filenameUnitsFixedTraders, keyColumns=keyColumns)
+	if createResults:   # the results files are those of the experiments in the spec
+		simulateSpec("specs/AAAI18-submission.json", numOfAuctions=numOfAuctions, streamingThreshold=streamingThreshold, memoryLimit=memoryLimit)
 
 	TITLESTART = ""# "Uniform; "
 	### non-additive
@@ -316,5 +195,6 @@ def randomSimulation(numOfAuctions = 100):
 
 createResults = False # True # 
 
-torqSimulation()
-randomSimulation(numOfAuctions = 10)
+if __name__ == "__main__":
+	torqSimulation()
+	randomSimulation(numOfAuctions = 10)
@@ -0,0 +1,707 @@
+#!python3
+
+"""
+Defines a class Market - a columnar (numpy-array) representation of a single-good multi-unit market.
+
+The virtual traders (bundles of units with the same marginal value) of all traders are kept in flat arrays,
+sorted once in the order in which walrasianEquilibrium processes them.
+Random samples of the traders are represented by multiplicities over the same arrays,
+so sampling a market copies neither the traders nor their valuations.
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import copy
+import math
+import numpy as np
+from collections import defaultdict
+from operator import mul
+
+INT64_BOUND = 2**62   # sums whose bound is below it cannot overflow int64 (with a margin for the rounding of the bound)
+
+
+def fitsInt64(quantities:np.ndarray, values:np.ndarray)->bool:
+	"""
+	OUTPUT: True if any sum of products quantities[i]*values[i] (e.g, a gain) surely fits in int64.
+	        The bound is calculated in floating point, so it cannot overflow itself.
+
+	>>> fitsInt64(np.array([5, 3]), np.array([250, 100]))
+	True
+	>>> fitsInt64(np.array([999999999, 10**8]), np.array([10**10, 7]))
+	False
+	"""
+	if len(quantities)==0:
+		return True
+	return bool(np.abs(quantities).sum(dtype=float) * max(1.0, float(np.abs(values).max())) < INT64_BOUND)
+
+
+def exactArray(numbers)->np.ndarray:
+	"""
+	An array of the given Python numbers, in int64 or float64 if they fit, and otherwise in an object array of Python integers,
+	which exactDotProduct sums exactly (numpy would keep integers beyond int64 in uint64, which becomes float64 when mixed with int64).
+
+	>>> exactArray([5, 3]).dtype, exactArray([2.5, 3]).dtype, exactArray([10**20, 3]).dtype, exactArray([2**63]).dtype, exactArray([]).dtype
+	(dtype('int64'), dtype('float64'), dtype('O'), dtype('O'), dtype('int64'))
+	"""
+	if len(numbers)==0:
+		return np.zeros(0, dtype=np.int64)
+	array = np.array(numbers)
+	if array.dtype.kind=="u":
+		return np.array(numbers, dtype=object)
+	return array
+
+
+def exactDotProduct(quantities:np.ndarray, values:np.ndarray):
+	"""
+	The sum of quantities[i]*values[i] (e.g, the total value of some virtual traders), without overflow or order-dependent rounding:
+	integer values are summed in int64 if it cannot overflow (see fitsInt64), and in Python integers otherwise
+	(also quantities or values that are already Python integers beyond int64, in an object array);
+	float values are summed by math.fsum, so the sum of the products is correctly rounded, whatever the order of the virtual traders.
+	OUTPUT: a Python int or float.
+
+	>>> exactDotProduct(np.array([999999999, 3]), np.array([10**10, 7]))   # overflows int64
+	9999999990000000021
+	>>> exactDotProduct(np.array([1, 1, 1]), np.array([1e16, 1.0, -1e16]))
+	1.0
+	>>> exactDotProduct(np.array([3, 2]), np.array([10**20, -1]))
+	299999999999999999998
+	>>> exactDotProduct(exactArray([10**20, 1]), np.array([40, -1]))
+	3999999999999999999999
+	"""
+	if len(values)==0:
+		return 0
+	if values.dtype.kind in "iub" and quantities.dtype.kind in "iub":
+		if fitsInt64(quantities, values):
+			return int(np.dot(quantities.astype(np.int64), values.astype(np.int64)))
+		return sum(map(mul, quantities.tolist(), values.tolist()))
+	if "O" in (values.dtype.kind, quantities.dtype.kind) and all(isinstance(number, (int, np.integer)) for number in values.tolist()+quantities.tolist()):
+		return sum(map(mul, quantities.tolist(), values.tolist()))
+	return math.fsum((quantities*values).tolist())
+
+
+def exactSum(quantities:np.ndarray)->int:
+	"""
+	The sum of the given numbers, without overflow or order-dependent rounding (see exactDotProduct).
+
+	>>> exactSum(np.array([2**62, 2**62])), exactSum(np.zeros(0, dtype=np.int64))
+	(9223372036854775808, 0)
+	"""
+	return exactDotProduct(quantities, np.ones(len(quantities), dtype=np.int64))
+
+
+def equilibriumGain(quantities:np.ndarray, values:np.ndarray, isBuyer:np.ndarray, price:float, totalUnitsTraded:int):
+	"""
+	The gain from trade at a Walrasian equilibrium with the given price and number of units traded,
+	in a market with the given virtual traders (in any order).
+	The buyers above the price and the sellers below it trade all their units, and the rest of the trade is at the price itself,
+	so the gain does not depend on the order of the virtual traders, nor on which of the ties at the price trade.
+	It is summed in a single exactDotProduct, so all the engines of the equilibrium give exactly the same gain.
+
+	>>> equilibriumGain(np.array([5,4,3,5,4,3]), np.array([250,150,350,200,100,300]), np.array([True,True,True,False,False,False]), 200, 8)
+	1100
+	>>> equilibriumGain(np.array([1,1]), np.array([0.1,0.3]), np.array([True,False]), math.inf, 0)
+	0
+	>>> equilibriumGain(np.array([4*10**18, 4*10**18, 8*10**18]), np.array([50, 40, 10]), np.array([True,True,False]), 40, 8*10**18)
+	280000000000000000000
+	"""
+	if totalUnitsTraded==0:
+		return 0
+	buyers = isBuyer & (values>price)
+	sellers = ~isBuyer & (values<price)
+	(buyerQuantities, sellerQuantities) = (quantities[buyers], quantities[sellers])
+	unitsAtPrice = exactArray([totalUnitsTraded-exactSum(buyerQuantities), totalUnitsTraded-exactSum(sellerQuantities)])
+	return exactDotProduct(np.concatenate((buyerQuantities, sellerQuantities, unitsAtPrice)),
+		np.concatenate((values[buyers], -values[sellers], [price, -price])))
+
+
+BAND_CUTOFF = 1024        # below this number of virtual traders, equilibriumBand does not look for a band (see walrasianEquilibrium)
+BAND_SAMPLE_SIZE = 512    # the number of virtual traders of each side in the sample that estimates the band
+BAND_MARGIN = 48          # the number of sampled values on each side of the estimated price that the band includes
+
+def equilibriumBand(buyerQuantities:np.ndarray, buyerValues:np.ndarray, sellerQuantities:np.ndarray, sellerValues:np.ndarray)->tuple:
+	"""
+	Find a narrow band of values around the equilibrium price, so that walrasianEquilibrium sorts and scans only the virtual traders in it.
+	In the order of walrasianEquilibrium (descending value, a buyer before a seller with the same value), the crossing is in the band if:
+	(a) the demand of the buyers above the band is less than the supply of the sellers that are not above it,
+	    so all the virtual traders above the band pass before the crossing - the buyers enter and the sellers exit, fully; and
+	(b) the demand of the buyers that are not below the band reaches the supply of the sellers below it,
+	    so the crossing comes before any virtual trader below the band - the buyers below it never enter, and the sellers below it remain.
+	The band is estimated around the equilibrium price of a sample (with a fixed seed), and (a) and (b) are checked on all the virtual traders;
+	a side of the band that fails its check is unbounded. So the band changes only the running time, never the equilibrium.
+
+	INPUT: the quantities and values of the virtual buyers and of the virtual sellers, in any order.
+	OUTPUT: None if nothing can be pruned (a small market, an empty side, or a band that is unbounded on both sides); otherwise
+	        (buyers, sellers, demand, numOfBuyers, supply, numOfSellers) - the indices of the virtual buyers and sellers in the band (in ascending order),
+	        the units and number of the virtual buyers above the band, and the units and number of the virtual sellers below it.
+
+	>>> rng = np.random.default_rng(1)
+	>>> (buyerQuantities, sellerQuantities) = (rng.integers(1, 6, size=5000), rng.integers(1, 6, size=5000))
+	>>> (buyerValues, sellerValues) = (rng.uniform(50, 150, size=5000), rng.uniform(50, 150, size=5000))
+	>>> (buyers, sellers, demand, numOfBuyers, supply, numOfSellers) = equilibriumBand(buyerQuantities, buyerValues, sellerQuantities, sellerValues)
+	>>> int(buyerQuantities[buyers].sum()+sellerQuantities[sellers].sum()) < int(buyerQuantities.sum()+sellerQuantities.sum())/2   # a minority of the units
+	True
+	>>> float(buyerValues[buyers].min()) < 100 < float(buyerValues[buyers].max())
+	True
+
+	walrasianEquilibrium, which sorts only the virtual traders in the band, finds the same equilibrium as a sort of all of them:
+
+	>>> from doubleauction import Trader, walrasianEquilibrium
+	>>> traders = [Trader.Buyer([[q,v]]) for (q,v) in zip(buyerQuantities.tolist(), buyerValues.tolist())]
+	>>> traders += [Trader.Seller([[q,v]]) for (q,v) in zip(sellerQuantities.tolist(), sellerValues.tolist())]
+	>>> (quantities, values) = (np.concatenate((buyerQuantities, sellerQuantities)), np.concatenate((buyerValues, sellerValues)))
+	>>> isBuyer = np.arange(10000) < 5000
+	>>> order = np.lexsort((~isBuyer, -values))
+	>>> walrasianEquilibrium(traders) == equilibriumOfSortedUnits(quantities[order], values[order], isBuyer[order])
+	True
+	>>> equilibriumBand(buyerQuantities[:100], buyerValues[:100], sellerQuantities[:100], sellerValues[:100]) is None
+	True
+	"""
+	(numOfVirtualBuyers, numOfVirtualSellers) = (len(buyerValues), len(sellerValues))
+	if numOfVirtualBuyers+numOfVirtualSellers < BAND_CUTOFF or numOfVirtualBuyers==0 or numOfVirtualSellers==0:
+		return None
+	if not fitsInt64(np.concatenate((buyerQuantities, sellerQuantities)), np.array([BAND_SAMPLE_SIZE*(numOfVirtualBuyers+numOfVirtualSellers)])):
+		return None   # the sums of the (scaled) units might overflow int64
+	rng = np.random.default_rng(0)
+	(sampledBuyers, sampledSellers) = (rng.integers(numOfVirtualBuyers, size=BAND_SAMPLE_SIZE), rng.integers(numOfVirtualSellers, size=BAND_SAMPLE_SIZE))
+	values = np.concatenate((buyerValues[sampledBuyers], sellerValues[sampledSellers]))
+	quantities = np.concatenate((buyerQuantities[sampledBuyers]*numOfVirtualBuyers, sellerQuantities[sampledSellers]*numOfVirtualSellers))   # scaled to their sides
+	isBuyer = np.arange(len(values)) < BAND_SAMPLE_SIZE
+	order = np.lexsort((~isBuyer, -values))
+	price = equilibriumOfSortedUnits(quantities[order], values[order], isBuyer[order])[0]
+	if price==math.inf:
+		return None
+	values = np.sort(values)
+	position = int(np.searchsorted(values, price))
+	(low, high) = (values[max(0, position-BAND_MARGIN)], values[min(len(values)-1, position+BAND_MARGIN)])
+
+	aboveBuyers = buyerValues > high
+	if not buyerQuantities[aboveBuyers].sum() < sellerQuantities[sellerValues <= high].sum():   # (a)
+		(high, aboveBuyers) = (math.inf, np.zeros(numOfVirtualBuyers, dtype=bool))
+	belowSellers = sellerValues < low
+	if not buyerQuantities[buyerValues >= low].sum() >= sellerQuantities[belowSellers].sum():   # (b)
+		(low, belowSellers) = (-math.inf, np.zeros(numOfVirtualSellers, dtype=bool))
+	if low==-math.inf and high==math.inf:
+		return None
+	buyers = np.flatnonzero((buyerValues >= low) & ~aboveBuyers)
+	sellers = np.flatnonzero((sellerValues <= high) & ~belowSellers)
+	return (buyers, sellers, int(buyerQuantities[aboveBuyers].sum()), int(aboveBuyers.sum()),
+		int(sellerQuantities[belowSellers].sum()), int(belowSellers.sum()))
+
+
+class Market:
+	"""
+	A sequence of Trader objects, backed by flat arrays of their virtual traders.
+	The arrays are in int64, so a market whose total units or integer values do not fit in it raises OverflowError
+	(its list of traders can be used instead, as the mechanisms accumulate Python integers).
+
+	Iterating over a Market yields the Trader objects, so it can be passed to any function that expects a list of traders.
+
+	>>> from traders import Trader
+	>>> b1 = Trader.Buyer([[5,250]])
+	>>> b2 = Trader.Buyer([[4,150],[3,350]])
+	>>> s1 = Trader.Seller([[5,200]])
+	>>> s2 = Trader.Seller([[4,100],[3,300]])
+	>>> market = Market([b1,b2,s1,s2])
+	>>> len(market)
+	4
+	>>> market.values.tolist()
+	[350, 300, 250, 200, 150, 100]
+	>>> market.walrasianEquilibrium()
+	(200, 2, 2, 8, 1100)
+	>>> Market([Trader.Buyer([[10**20,50]]), Trader.Seller([[10**20,10]])])
+	Traceback (most recent call last):
+	...
+	OverflowError: the units or values of the traders do not fit in int64; use the list of traders instead
+	"""
+
+	def __init__(self, traders:list):
+		self.traders = list(traders)
+		numOfTraders = len(self.traders)
+		self.isTraderBuyer = np.fromiter((t.isBuyer for t in self.traders), dtype=bool, count=numOfTraders)
+		sizes = np.fromiter((len(t.valuations) for t in self.traders), dtype=np.int64, count=numOfTraders)
+		owners = np.repeat(np.arange(numOfTraders), sizes)
+		slots = np.arange(len(owners)) - np.repeat(np.cumsum(sizes)-sizes, sizes)   # index of each valuation within its trader
+		quantities = exactArray([v[0] for t in self.traders for v in t.valuations])
+		values = exactArray([v[1] for t in self.traders for v in t.valuations])
+		if quantities.dtype.kind=="O" or values.dtype.kind=="O" or not fitsInt64(quantities, np.ones(1)):
+			raise OverflowError("the units or values of the traders do not fit in int64; use the list of traders instead")
+		isBuyer = self.isTraderBuyer[owners]
+
+		# walrasianEquilibrium pops the virtual traders of each side from the end of a stable ascending sort,
+		# i.e, by descending value, where ties are broken by descending position:
+		buyerIndices  = np.flatnonzero(isBuyer)
+		sellerIndices = np.flatnonzero(~isBuyer)
+		buyerIndices  = buyerIndices [np.argsort(values[buyerIndices],  kind='stable')[::-1]]
+		sellerIndices = sellerIndices[np.argsort(values[sellerIndices], kind='stable')[::-1]]
+		# ... and merges the two sides by descending value, where a buyer enters before a seller with the same value:
+		merged = np.concatenate((buyerIndices, sellerIndices))
+		sides = np.concatenate((np.zeros(len(buyerIndices),dtype=np.int8), np.ones(len(sellerIndices),dtype=np.int8)))
+		merged = merged[np.lexsort((sides, -values[merged]))]
+
+		self.quantities = quantities[merged]
+		self.values     = values[merged]
+		self.owners     = owners[merged]
+		self.slots      = slots[merged]
+		self.isBuyer    = isBuyer[merged]
+		self.indices    = np.arange(numOfTraders)   # the traders in this market, in order
+		self.counts     = None                      # the multiplicity of each trader; None means all ones
+		cumulativeUnits = np.concatenate(([0], np.cumsum(quantities)))
+		self.traderUnits = cumulativeUnits[np.cumsum(sizes)] - cumulativeUnits[np.cumsum(sizes)-sizes]   # the total units of each trader
+
+	def sample(self, indices:np.ndarray):
+		"""
+		INPUT: an array of trader indices, possibly with repetitions.
+		OUTPUT: a Market with the given traders, in the given order.
+		        It shares the arrays of this market, so it is not sorted again.
+
+		>>> from traders import Trader
+		>>> market = Market([Trader.Buyer([(5,250)]), Trader.Buyer([(4,150),(3,350)]), Trader.Seller([(5,200)]), Trader.Seller([(4,100),(3,300)])])
+		>>> sample = market.sample([0,0,2])
+		>>> sample.walrasianEquilibrium()
+		(250, 1, 1, 5, 250)
+		>>> list(sample)
+		[B[(5, 250)], B[(5, 250)], S[(5, 200)]]
+		"""
+		sample = copy.copy(self)   # shallow: the arrays are shared
+		sample.indices = np.asarray(indices, dtype=np.int64)
+		sample.counts = np.bincount(sample.indices, minlength=len(self.traders))
+		return sample
+
+	def traderArrays(self)->tuple:
+		"""
+		OUTPUT: (isTraderBuyer, unitsPerTrader) - arrays with an entry per trader of this market (or sample), in order.
+
+		>>> from traders import Trader
+		>>> market = Market([Trader.Buyer([(5,250)]), Trader.Buyer([(4,150),(3,350)]), Trader.Seller([(5,200)])])
+		>>> [array.tolist() for array in market.sample([1,1,2]).traderArrays()]
+		[[True, True, False], [7, 7, 5]]
+		"""
+		return (self.isTraderBuyer[self.indices], self.traderUnits[self.indices])
+
+	def __len__(self):
+		return len(self.indices)
+
+	def __iter__(self):
+		traders = self.traders
+		return (traders[i] for i in self.indices)
+
+	def __getitem__(self, i):
+		return self.traders[self.indices[i]]
+
+	def __repr__(self):
+		return list(self).__repr__()
+
+	def walrasianEquilibrium(self)->tuple:
+		"""
+		Calculate a Walrasian equilibrium in O(n) time, using the pre-sorted arrays.
+		OUTPUT: (equilibriumPrice, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade) - the same as doubleauction.walrasianEquilibrium.
+		The gains are exact even when they overflow int64 (see exactDotProduct):
+
+		>>> from traders import Trader
+		>>> Market([Trader.Buyer([(10**9,10**10)]), Trader.Buyer([(10**9,10**10)]), Trader.Seller([(10**9,1)]), Trader.Seller([(10**9,2)])]).walrasianEquilibrium()
+		(10000000000, 2, 2, 2000000000, 19999999997000000000)
+		"""
+		if self.counts is None:
+			return equilibriumOfSortedUnits(self.quantities, self.values, self.isBuyer)
+		else:
+			return equilibriumOfSortedUnits(self.quantities, self.values, self.isBuyer, self.counts[self.owners], self._sampleOrder)
+
+	def _sampleOrder(self, entries:np.ndarray)->list:
+		"""
+		INPUT: indices of virtual traders with the same value and side.
+		OUTPUT: a list with an entry per copy of these virtual traders in the sample,
+		        in the order in which walrasianEquilibrium processes the corresponding list of traders.
+		"""
+		positions = defaultdict(list)   # trader index -> positions in the sample
+		owners = set(self.owners[entries].tolist())
+		for (position,index) in enumerate(self.indices.tolist()):
+			if index in owners:
+				positions[index].append(position)
+		copies = [(position, self.slots[e], e) for e in entries.tolist() for position in positions[self.owners[e]]]
+		copies.sort(reverse=True)   # ties are processed by descending position
+		return [e for (position,slot,e) in copies]
+
+
+
+def equilibriumOfSortedUnits(quantities:np.ndarray, values:np.ndarray, isBuyer:np.ndarray, copies:np.ndarray=None, tieOrder=None)->tuple:
+	"""
+	Calculate a Walrasian equilibrium of virtual traders that are already sorted in the order of Market.
+
+	INPUT: quantities, values, isBuyer - arrays with an entry per virtual trader;
+	       copies - optional array with the number of copies of each virtual trader (default: all ones).
+	       tieOrder - optional function that gets the indices of a block of virtual traders with the same value and side,
+	                  and returns a list with an index per copy, in the order in which they should be processed
+	                  (default: the copies of each virtual trader are processed consecutively, in the array order).
+	OUTPUT: (equilibriumPrice, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade)
+
+	The buyers enter and the sellers exit in the merged order, until the demand reaches the supply;
+	the first virtual trader at which this happens determines the price.
+	The order of virtual traders with the same value affects only the numbers of buyers and sellers.
+
+	>>> import numpy as np
+	>>> equilibriumOfSortedUnits(np.array([5,5]), np.array([250,200]), np.array([True,False]))
+	(250, 1, 1, 5, 250)
+	>>> equilibriumOfSortedUnits(np.array([5,5]), np.array([250,200]), np.array([True,False]), np.array([3,1]))
+	(250, 1, 1, 5, 250)
+	>>> equilibriumOfSortedUnits(np.array([5,5]), np.array([250,200]), np.array([True,False]), np.array([1,3]))
+	(200, 1, 1, 5, 250)
+	"""
+	if copies is None:
+		copies = np.ones(len(quantities), dtype=np.int64)
+		entries = np.arange(len(quantities))
+		totalQuantities = quantities
+	else:
+		entries = np.flatnonzero(copies)
+		(quantities, values, isBuyer, copies) = (quantities[entries], values[entries], isBuyer[entries], copies[entries])
+		totalQuantities = quantities*copies
+	isSeller = ~isBuyer
+	numOfVirtualSellers = int(copies[isSeller].sum())
+	totalSupply = int(totalQuantities[isSeller].sum())
+	if totalSupply <= 0:
+		return (math.inf, 0, numOfVirtualSellers, 0, 0)
+
+	demand = np.cumsum(np.where(isBuyer, totalQuantities, 0))
+	supply = totalSupply - np.cumsum(np.where(isSeller, totalQuantities, 0))
+	k = int(np.argmax(demand >= supply))   # the first virtual trader at which the demand reaches the supply
+	price = values[k].item()
+	start = k   # the first virtual trader in the block of ties that contains k
+	while start>0 and values[start-1]==price and isBuyer[start-1]==isBuyer[k]:
+		start -= 1
+
+	currentDemand = int(demand[start-1]) if start>0 else 0
+	currentSupply = int(supply[start-1]) if start>0 else totalSupply
+	numOfBuyers  = int(copies[:start][isBuyer[:start]].sum())
+	numOfSellers = numOfVirtualSellers - int(copies[:start][isSeller[:start]].sum())
+	gap = currentSupply - currentDemand   # units that the block closes, all at the same price
+	totalUnitsTraded = currentSupply if isBuyer[k] else currentDemand
+
+	# Count the buyers that enter / sellers that exit in the block, until the gap is closed:
+	end = k+1   # the end of the block of ties
+	while end<len(values) and values[end]==price and isBuyer[end]==isBuyer[k]:
+		end += 1
+	if tieOrder is None or (end-start==1 and copies[k]==1):
+		runs = [(i, int(copies[i])) for i in range(start, end)]
+	else:
+		positionInBlock = {e:i for (i,e) in enumerate(entries[start:end].tolist(), start)}
+		runs = [(positionInBlock[e], 1) for e in tieOrder(entries[start:end])]
+	for (i,numOfCopies) in runs:
+		quantity = int(quantities[i])
+		if numOfCopies*quantity < gap:
+			gap -= numOfCopies*quantity
+			if isBuyer[k]: numOfBuyers += numOfCopies
+			else:          numOfSellers -= numOfCopies
+			continue
+		copiesNeeded = -(-gap // quantity)
+		if isBuyer[k]:
+			numOfBuyers += copiesNeeded
+		else:   # the last seller might exit partially, in which case he remains in the market
+			numOfSellers -= copiesNeeded if copiesNeeded*quantity==gap else copiesNeeded-1
+		break
+	return (price, numOfBuyers, numOfSellers, totalUnitsTraded, equilibriumGain(totalQuantities, values, isBuyer, price, totalUnitsTraded))
+
+
+
+class Crossing:
+	"""
+	Finds a Walrasian equilibrium while a stream of virtual traders passes in the order of walrasianEquilibrium
+	(descending value, a buyer before a seller with the same value).
+
+	The stream may start in the middle: the state (demand, remaining supply, values and numbers of traders)
+	describes the virtual traders that passed before it.
+	If mask is given, only the virtual traders whose owners are in the mask are considered.
+
+	>>> crossing = Crossing(numOfVirtualSellers=3, supply=12, sellersValue=2300)   # the market in the doctest of Market
+	>>> crossing.consume(np.array([3,3,5]), np.array([350,300,250]), np.array([1,3,0]), np.array([True,False,True]))
+	>>> crossing.consume(np.array([5,4,4]), np.array([200,150,100]), np.array([2,1,3]), np.array([False,True,False]))
+	>>> crossing.result
+	(200, 2, 2, 8, 1100)
+	"""
+
+	def __init__(self, numOfVirtualSellers:int, supply:int, sellersValue:float, demand:int=0, buyersValue:float=0,
+		numOfBuyers:int=0, numOfSellersExited:int=0, mask:np.ndarray=None):
+		self.mask = mask
+		self.numOfVirtualSellers = numOfVirtualSellers
+		(self.supply, self.sellersValue) = (supply, sellersValue)
+		(self.demand, self.buyersValue) = (demand, buyersValue)
+		(self.numOfBuyers, self.numOfSellersExited) = (numOfBuyers, numOfSellersExited)
+		self.result = (math.inf, 0, self.numOfVirtualSellers, 0, 0) if self.supply<=0 else None
+
+	@property
+	def done(self):
+		return self.result is not None
+
+	def consume(self, quantities, values, owners, isBuyer):
+		if self.mask is not None:
+			inMask = self.mask[owners]
+			(quantities, values, isBuyer) = (quantities[inMask], values[inMask], isBuyer[inMask])
+		demandQuantities = np.where(isBuyer, quantities, 0)
+		supplyQuantities = np.where(isBuyer, 0, quantities)
+		demand = self.demand + np.cumsum(demandQuantities)
+		supply = self.supply - np.cumsum(supplyQuantities)
+		crossed = demand >= supply
+		if not crossed.any():
+			self.demand = int(demand[-1]) if len(demand)>0 else self.demand
+			self.supply = int(supply[-1]) if len(supply)>0 else self.supply
+			self.numOfBuyers += int(isBuyer.sum())
+			self.numOfSellersExited += int((~isBuyer).sum())
+			self.buyersValue += exactDotProduct(demandQuantities, values)
+			self.sellersValue -= exactDotProduct(supplyQuantities, values)
+			return
+		k = int(np.argmax(crossed))
+		previousDemand = int(demand[k-1]) if k>0 else self.demand
+		previousSupply = int(supply[k-1]) if k>0 else self.supply
+		gap = previousSupply - previousDemand
+		price = values[k].item()
+		numOfBuyers = self.numOfBuyers + int(isBuyer[:k].sum())
+		numOfSellers = self.numOfVirtualSellers - self.numOfSellersExited - int((~isBuyer[:k]).sum())
+		buyersValue = self.buyersValue + exactDotProduct(demandQuantities[:k], values[:k])
+		sellersValue = self.sellersValue - exactDotProduct(supplyQuantities[:k], values[:k])
+		if isBuyer[k]:
+			numOfBuyers += 1
+			totalUnitsTraded = previousSupply
+			buyersValue += gap*price
+		else:
+			if previousSupply - int(quantities[k]) == previousDemand:  # a full exit
+				numOfSellers -= 1
+			totalUnitsTraded = previousDemand
+			sellersValue -= gap*price
+		self.result = (price, numOfBuyers, numOfSellers, totalUnitsTraded, buyersValue-sellersValue)
+
+
+
+SELECTION_CUTOFF = 256   # below this number of candidates, selectEquilibrium sorts them
+
+def selectEquilibrium(quantities:np.ndarray, values:np.ndarray, isBuyer:np.ndarray, order:np.ndarray=None, rng:np.random.Generator=None)->tuple:
+	"""
+	Calculate a Walrasian equilibrium of unsorted virtual traders in expected O(n) time, without sorting them.
+
+	Like quickselect, it picks a random pivot value and splits the candidates to those above, at and below it.
+	If the demand of the buyers above the pivot reaches the supply of the sellers that are not above it,
+	the crossing is above the pivot; otherwise, these buyers and sellers pass (as in walrasianEquilibrium),
+	and the search continues at the pivot and below it. Only the last few candidates are sorted.
+
+	INPUT: quantities, values, isBuyer - arrays with an entry per virtual trader, in any order;
+	       order - optional array that breaks ties between virtual traders with the same value and side:
+	               they are processed in ascending order (default: the array order).
+	OUTPUT: (equilibriumPrice, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade) - the same as
+	        equilibriumOfSortedUnits on the sorted virtual traders (the gain is summed by equilibriumGain in both).
+
+	>>> import numpy as np
+	>>> selectEquilibrium(np.array([5,4,3,5,4,3]), np.array([250,150,350,200,100,300]), np.array([True,True,True,False,False,False]))
+	(200, 2, 2, 8, 1100)
+	>>> rng = np.random.default_rng(1)
+	>>> (quantities, values, isBuyer) = (rng.integers(1,5,size=10000), rng.integers(0,100,size=10000), rng.random(10000)<0.5)
+	>>> sortOrder = np.lexsort((np.arange(10000), ~isBuyer, -values))
+	>>> selectEquilibrium(quantities, values, isBuyer) == equilibriumOfSortedUnits(quantities[sortOrder], values[sortOrder], isBuyer[sortOrder])
+	True
+	>>> values = rng.uniform(0, 100, size=10000)
+	>>> sortOrder = np.lexsort((np.arange(10000), ~isBuyer, -values))
+	>>> selectEquilibrium(quantities, values, isBuyer) == equilibriumOfSortedUnits(quantities[sortOrder], values[sortOrder], isBuyer[sortOrder])
+	True
+	"""
+	if order is None:
+		order = np.arange(len(values))
+	if rng is None:
+		rng = np.random.default_rng()
+	market = (quantities, values, isBuyer)
+	isSeller = ~isBuyer
+	crossing = Crossing(int(isSeller.sum()), quantities[isSeller].sum().item(), exactDotProduct(quantities[isSeller], values[isSeller]))
+	while not crossing.done:
+		if len(values) <= SELECTION_CUTOFF:
+			sortOrder = np.lexsort((order, ~isBuyer, -values))
+			crossing.consume(quantities[sortOrder], values[sortOrder], None, isBuyer[sortOrder])
+			break
+		pivot = values[rng.integers(len(values))]
+		above = values>pivot
+		(aboveQuantities, aboveIsBuyer) = (quantities[above], isBuyer[above])
+		if crossing.demand + aboveQuantities[aboveIsBuyer].sum() >= crossing.supply - aboveQuantities[~aboveIsBuyer].sum():
+			(quantities, values, isBuyer, order) = (aboveQuantities, values[above], aboveIsBuyer, order[above])
+			continue
+		crossing.consume(aboveQuantities, values[above], None, aboveIsBuyer)   # in any order, as there is no crossing
+		at = values==pivot
+		(atQuantities, atIsBuyer) = (quantities[at], isBuyer[at])
+		if crossing.demand + atQuantities[atIsBuyer].sum() >= crossing.supply - atQuantities[~atIsBuyer].sum():
+			sortOrder = np.lexsort((order[at], ~atIsBuyer))   # a block of ties
+			crossing.consume(atQuantities[sortOrder], values[at][sortOrder], None, atIsBuyer[sortOrder])
+			break
+		crossing.consume(atQuantities, values[at], None, atIsBuyer)
+		below = values<pivot
+		(quantities, values, isBuyer, order) = (quantities[below], values[below], isBuyer[below], order[below])
+	(price, numOfBuyers, numOfSellers, totalUnitsTraded, gain) = crossing.result   # its gain is summed by blocks, in the order of the pivots
+	return (price, numOfBuyers, numOfSellers, totalUnitsTraded, equilibriumGain(*market, price, totalUnitsTraded))
+
+
+def _coversVickreyPayments(quantities:np.ndarray, owners:np.ndarray, quota:int)->bool:
+	"""
+	INPUT: the quantities and owners of a prefix of the sorted candidates of a Vickrey auction.
+	OUTPUT: True if the prefix fills the quota, and each winner can be paid by the losing units of the other owners in the prefix
+	        (strictly more units than it wins, so the payment loop of winnerPayment ends at a loser in the prefix).
+	"""
+	winning = np.minimum(quantities, np.maximum(0, quota - (np.cumsum(quantities)-quantities)))
+	if winning.sum() < quota:
+		return False
+	losing = quantities-winning
+	(owners, inverse) = np.unique(owners, return_inverse=True)
+	winningPerOwner = np.bincount(inverse, weights=winning, minlength=len(owners))
+	losingPerOwner = np.bincount(inverse, weights=losing, minlength=len(owners))
+	winners = winningPerOwner>0
+	return bool(np.all(losing.sum() - losingPerOwner[winners] > winningPerOwner[winners]))
+
+
+def vickreyOrder(keys:np.ndarray, quantities:np.ndarray, owners:np.ndarray, quota:int)->np.ndarray:
+	"""
+	Select the candidates of a Vickrey auction for quota units, without sorting all of them.
+
+	The winners are the candidates with the smallest keys (e.g, the values of sellers, or minus the values of buyers),
+	and the payment of each winner depends only on the next few losers. So the candidates are selected by a weighted partial selection:
+	np.partition finds a threshold key that leaves about twice the quota units below it, and only the candidates up to the threshold are sorted;
+	if they do not cover the winners and their payments, the number of units is doubled.
+
+	INPUT: keys, quantities, owners - arrays with an entry per candidate (virtual trader); quota - the number of units to win.
+	OUTPUT: a prefix of np.argsort(keys, kind='stable') with the winners and the losers needed by winnerPayment
+	        (the whole order, if all the losers are needed).
+
+	>>> import numpy as np
+	>>> rng = np.random.default_rng(1)
+	>>> (keys, quantities, owners) = (rng.integers(0,1000,size=10000), rng.integers(1,5,size=10000), rng.integers(0,3000,size=10000))
+	>>> order = vickreyOrder(keys, quantities, owners, quota=500)
+	>>> len(order) < 1000, np.array_equal(order, np.argsort(keys, kind='stable')[:len(order)])
+	(True, True)
+	>>> len(vickreyOrder(keys[:10], quantities[:10], owners[:10], quota=5))
+	10
+	"""
+	numOfCandidates = len(keys)
+	if numOfCandidates <= SELECTION_CUTOFF or keys.dtype.kind=="O" or quantities.dtype.kind=="O":
+		return np.argsort(keys, kind='stable')
+	totalUnits = quantities.sum().item()
+	neededUnits = 2*quota   # the winning units, and as many losing units
+	while neededUnits < totalUnits:
+		numOfSelected = min(numOfCandidates, int(neededUnits*numOfCandidates/totalUnits) + SELECTION_CUTOFF)
+		threshold = np.partition(keys, numOfSelected-1)[numOfSelected-1]
+		prefix = np.flatnonzero(keys<=threshold)   # with all the ties of the threshold, in their order
+		prefix = prefix[np.argsort(keys[prefix], kind='stable')]
+		if len(prefix)==numOfCandidates or _coversVickreyPayments(quantities[prefix], owners[prefix], quota):
+			return prefix
+		neededUnits *= 2
+	return np.argsort(keys, kind='stable')
+
+
+
+TICK_SIZE = 1/8   # the tick size of the "ticks" backend: the prices in the (non-normalized) TORQ datasets, and all integers, are its multiples
+TICK_LEVELS_PER_TRADER = 64   # tickEquilibrium refuses markets with more price levels per virtual trader, which are faster to sort
+
+
+def toTicks(values, tickSize:float=1)->np.ndarray:
+	"""
+	Convert values (prices) to a fixed-point representation: integer multiples of tickSize (e.g, 1/8 for the TORQ prices).
+	The conversion is exact: fromTicks returns exactly the same values,
+	and if some value is not a multiple of tickSize (in floating point), a ValueError is raised.
+
+	>>> toTicks([110.25, 102.0, 99.875], tickSize=1/8).tolist()
+	[882, 816, 799]
+	>>> fromTicks(toTicks([110.25, 102.0, 99.875], tickSize=1/8), tickSize=1/8).tolist()
+	[110.25, 102.0, 99.875]
+	>>> toTicks([110.25, 1.1], tickSize=1/8)
+	Traceback (most recent call last):
+	...
+	ValueError: the values are not multiples of the tick size 0.125, e.g, 1.1
+	"""
+	values = np.asarray(values)
+	if len(values)>0 and not np.abs(values).max() < INT64_BOUND*tickSize:
+		raise ValueError("the values do not fit in int64 ticks of size {}".format(tickSize))
+	ticks = np.rint(values/tickSize).astype(np.int64)
+	inexact = fromTicks(ticks, tickSize)!=values
+	if inexact.any():
+		raise ValueError("the values are not multiples of the tick size {}, e.g, {}".format(tickSize, values[inexact][0]))
+	return ticks
+
+
+def fromTicks(ticks, tickSize:float=1):
+	"""
+	The values of the given integer ticks (an array, or an int).
+	With an integer tickSize, the values are integers.
+	"""
+	return ticks*tickSize
+
+
+def tickEquilibrium(quantities:np.ndarray, ticks:np.ndarray, isBuyer:np.ndarray, tickSize:float=1)->tuple:
+	"""
+	Calculate a Walrasian equilibrium of unsorted virtual traders whose values are integer ticks (see toTicks),
+	in O(n+P) time, where P is the number of price levels between the lowest and highest tick.
+	Instead of sorting the virtual traders, their quantities are counted per (price level, side), as in a counting sort,
+	and only the block of ties at the crossing is processed one virtual trader at a time.
+	The values are summed in integer ticks, and converted back only at the end.
+
+	INPUT: quantities, ticks, isBuyer - arrays with an entry per virtual trader, in any order.
+	       Virtual traders with the same value and side are processed by descending position, as in walrasianEquilibrium.
+	OUTPUT: (equilibriumPrice, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade) - the same as equilibriumOfSortedUnits.
+	Raises ValueError if there are more than TICK_LEVELS_PER_TRADER price levels per virtual trader.
+
+	>>> tickEquilibrium(np.array([5,4,3,5,4,3]), toTicks([250,150,350,200,100,300]), np.array([True,True,True,False,False,False]))
+	(200, 2, 2, 8, 1100)
+	>>> rng = np.random.default_rng(1)
+	>>> (quantities, ticks, isBuyer) = (rng.integers(1,5,size=10000), rng.integers(0,800,size=10000), rng.random(10000)<0.5)
+	>>> sortOrder = np.lexsort((-np.arange(10000), ~isBuyer, -ticks))
+	>>> values = fromTicks(ticks, 1/8)
+	>>> tickEquilibrium(quantities, ticks, isBuyer, 1/8) == equilibriumOfSortedUnits(quantities[sortOrder], values[sortOrder], isBuyer[sortOrder])
+	True
+	"""
+	isSeller = ~isBuyer
+	numOfVirtualSellers = int(isSeller.sum())
+	totalSupply = int(quantities[isSeller].sum())
+	if totalSupply <= 0:
+		return (math.inf, 0, numOfVirtualSellers, 0, 0)
+
+	# The blocks are in the order of equilibriumOfSortedUnits: by descending value, where the buyers come before the sellers.
+	maxTick = int(ticks.max())
+	numOfLevels = maxTick-int(ticks.min())+1
+	if numOfLevels > TICK_LEVELS_PER_TRADER*len(ticks):
+		raise ValueError("{} price levels are too many for {} virtual traders".format(numOfLevels, len(ticks)))
+	numOfBlocks = 2*numOfLevels
+	blocks = 2*(maxTick-ticks) + isSeller
+	blockQuantities = np.zeros(numOfBlocks, dtype=np.int64)
+	np.add.at(blockQuantities, blocks, quantities)
+	blockCounts = np.bincount(blocks, minlength=numOfBlocks)
+	blockTicks = maxTick - np.arange(numOfBlocks)//2
+	blockIsBuyer = np.arange(numOfBlocks)%2==0
+
+	demand = np.cumsum(np.where(blockIsBuyer, blockQuantities, 0))
+	supply = totalSupply - np.cumsum(np.where(blockIsBuyer, 0, blockQuantities))
+	k = int(np.argmax(demand >= supply))   # the first block at which the demand reaches the supply
+	priceTick = int(blockTicks[k])
+	currentDemand = int(demand[k-1]) if k>0 else 0
+	currentSupply = int(supply[k-1]) if k>0 else totalSupply
+	(isBuyerBefore, isSellerBefore) = (blockIsBuyer[:k], ~blockIsBuyer[:k])
+	numOfBuyers  = int(blockCounts[:k][isBuyerBefore].sum())
+	numOfSellers = numOfVirtualSellers - int(blockCounts[:k][isSellerBefore].sum())
+	buyersValue  = exactDotProduct(blockQuantities[:k][isBuyerBefore], blockTicks[:k][isBuyerBefore])
+	sellersValue = exactDotProduct(blockQuantities[~blockIsBuyer], blockTicks[~blockIsBuyer]) \
+		- exactDotProduct(blockQuantities[:k][isSellerBefore], blockTicks[:k][isSellerBefore])
+	gap = currentSupply - currentDemand   # units that the block closes, all at the same price
+	if blockIsBuyer[k]:
+		buyersValue += gap*priceTick
+		totalUnitsTraded = currentSupply
+	else:
+		sellersValue -= gap*priceTick
+		totalUnitsTraded = currentDemand
+
+	# Count the buyers that enter / sellers that exit in the block, until the gap is closed:
+	for quantity in quantities[np.flatnonzero(blocks==k)[::-1]].tolist():
+		if quantity < gap:
+			gap -= quantity
+			if blockIsBuyer[k]: numOfBuyers += 1
+			else:               numOfSellers -= 1
+			continue
+		if blockIsBuyer[k]:
+			numOfBuyers += 1
+		elif quantity==gap:   # the last seller might exit partially, in which case he remains in the market
+			numOfSellers -= 1
+		break
+	return (fromTicks(priceTick, tickSize), numOfBuyers, numOfSellers, totalUnitsTraded, fromTicks(buyersValue-sellersValue, tickSize))
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
@@ -0,0 +1,190 @@
+#!python3
+
+"""
+Defines a class OrderBook - a limit-order book that is cleared periodically by a double-auction mechanism
+(a sequence of call auctions), where the unfilled orders carry over to the next round.
+
+The book is kept sorted by price-time priority between rounds, in arrays: the new orders of a round are merged into their place,
+and filled orders are removed, so the traders are not rebuilt from scratch in each round,
+and WALRAS clears the sorted book without sorting it again.
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import numpy as np
+
+from traders import Trader
+from doubleauction import MUDA
+from markets import equilibriumOfSortedUnits
+
+MECHANISMS = ("WALRAS", "MUDA-lottery", "MUDA-Vickrey")
+
+
+class _Side:
+	"""
+	The orders of one side of an OrderBook, in arrays sorted by price-time priority:
+	by descending price for the bids and ascending price for the asks, and by arrival time within each price.
+	A new order is appended to a list in O(1) time, and the new orders are merged into the arrays when the sorted side is needed.
+
+	>>> asks = _Side(isBuyer=False)
+	>>> for (price,orderId,quantity) in [(200,0,5), (100,1,4), (200,2,3)]:
+	...     asks.add(price, orderId, quantity)
+	>>> asks.sorted().orderIds.tolist()
+	[1, 0, 2]
+	>>> asks.fillByPriority(7), asks.orderIds.tolist(), asks.quantities.tolist()
+	(2, [0, 2], [2, 3])
+	"""
+
+	def __init__(self, isBuyer:bool):
+		self.isBuyer = isBuyer
+		self.prices = np.zeros(0, dtype=np.int64)
+		self.orderIds = np.zeros(0, dtype=np.int64)
+		self.quantities = np.zeros(0, dtype=np.int64)   # the remaining quantity of each order
+		self.newOrders = []   # (price, orderId, quantity) of the orders that were added since the last merge
+
+	def add(self, price:float, orderId:int, quantity:int):
+		self.newOrders.append((price, orderId, quantity))
+
+	def sorted(self)->'_Side':
+		"""
+		Merge the new orders into the arrays, and return the side.
+		The new orders arrive after the orders in the arrays, so a stable sort by price keeps the time priority;
+		as the arrays are already sorted, numpy's stable sort merges them in about O(n + k log k) time for k new orders.
+		"""
+		if self.newOrders:
+			(prices, orderIds, quantities) = zip(*self.newOrders)
+			self.newOrders = []
+			self.prices = np.concatenate((self.prices, prices))
+			self.orderIds = np.concatenate((self.orderIds, orderIds))
+			self.quantities = np.concatenate((self.quantities, np.array(quantities, dtype=np.int64)))
+			order = np.argsort(-self.prices if self.isBuyer else self.prices, kind="stable")
+			(self.prices, self.orderIds, self.quantities) = (self.prices[order], self.orderIds[order], self.quantities[order])
+		return self
+
+	def fillByPriority(self, totalUnits:int)->int:
+		"""
+		Fill totalUnits units of the sorted orders by price-time priority: the filled orders leave the side,
+		and a partially-filled order keeps its place.
+		OUTPUT: the number of orders of which some units are filled.
+		"""
+		if totalUnits<=0:
+			return 0
+		cumulativeQuantities = np.cumsum(self.quantities)
+		last = int(np.searchsorted(cumulativeQuantities, totalUnits))   # the last order that is filled
+		units = totalUnits - (int(cumulativeQuantities[last-1]) if last>0 else 0)   # its filled units
+		self.fill(np.r_[self.quantities[:last], units, np.zeros(len(self.quantities)-last-1, dtype=np.int64)])
+		return last+1
+
+	def fill(self, units:np.ndarray):
+		"""
+		Fill the given units of each of the sorted orders: the filled orders leave the side, and partially-filled orders keep their place.
+		"""
+		self.quantities = self.quantities - units
+		remaining = self.quantities>0
+		if not remaining.all():
+			(self.prices, self.orderIds, self.quantities) = (self.prices[remaining], self.orderIds[remaining], self.quantities[remaining])
+
+	def traders(self)->list:
+		"""
+		The Trader of each of the sorted orders, with its remaining quantity.
+		"""
+		return Trader.fromArrays(np.full(len(self.prices), self.isBuyer), np.arange(len(self.prices)+1), self.quantities, self.prices, presorted=True)
+
+	def __len__(self):
+		return len(self.prices) + len(self.newOrders)
+
+
+class OrderBook:
+	"""
+	A book of limit orders, each of which is a trader with a single valuation (quantity,price).
+
+	>>> book = OrderBook()
+	>>> for (isBuyer,quantity,price) in [(True,5,250), (True,4,150), (True,3,350), (False,5,200), (False,4,100), (False,3,300)]:
+	...     orderId = book.add(isBuyer, quantity, price)
+	>>> book
+	B[(3, 350)] B[(5, 250)] B[(4, 150)] | S[(4, 100)] S[(5, 200)] S[(3, 300)]
+	>>> book.clear("WALRAS")
+	(8, 1100, 4)
+	>>> book
+	B[(4, 150)] | S[(1, 200)] S[(3, 300)]
+	>>> orderId = book.add(True, 2, 220)
+	>>> book.clear("WALRAS")
+	(1, 20, 2)
+	>>> book
+	B[(1, 220)] B[(4, 150)] | S[(3, 300)]
+	"""
+
+	def __init__(self, rng:np.random.Generator=None):
+		self.rng = rng      # the random Generator of MUDA (default: the global random module)
+		self.bids = _Side(isBuyer=True)
+		self.asks = _Side(isBuyer=False)
+		self.nextOrderId = 0
+
+	def add(self, isBuyer:bool, quantity:int, price:float)->int:
+		"""
+		Add a new order to the book, in O(1) time (it is merged into its place when the book is cleared).
+		OUTPUT: the id of the new order.
+		"""
+		orderId = self.nextOrderId
+		self.nextOrderId += 1
+		(self.bids if isBuyer else self.asks).add(price, orderId, quantity)
+		return orderId
+
+	def orderIds(self)->list:
+		"""
+		The ids of the orders in the book, by price-time priority: the bids, then the asks.
+		"""
+		return self.bids.sorted().orderIds.tolist() + self.asks.sorted().orderIds.tolist()
+
+	def traders(self)->list:
+		return self.bids.sorted().traders() + self.asks.sorted().traders()
+
+	def __len__(self):
+		return len(self.bids) + len(self.asks)
+
+	def __repr__(self):
+		return " ".join([repr(trader) for trader in self.bids.sorted().traders()] + ["|"] + [repr(trader) for trader in self.asks.sorted().traders()])
+
+	def clear(self, mechanism:str="WALRAS")->tuple:
+		"""
+		Clear the book once, using one of the MECHANISMS, and remove the filled units from the book.
+		WALRAS fills the bids and asks by price-time priority; MUDA fills the orders allocated by its lottery or Vickrey variant.
+		OUTPUT: (totalUnitsTraded, gainFromTrade, numOfOrdersFilled) - where an order is filled if some of its units are traded.
+		"""
+		(bids, asks) = (self.bids.sorted(), self.asks.sorted())
+		if mechanism=="WALRAS":
+			(price, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade) = self._walrasianEquilibrium()
+			numOfOrdersFilled = bids.fillByPriority(totalUnitsTraded) + asks.fillByPriority(totalUnitsTraded)
+		elif mechanism in MECHANISMS:
+			outcome = MUDA(self.traders(), Lottery=True, Vickrey=True, rng=self.rng)
+			allocation = outcome.lottery if mechanism=="MUDA-lottery" else outcome.vickrey
+			(totalUnitsTraded, gainFromTrade) = (allocation[0], allocation[-1])
+			units = allocation.units
+			numOfOrdersFilled = int((units>0).sum())
+			(numOfBids, numOfAsks) = (len(bids.prices), len(asks.prices))
+			bids.fill(units[:numOfBids])
+			asks.fill(units[numOfBids:numOfBids+numOfAsks])
+		else:
+			raise ValueError("mechanism should be one of {}, not {}".format(MECHANISMS, mechanism))
+		return (totalUnitsTraded, gainFromTrade, numOfOrdersFilled)
+
+	def _walrasianEquilibrium(self)->tuple:
+		"""
+		The same price, trade and gain as doubleauction.walrasianEquilibrium of the traders of the book, from the sorted bids and asks:
+		the bids (by descending price) and the reversed asks are two sorted runs, which a stable sort merges in linear time,
+		into the order of markets.equilibriumOfSortedUnits (where a buyer comes before a seller with the same value).
+		"""
+		(bids, asks) = (self.bids.sorted(), self.asks.sorted())
+		quantities = np.concatenate((bids.quantities, asks.quantities[::-1]))
+		values = np.concatenate((bids.prices, asks.prices[::-1]))
+		isBuyer = np.arange(len(values)) < len(bids.prices)
+		order = np.argsort(-values, kind="stable")
+		return equilibriumOfSortedUnits(quantities[order], values[order], isBuyer[order])
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
@@ -0,0 +1,160 @@
+#!python3
+
+"""
+Compact representations of markets, for sending them to worker processes.
+
+A list of Trader objects (each with a list of tuples) is slow to pickle, and its pickle is much larger than its data.
+A PackedMarket keeps the same traders in a few flat typed arrays - the side of each trader,
+the offsets of its valuations, and the quantities and values of all valuations.
+Under pickle protocol 5 its arrays can be transferred as out-of-band buffers (see pickle.PickleBuffer),
+and a SharedPackedMarket keeps them in shared memory (multiprocessing.shared_memory),
+so that only the name of the memory block is pickled.
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from traders import Trader
+
+DEFAULT_SHARED_MEMORY_THRESHOLD = 2**24   # bytes; smaller markets are pickled with their arrays
+
+
+class PackedMarket:
+	"""
+	A list of traders, packed into flat arrays.
+
+	>>> traders = [Trader.Buyer([(5,250)]), Trader.Buyer([(4,150),(3,350)]), Trader.Seller([(5,200)]), Trader.Seller([(4,100),(3,300)])]
+	>>> packed = PackedMarket.fromTraders(traders)
+	>>> len(packed), packed.offsets.tolist(), packed.values.tolist()
+	(4, [0, 1, 3, 4, 6], [250, 350, 150, 200, 100, 300])
+	>>> packed.traders()
+	[B[(5, 250)], B[(3, 350), (4, 150)], S[(5, 200)], S[(4, 100), (3, 300)]]
+
+	With protocol 5, the arrays are not copied into the pickle, but passed as separate buffers:
+
+	>>> import pickle
+	>>> buffers = []
+	>>> data = pickle.dumps(packed, protocol=5, buffer_callback=buffers.append)
+	>>> len(buffers)
+	4
+	>>> pickle.loads(data, buffers=buffers).traders()
+	[B[(5, 250)], B[(3, 350), (4, 150)], S[(5, 200)], S[(4, 100), (3, 300)]]
+	"""
+
+	def __init__(self, isTraderBuyer:np.ndarray, offsets:np.ndarray, quantities:np.ndarray, values:np.ndarray):
+		self.isTraderBuyer = isTraderBuyer   # an entry per trader
+		self.offsets = offsets               # the valuations of trader i are at offsets[i]:offsets[i+1]
+		self.quantities = quantities         # an entry per valuation (in the smallest type that holds them)
+		self.values = values                 # an entry per valuation (integers if all the values are integers)
+
+	@staticmethod
+	def fromTraders(traders:list)->'PackedMarket':
+		"""
+		INPUT: a list of traders (or a Market).
+		"""
+		traders = list(traders)
+		numOfTraders = len(traders)
+		isTraderBuyer = np.fromiter((t.isBuyer for t in traders), dtype=bool, count=numOfTraders)
+		sizes = np.fromiter((len(t.valuations) for t in traders), dtype=np.int64, count=numOfTraders)
+		offsets = np.concatenate(([0], np.cumsum(sizes)))
+		quantities = np.array([v[0] for t in traders for v in t.valuations], dtype=np.int64)
+		if len(quantities)>0 and quantities.min()>=0:
+			quantities = quantities.astype(np.min_scalar_type(quantities.max()))
+		values = np.array([v[1] for t in traders for v in t.valuations])
+		return PackedMarket(isTraderBuyer, offsets, quantities, values)
+
+	def arrays(self)->tuple:
+		return (self.offsets, self.values, self.quantities, self.isTraderBuyer)   # from the widest type, so the arrays stay aligned in shared memory
+
+	@property
+	def nbytes(self)->int:
+		return sum(array.nbytes for array in self.arrays())
+
+	def traders(self)->list:
+		"""
+		OUTPUT: the list of traders, with the valuations of each trader in their original order.
+		"""
+		return Trader.fromArrays(self.isTraderBuyer, self.offsets, self.quantities, self.values, presorted=True)   # packed from sorted traders
+
+	def share(self)->'SharedPackedMarket':
+		return SharedPackedMarket(self)
+
+	def __len__(self):
+		return len(self.isTraderBuyer)
+
+	def __repr__(self):
+		return "PackedMarket({} traders, {} valuations)".format(len(self), len(self.values))
+
+
+class SharedPackedMarket:
+	"""
+	A PackedMarket whose arrays are kept in a block of shared memory.
+	Only the name of the block and the layout of the arrays are pickled;
+	a process that unpickles it reads the traders directly from the block.
+	The process that created it should unlink it when the other processes are done with it.
+
+	>>> import pickle
+	>>> shared = PackedMarket.fromTraders([Trader.Buyer([(5,250)]), Trader.Seller([(4,100),(3,300)])]).share()
+	>>> copy = pickle.loads(pickle.dumps(shared))
+	>>> copy.traders()
+	[B[(5, 250)], S[(4, 100), (3, 300)]]
+	>>> shared.unlink()
+	"""
+
+	def __init__(self, packed:PackedMarket):
+		arrays = packed.arrays()
+		self.layout = [(array.dtype.str, len(array)) for array in arrays]
+		self.memory = shared_memory.SharedMemory(create=True, size=max(1, packed.nbytes))
+		self.name = self.memory.name
+		for (array, view) in zip(arrays, self._views(self.memory)):
+			view[:] = array
+		del view   # a live view prevents closing the memory block
+
+	def _views(self, memory:shared_memory.SharedMemory)->list:
+		views = []
+		offset = 0
+		for (dtype, length) in self.layout:
+			views.append(np.ndarray(length, dtype=dtype, buffer=memory.buf, offset=offset))
+			offset += views[-1].nbytes
+		return views
+
+	def traders(self)->list:
+		"""
+		OUTPUT: the list of traders, copied out of the shared memory (see PackedMarket.traders).
+		"""
+		memory = self.memory if self.memory is not None else shared_memory.SharedMemory(name=self.name)
+		try:
+			(offsets, values, quantities, isTraderBuyer) = self._views(memory)
+			traders = PackedMarket(isTraderBuyer, offsets, quantities, values).traders()
+			del offsets, quantities, values, isTraderBuyer   # a live view prevents closing the memory block
+		finally:
+			if memory is not self.memory:
+				memory.close()
+		return traders
+
+	def unlink(self):
+		"""
+		Free the shared memory. Called by the process that created it.
+		"""
+		self.memory.close()
+		self.memory.unlink()
+		self.memory = None
+
+	def __getstate__(self):
+		return {"name": self.name, "layout": self.layout, "memory": None}
+
+	def __len__(self):
+		return self.layout[-1][1]
+
+	def __repr__(self):
+		return "SharedPackedMarket({}, {} traders)".format(self.name, len(self))
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
@@ -9,9 +9,11 @@ Since : 2017-09
 
 import numpy as np
 from doubleauction import Trader
+from result_store import SeededAuction
+from streaming import randomStreamingAuction, DEFAULT_MEMORY_LIMIT
 
 
-def randomValuations(minNumOfUnits:int, maxNumOfUnits:int, meanValue:float, maxNoiseSize:float, round:bool=False, index:int=None)->list:
+def randomValuations(minNumOfUnits:int, maxNumOfUnits:int, meanValue:float, maxNoiseSize:float, round:bool=False, index:int=None, rng:np.random.Generator=None)->list:
 	"""
 	Creates a list of tuples (num-of-units, value) that represents a multi-unit valuation function.
 	Each marginal value is selected at random from [meanValue +- maxNoiseSize].
@@ -22,19 +24,46 @@ def randomValuations(minNumOfUnits:int, maxNumOfUnits:int, meanValue:float, maxN
 	:param maxNoiseSize:  deviation in marginal value per unit.
 	:param round: if True, round valuations to nearest integer.
 	:param index: if given, add this index to each virtual-valuation, for tracking purposes.
+	:param rng: a numpy random Generator (default: the global np.random).
 	:return:
 
 	"""
+	if rng is None:
+		rng = np.random
 	numOfBundles = maxNumOfUnits // minNumOfUnits
 	result = []
 	for i in range(numOfBundles):
-		val = meanValue + np.random.uniform(-maxNoiseSize,+maxNoiseSize)
+		val = meanValue + rng.uniform(-maxNoiseSize,+maxNoiseSize)
 		if round: val = int(np.round(val))
 		tupleToAdd = (minNumOfUnits, val, index) if index is not None else (minNumOfUnits, val)
 		result.append(tupleToAdd)
 	return result
 
-def randomAuction(numOfTraders:int, minNumOfUnitsPerTrader:int, maxNumOfUnitsPerTrader:int, meanValue:float, maxNoiseSize:float, fixedNumOfVirtualTraders=False)->list:
+def randomTraderPairs(numOfPairs:int, minNumOfUnits:int, maxNumOfUnits:int, meanValue:float, maxNoiseSize:float, rng:np.random.Generator=None)->list:
+	"""
+	Creates numOfPairs pairs of a buyer and a seller, each with valuations like randomValuations(minNumOfUnits, maxNumOfUnits, meanValue, maxNoiseSize).
+	The values are drawn at once, in the same order as by successive calls to randomValuations (so they are the same values),
+	sorted in bulk, and passed to Trader.fromArrays as presorted.
+	:return: a list of Trader objects: buyer, seller, buyer, seller, ...
+
+	>>> [(repr(trader)[0], len(trader.valuations), trader.totalUnits()) for trader in randomTraderPairs(2, 2, 5, 100, 20, rng=np.random.default_rng(1))]
+	[('B', 2, 4), ('S', 2, 4), ('B', 2, 4), ('S', 2, 4)]
+	>>> repr(randomTraderPairs(2, 2, 5, 100, 20, rng=np.random.default_rng(1))) == repr([Trader(i%2==0, randomValuations(2, 5, 100, 20, rng=rng)) for rng in [np.random.default_rng(1)] for i in range(4)])
+	True
+	"""
+	if rng is None:
+		rng = np.random
+	numOfBundles = maxNumOfUnits // minNumOfUnits
+	values = meanValue + rng.uniform(-maxNoiseSize,+maxNoiseSize, size=(2*numOfPairs, numOfBundles))
+	values.sort(axis=1)   # ascending, as for a seller; equal values are identical bundles, so their order does not matter
+	values[0::2] = values[0::2, ::-1]   # descending, as for a buyer
+	isTraderBuyer = np.arange(2*numOfPairs)%2==0
+	offsets = np.arange(2*numOfPairs+1)*numOfBundles
+	quantities = np.full(values.size, minNumOfUnits)
+	return Trader.fromArrays(isTraderBuyer, offsets, quantities, values.ravel(), presorted=True)
+
+
+def randomAuction(numOfTraders:int, minNumOfUnitsPerTrader:int, maxNumOfUnitsPerTrader:int, meanValue:float, maxNoiseSize:float, fixedNumOfVirtualTraders=False, rng:np.random.Generator=None)->list:
 	"""
 	Creates a set of n buyers and n sellers with random valuations, for simulating a double-auction.
 
@@ -45,34 +74,81 @@ def randomAuction(numOfTraders:int, minNumOfUnitsPerTrader:int, maxNumOfUnitsPer
 	:param maxNoiseSize:  deviation in marginal value per unit.
 	:param fixedNumOfVirtualTraders: If false (default) - numOfTraders is the number of real traders, and the number of virtual traders (units) might be larger.
 	                                 If true - fixes the total number of units and determines the number of real traders accordingly.
+	:param rng: a numpy random Generator (default: the global np.random).
 	:return: a list of Trader objects
 	"""
-	traders = []
 	if fixedNumOfVirtualTraders:
-		for i in range(numOfTraders // maxNumOfUnitsPerTrader):
-			traders.append ( Trader.Buyer( randomValuations(minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader,meanValue,maxNoiseSize) ) )
-			traders.append ( Trader.Seller( randomValuations(minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader,meanValue,maxNoiseSize) ) )
+		traders = randomTraderPairs(numOfTraders // maxNumOfUnitsPerTrader, minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader, meanValue, maxNoiseSize, rng=rng)
 		if numOfTraders%maxNumOfUnitsPerTrader>=minNumOfUnitsPerTrader:
-			traders.append ( Trader.Buyer( randomValuations(minNumOfUnitsPerTrader,numOfTraders%maxNumOfUnitsPerTrader,meanValue,maxNoiseSize) ) )
-			traders.append ( Trader.Seller( randomValuations(minNumOfUnitsPerTrader,numOfTraders%maxNumOfUnitsPerTrader,meanValue,maxNoiseSize) ) )
+			traders += randomTraderPairs(1, minNumOfUnitsPerTrader, numOfTraders%maxNumOfUnitsPerTrader, meanValue, maxNoiseSize, rng=rng)
 	else:   # fixed num of real traders
-		for i in range(numOfTraders):
-			traders.append ( Trader.Buyer( randomValuations(minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader,meanValue,maxNoiseSize) ) )
-			traders.append ( Trader.Seller( randomValuations(minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader,meanValue,maxNoiseSize) ) )
+		traders = randomTraderPairs(numOfTraders, minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader, meanValue, maxNoiseSize, rng=rng)
 	return traders
 
 
-def randomAuctions(numOfAuctions:int, numOfTraderss:int, minNumOfUnitsPerTrader:int, maxNumOfUnitsPerTraders:int, meanValue:float, maxNoiseSizes:float, fixedNumOfVirtualTraders=False):
+def randomAuctionEngine(numOfTraders:int, maxNumOfUnitsPerTrader:int, fixedNumOfVirtualTraders=False,
+	streamingThreshold:int=None, memoryLimit:int=DEFAULT_MEMORY_LIMIT)->dict:
+	"""
+	The engine that randomAuctionOfSize uses for an auction of the given size.
+	The streaming engine draws the MUDA partition and sums the gains in its own way (and by blocks of memoryLimit),
+	so its results are not identical to those of the same auction in memory.
+
+	>>> randomAuctionEngine(100, 5)
+	{'engine': 'memory'}
+	>>> randomAuctionEngine(100, 5, streamingThreshold=499, memoryLimit=1000)
+	{'engine': 'streaming', 'memoryLimit': 1000}
+	"""
+	numOfUnits = numOfTraders if fixedNumOfVirtualTraders else numOfTraders*maxNumOfUnitsPerTrader
+	if streamingThreshold is not None and numOfUnits > streamingThreshold:
+		return dict(engine="streaming", memoryLimit=memoryLimit)
+	else:
+		return dict(engine="memory")
+
+
+def randomAuctionOfSize(numOfTraders:int, minNumOfUnitsPerTrader:int, maxNumOfUnitsPerTrader:int, meanValue:float, maxNoiseSize:float, fixedNumOfVirtualTraders=False,
+	streamingThreshold:int=None, memoryLimit:int=DEFAULT_MEMORY_LIMIT, rng:np.random.Generator=None):
+	"""
+	A random auction created by randomAuction, or by randomStreamingAuction if it has more units per side than streamingThreshold.
+	"""
+	if randomAuctionEngine(numOfTraders, maxNumOfUnitsPerTrader, fixedNumOfVirtualTraders, streamingThreshold, memoryLimit)["engine"]=="streaming":
+		return randomStreamingAuction(numOfTraders, minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader, meanValue, maxNoiseSize, fixedNumOfVirtualTraders, memoryLimit, rng=rng)
+	else:
+		return randomAuction(numOfTraders, minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader, meanValue, maxNoiseSize, fixedNumOfVirtualTraders, rng=rng)
+
+
+def randomAuctions(numOfAuctions:int, numOfTraderss:int, minNumOfUnitsPerTrader:int, maxNumOfUnitsPerTraders:int, meanValue:float, maxNoiseSizes:float, fixedNumOfVirtualTraders=False,
+	streamingThreshold:int=None, memoryLimit:int=DEFAULT_MEMORY_LIMIT, seed:int=None):
 	"""
 	A generator, generates a sequence of numOfAuctions random auctions using randomAuction.
 	The parameters after numOfAuctions are passed to randomAuction.
+
+	:param streamingThreshold: if given, auctions with more units per side than this threshold
+	                           are generated by randomStreamingAuction, as a StreamingMarket.
+	:param memoryLimit: the memory limit (in bytes) for the virtual traders of each StreamingMarket.
+	:param seed: if given, the auctions are reproducible: each auction is a SeededAuction, that is generated only when it is called,
+	             and whose parameters identify its results in a result_store.ResultStore.
+
+	>>> [(auctionID, auction.auction) for (auctionID, auction) in randomAuctions(2, [3], 1, [5], 100, [20], seed=1)]
+	[((3, 1, 5, 20), 0), ((3, 1, 5, 20), 1)]
+	>>> auctions = list(randomAuctions(1, [3], 1, [5], 100, [20], seed=1))
+	>>> repr(auctions[0][1]()) == repr(auctions[0][1]())
+	True
+	>>> auctions[0][1].key()["engine"], list(randomAuctions(1, [3], 1, [5], 100, [20], streamingThreshold=10, seed=1))[0][1].key()["engine"]
+	('memory', 'streaming')
 	"""
 	for i in range(numOfAuctions):
 		for numOfTraders in numOfTraderss:
 			for maxNumOfUnitsPerTrader in maxNumOfUnitsPerTraders:
 				for maxNoiseSize in maxNoiseSizes:
 					auctionID = (numOfTraders,minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader,maxNoiseSize)
-					yield(auctionID, randomAuction(numOfTraders, minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader, meanValue, maxNoiseSize, fixedNumOfVirtualTraders))
+					parameters = dict(numOfTraders=numOfTraders, minNumOfUnitsPerTrader=minNumOfUnitsPerTrader, maxNumOfUnitsPerTrader=maxNumOfUnitsPerTrader,
+						meanValue=meanValue, maxNoiseSize=maxNoiseSize, fixedNumOfVirtualTraders=fixedNumOfVirtualTraders)
+					settings = dict(streamingThreshold=streamingThreshold, memoryLimit=memoryLimit)
+					if seed is None:
+						yield(auctionID, randomAuctionOfSize(**parameters, **settings))
+					else:
+						engine = randomAuctionEngine(numOfTraders, maxNumOfUnitsPerTrader, fixedNumOfVirtualTraders, streamingThreshold, memoryLimit)
+						yield(auctionID, SeededAuction("random", randomAuctionOfSize, parameters, seed, i, settings, engine))
 
 ### MAIN PROGRAM ###
 
@@ -0,0 +1,124 @@
+#!python3
+
+"""
+A content-addressed store of the results of simulated auctions.
+
+The results of a seeded auction are determined by the version of the mechanisms,
+the parameters of the generator that created the auction, and its seed.
+The store keeps the results of each auction under a hash of these, so an auction that was already simulated -
+in any experiment, and into any results file - is not simulated again.
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import hashlib
+import json
+import numpy as np
+import os
+
+from doubleauction import MECHANISM_VERSION
+
+GENERATOR_STREAM = 0   # the random numbers that generate the auction
+MECHANISM_STREAM = 1   # the random numbers of the mechanisms
+
+
+class SeededAuction:
+	"""
+	The auction number auction of a sequence of random auctions with the given seed,
+	which is generated only when it is needed, by calling generate(**parameters, **settings, rng=...).
+	The random numbers of each auction are spawned from the seed by the auction number (with numpy's SeedSequence),
+	in separate streams for the generator and for the mechanisms, so they do not depend on the other auctions,
+	nor on the process in which the auction is simulated.
+	The generator, parameters, seed and auction number, and the engine that simulates the auction
+	(e.g. in memory or streaming, which may sum the gains in a different order), determine the results, so they identify them in a ResultStore.
+	The settings are passed to generate; the engine should describe whatever in them changes the results.
+
+	>>> auction = SeededAuction("uniform", lambda size, rng: rng.integers(100, size=size).tolist(), dict(size=3), seed=7, auction=0)
+	>>> auction() == auction()
+	True
+	>>> auction.key()
+	{'generator': 'uniform', 'seed': 7, 'auction': 0, 'size': 3}
+	>>> SeededAuction("uniform", None, dict(size=3), seed=7, auction=0, engine=dict(engine="streaming")).key()
+	{'generator': 'uniform', 'seed': 7, 'auction': 0, 'size': 3, 'engine': 'streaming'}
+	"""
+
+	def __init__(self, generator:str, generate, parameters:dict, seed:int, auction:int, settings:dict=None, engine:dict=None):
+		self.generator = generator
+		self.generate = generate
+		self.parameters = parameters
+		self.seed = seed
+		self.auction = auction
+		self.settings = settings or {}
+		self.engine = engine or {}
+
+	def rng(self, stream:int)->np.random.Generator:
+		"""
+		A new Generator for the given stream (GENERATOR_STREAM or MECHANISM_STREAM) of the auction.
+		"""
+		return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(self.auction, stream)))
+
+	def __call__(self):
+		return self.generate(**self.parameters, **self.settings, rng=self.rng(GENERATOR_STREAM))
+
+	def key(self)->dict:
+		return dict(generator=self.generator, seed=self.seed, auction=self.auction, **self.parameters, **self.engine)
+
+	def __repr__(self):
+		return "SeededAuction({})".format(self.key())
+
+
+class ResultStore:
+	"""
+	A directory with a file per auction, named by the hash of (MECHANISM_VERSION, parameters).
+
+	>>> import tempfile
+	>>> store = ResultStore(tempfile.mkdtemp())
+	>>> store.get({"numOfTraders": 10, "seed": 1}) is None
+	True
+	>>> store.put({"numOfTraders": 10, "seed": 1}, [5, 5.0, float("inf")])
+	>>> store.get({"seed": 1, "numOfTraders": 10})
+	[5, 5.0, inf]
+	>>> store.get({"numOfTraders": 10, "seed": 2}) is None
+	True
+	"""
+
+	def __init__(self, directory:str="results/store"):
+		self.directory = directory
+
+	@staticmethod
+	def key(parameters:dict)->str:
+		description = json.dumps({"version": MECHANISM_VERSION, "parameters": parameters}, sort_keys=True)
+		return hashlib.sha256(description.encode()).hexdigest()
+
+	def _filename(self, key:str)->str:
+		return os.path.join(self.directory, key[:2], key+".json")
+
+	def get(self, parameters:dict)->list:
+		"""
+		OUTPUT: the stored results of the auction with the given parameters, or None if it was not simulated yet.
+		"""
+		filename = self._filename(self.key(parameters))
+		if not os.path.exists(filename):
+			return None
+		with open(filename) as file:
+			return json.load(file)["results"]
+
+	def put(self, parameters:dict, results:list):
+		"""
+		Store the results of the auction with the given parameters.
+		The file is replaced atomically, so several processes can share the store.
+		"""
+		filename = self._filename(self.key(parameters))
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+		results = [value.item() if hasattr(value, "item") else value for value in results]   # numpy scalars
+		with open(filename+".temp{}".format(os.getpid()), "w") as file:
+			json.dump({"version": MECHANISM_VERSION, "parameters": parameters, "results": results}, file)
+		os.replace(filename+".temp{}".format(os.getpid()), filename)
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
@@ -0,0 +1,229 @@
+#!python3
+
+"""
+Aggregation of simulation results for plotting.
+
+A results file is loaded once, from a columnar cache (a pickle of the DataFrame that is kept next to the CSV file),
+and the bins of all columns - means, counts, and confidence intervals of the gain ratios - are calculated in a single pass.
+The bin tables are cached by (resultsFilename, xColumn, numOfBins), in memory and next to the CSV file,
+so re-drawing a figure does not re-read or re-bin the results.
+Alternatively, the bins can be accumulated online while the auctions are simulated (see OnlineBins),
+so the per-auction rows need not be written at all.
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import math
+import numbers
+import os
+import pickle
+
+RATIO_FIELDS = ('MUDA-lottery', 'MUDA-Vickrey traders', 'MUDA-Vickrey total')
+CONFIDENCE_Z = 1.96   # 95% confidence intervals
+
+_loadedResults = {}   # resultsFilename -> (modification time of the CSV file, results)
+_binTables = {}       # (resultsFilename, xColumn, numOfBins) -> (modification time of the CSV file, bin table)
+
+
+def _modificationTime(filename:str)->float:
+	return os.path.getmtime(filename) if os.path.exists(filename) else None
+
+
+def loadResults(resultsFilename:str)->DataFrame:
+	"""
+	Load a results file, with the derived columns used in the plots, keeping only the auctions with a positive optimal gain.
+	The loaded results are cached in memory and in resultsFilename+".pkl", and re-loaded only if the CSV file changes.
+	"""
+	csvTime = _modificationTime(resultsFilename)
+	if resultsFilename in _loadedResults and _loadedResults[resultsFilename][0]==csvTime:
+		return _loadedResults[resultsFilename][1]
+	columnsFilename = resultsFilename+".pkl"
+	columnsTime = _modificationTime(columnsFilename)
+	if columnsTime is not None and (csvTime is None or columnsTime>=csvTime):
+		results = pd.read_pickle(columnsFilename)
+	else:
+		results = pd.read_csv(resultsFilename)
+		results.rename(columns=lambda column: column.replace("MIDA","MUDA"), inplace=True)  # older results use the name MIDA
+		results['Optimal market size'] = (results['Optimal buyers']+results['Optimal sellers']) / 2
+		results['Normalized market size'] = results['Optimal units'] / (results['Max units per trader'])
+		results['log10(M)'] = np.log(results['Max units per trader'])/np.log(10)
+		print(len(results), " auctions")
+		results = results[results['Optimal gain']>0].reset_index(drop=True)
+		print(len(results), " auctions with positive optimal gain")
+		for field in RATIO_FIELDS:
+			results[field+' ratio'] = results[field+' gain'] / results['Optimal gain']
+		results.to_pickle(columnsFilename)
+	_loadedResults[resultsFilename] = (csvTime, results)
+	return results
+
+
+def binStatistics(codes:np.ndarray, values:np.ndarray, squaredColumns:list=())->tuple:
+	"""
+	Calculate the statistics of the rows in each bin, in a single pass over the values. NaN values are skipped.
+	INPUT: codes - the bin of each row (non-negative integers);
+	       values - a matrix with a row per row and a column per column;
+	       squaredColumns - indices of the columns whose standard deviation is needed.
+	OUTPUT: (bins, counts, means, stds) - the bins that have rows (ascending),
+	        and for each of them: the number of non-NaN values, the mean, and the sample standard deviation of the squaredColumns.
+
+	>>> (bins, counts, means, stds) = binStatistics(np.array([1,0,1,1]), np.array([[1.,10],[2,20],[3,np.nan],[5,40]]), [0])
+	>>> bins.tolist(), counts.tolist(), means.tolist(), stds.tolist()
+	([0, 1], [[1.0, 1.0], [3.0, 2.0]], [[2.0, 20.0], [3.0, 25.0]], [[nan], [2.0]])
+	"""
+	order = np.argsort(codes, kind="stable")
+	sortedCodes = codes[order]
+	starts = np.flatnonzero(np.r_[True, sortedCodes[1:]!=sortedCodes[:-1]])
+	sortedValues = values[order]
+	valid = ~np.isnan(sortedValues)
+	filled = np.where(valid, sortedValues, 0)
+	squares = filled[:,list(squaredColumns)]**2
+	sums = np.add.reduceat(np.hstack([valid, filled, squares]), starts, axis=0)
+	numOfColumns = values.shape[1]
+	counts = sums[:, :numOfColumns]
+	with np.errstate(invalid="ignore", divide="ignore"):
+		means = sums[:, numOfColumns:2*numOfColumns] / counts
+		squaredCounts = counts[:,list(squaredColumns)]
+		squaredMeans = means[:,list(squaredColumns)]
+		variances = (sums[:, 2*numOfColumns:] - squaredCounts*squaredMeans**2) / (squaredCounts-1)
+		stds = np.sqrt(np.maximum(variances, 0))
+	stds[squaredCounts<2] = np.nan
+	return (sortedCodes[starts], counts, means, stds)
+
+
+def binResults(results:DataFrame, xColumn:str, numOfBins:int=10)->DataFrame:
+	"""
+	Calculate a table with a row per bin of xColumn: the mean of each numeric column, the number of auctions ('count'),
+	and the half-width of the confidence interval of each ratio column ('<field> ratio ci').
+	numOfBins - the number of equal-width bins (as in pd.cut); if None, each value of xColumn is a bin.
+	Empty bins are omitted.
+
+	>>> results = DataFrame({'x':[1,2,3,9,10], 'symbol':list('abcde'), 'MUDA-lottery ratio':[0.5,0.7,0.6,1,1]})
+	>>> table = binResults(results, 'x', numOfBins=2)
+	>>> table['x'].tolist(), table['count'].tolist(), table['MUDA-lottery ratio'].round(3).tolist()
+	([2.0, 9.5], [3, 2], [0.6, 1.0])
+	>>> table['MUDA-lottery ratio ci'].round(3).tolist()
+	[0.113, 0.0]
+	"""
+	x = results[xColumn]
+	if numOfBins:
+		bins = pd.cut(x, numOfBins)
+		(codes, binLabels) = (bins.cat.codes.to_numpy(), bins.cat.categories)
+	else:
+		(binLabels, codes) = np.unique(x.to_numpy(), return_inverse=True)
+	keep = codes>=0   # pd.cut gives code -1 to NaN values
+	numeric = results.select_dtypes(include=[np.number]).drop(columns=[c for c in results.columns if c.startswith("Unnamed:")], errors="ignore")
+	columns = list(numeric.columns)
+	ratioColumns = [field+' ratio' for field in RATIO_FIELDS if field+' ratio' in columns]
+	(binCodes, counts, means, stds) = binStatistics(codes[keep], numeric.to_numpy(dtype=float)[keep], [columns.index(c) for c in ratioColumns])
+	table = DataFrame(means, columns=columns, index=pd.Index(np.asarray(binLabels)[binCodes], name=xColumn))
+	table['count'] = np.bincount(codes[keep])[binCodes]
+	for (i,column) in enumerate(ratioColumns):
+		table[column+' ci'] = CONFIDENCE_Z * stds[:,i] / np.sqrt(counts[:,columns.index(column)])
+	return table
+
+
+def binnedResults(resultsFilename:str, xColumn:str='Min total traders', numOfBins:int=10)->DataFrame:
+	"""
+	The binResults of the given results file, cached by (resultsFilename, xColumn, numOfBins)
+	in memory and in resultsFilename+".bins.pkl" (until the CSV file changes).
+	A newly calculated table is also written to resultsFilename+".bins".
+	If there is no results file, but only a bin table that was accumulated during the simulation (see OnlineBins),
+	that table is returned as is.
+	"""
+	key = (resultsFilename, xColumn, numOfBins)
+	csvTime = _modificationTime(resultsFilename)
+	if key in _binTables and _binTables[key][0]==csvTime:
+		return _binTables[key][1]
+	if csvTime is None and os.path.exists(resultsFilename+".bins"):
+		return pd.read_csv(resultsFilename+".bins", index_col=0)
+	tablesFilename = resultsFilename+".bins.pkl"
+	tables = {}
+	if os.path.exists(tablesFilename):
+		with open(tablesFilename, "rb") as file:
+			tables = pickle.load(file)
+	if key[1:] in tables and tables[key[1:]][0]==csvTime:
+		table = tables[key[1:]][1]
+	else:
+		table = binResults(loadResults(resultsFilename), xColumn, numOfBins)
+		table.to_csv(resultsFilename+".bins")
+		tables[key[1:]] = (csvTime, table)
+		with open(tablesFilename, "wb") as file:
+			pickle.dump(tables, file)
+	_binTables[key] = (csvTime, table)
+	return table
+
+
+class OnlineBins:
+	"""
+	Running statistics of the simulated auctions in bins of xColumn, updated one auction at a time:
+	the count, and the mean and variance of each column (by Welford's algorithm).
+	As in loadResults, only auctions with a positive optimal gain are counted, and the ratio columns are added.
+	binWidth - the width of the bins (left-closed intervals); if None, each value of xColumn is a bin.
+
+	>>> rows = [{'x':x, 'Optimal gain':g, 'MUDA-lottery gain':m} for (x,g,m) in [(1,10,5),(2,10,7),(3,10,6),(9,10,10),(9,0,0),(8,5,5)]]
+	>>> bins = OnlineBins('x', binWidth=5)
+	>>> for row in rows:
+	...     bins.add(row)
+	>>> table = bins.table()
+	>>> table['x'].tolist(), table['count'].tolist(), table['MUDA-lottery ratio'].round(3).tolist()
+	([2.0, 8.5], [3, 2], [0.6, 1.0])
+	>>> table['MUDA-lottery ratio ci'].round(3).tolist()
+	[0.113, 0.0]
+	>>> table.index[0]
+	Interval(0, 5, closed='left')
+	"""
+
+	def __init__(self, xColumn:str, binWidth:float=None):
+		self.xColumn = xColumn
+		self.binWidth = binWidth
+		self.columns = None
+		self.bins = {}   # bin key -> [count, means, sums of squared deviations]
+
+	def add(self, row:dict):
+		"""
+		Add the results of a single auction - a dict from column names to values.
+		"""
+		if row['Optimal gain']<=0:
+			return
+		if self.columns is None:
+			self.columns = [column for (column,value) in row.items() if isinstance(value, numbers.Number)]
+			self.ratioFields = [field for field in RATIO_FIELDS if field+' gain' in row]
+		values = np.array([row[column] for column in self.columns] + [row[field+' gain']/row['Optimal gain'] for field in self.ratioFields], dtype=float)
+		x = row[self.xColumn]
+		key = x if self.binWidth is None else math.floor(x/self.binWidth)
+		if key not in self.bins:
+			self.bins[key] = [0, np.zeros(len(values)), np.zeros(len(values))]
+		bin = self.bins[key]
+		bin[0] += 1
+		delta = values - bin[1]
+		bin[1] += delta / bin[0]
+		bin[2] += delta * (values - bin[1])
+
+	def table(self)->DataFrame:
+		"""
+		The bin table, in the format of binResults.
+		"""
+		keys = sorted(self.bins.keys())
+		labels = keys if self.binWidth is None else [pd.Interval(key*self.binWidth, (key+1)*self.binWidth, closed='left') for key in keys]
+		ratioColumns = [field+' ratio' for field in self.ratioFields] if self.columns is not None else []
+		counts = np.array([self.bins[key][0] for key in keys], dtype=np.int64)
+		means = np.array([self.bins[key][1] for key in keys]).reshape(len(keys), -1)
+		squaredDeviations = np.array([self.bins[key][2] for key in keys]).reshape(len(keys), -1)
+		table = DataFrame(means, columns=(self.columns or [])+ratioColumns, index=pd.Index(labels, name=self.xColumn))
+		table['count'] = counts
+		with np.errstate(invalid="ignore", divide="ignore"):
+			stds = np.sqrt(squaredDeviations / (counts-1)[:,np.newaxis])
+		for (i,column) in enumerate(ratioColumns):
+			table[column+' ci'] = CONFIDENCE_Z * stds[:,len(self.columns)+i] / np.sqrt(counts)
+		return table
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
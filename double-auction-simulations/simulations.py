@@ -0,0 +1,517 @@
+#!python3
+
+"""
+Utilities for simulating double-auction mechanisms on sequences of auctions,
+shared by the main programs of the experiments.
+
+Author: Erel Segal-Halevi
+Since : 2017-07
+"""
+
+import collections
+import numpy as np
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from doubleauction import MUDA,WALRAS
+from jit_backend import resolveBackend
+from markets import Market, exactDotProduct
+from order_book import OrderBook
+from packed_markets import PackedMarket, DEFAULT_SHARED_MEMORY_THRESHOLD
+from result_store import ResultStore, SeededAuction, MECHANISM_STREAM
+from streaming import StreamingMarket, streamingWALRASandMUDA
+import torq_datasets_read as torq
+
+def traderCounts(isTraderBuyer:np.ndarray, unitsPerTrader:np.ndarray)->tuple:
+	totalBuyers = int(isTraderBuyer.sum())
+	totalSellers = len(isTraderBuyer)-totalBuyers
+	return (totalBuyers, totalSellers, totalBuyers+totalSellers, min(totalBuyers,totalSellers))
+
+def unitStatistics(isTraderBuyer:np.ndarray, unitsPerTrader:np.ndarray)->tuple:
+	maxUnitsPerTrader = int(unitsPerTrader.max())
+	minUnitsPerTrader = int(unitsPerTrader.min())
+	return (int(unitsPerTrader.sum()), maxUnitsPerTrader, minUnitsPerTrader, maxUnitsPerTrader/max(1,minUnitsPerTrader),
+		np.sqrt(exactDotProduct(unitsPerTrader, unitsPerTrader)))
+
+# The statistics of each auction: pairs (columns, function), where function(isTraderBuyer, unitsPerTrader) returns the values of the columns.
+# The arrays have an entry per trader, and are computed once per auction (see traderArrays); to add statistics, pass a longer list to simulateAuctions.
+STATISTICS = [
+	(('Total buyers', 'Total sellers', 'Total traders', 'Min total traders'), traderCounts),
+	(('Total units', 'Max units per trader', 'Min units per trader', 'Normalized max units per trader', 'stddev'), unitStatistics),
+]
+
+MECHANISM_COLUMNS=(
+	'Optimal buyers', 'Optimal sellers', 'Optimal units',
+	'Optimal gain', 'MUDA-lottery gain', 'MUDA-Vickrey traders gain', 'MUDA-Vickrey total gain')
+
+def statisticColumns(statistics:list=STATISTICS)->tuple:
+	return tuple(column for (columns,function) in statistics for column in columns)
+
+COLUMNS = statisticColumns(STATISTICS)+MECHANISM_COLUMNS
+
+PREFETCHERS = ("thread", "process")
+
+def replicaAuctions(replicaNums:list, auctions:list):
+	"""
+	INPUT: auctions - list of m auctions;
+	       replicaNums - list of n integers.
+	OUTPUT: generator of m*n auctions, where in each auction, each agent is replicated i times.
+	"""
+	for auctionID,auctionTraders in auctions:
+		for replicas in replicaNums:
+			traders = replicas * auctionTraders
+			yield auctionID,traders
+
+def sampleAuctions(agentNums:list, auctions:list, rng:np.random.Generator=None, nested:bool=True):
+	"""
+	INPUT: auctions - list of m auctions;
+	       agentNums - list of n integers.
+	       rng - a numpy random Generator (default: a new one).
+	       nested - if True, the samples of each auction are prefixes of a single sample of size max(agentNums).
+	                Each sample is still an i.i.d. sample from the empirical distribution,
+	                but samples of the same auction with different sizes are correlated.
+	OUTPUT: generator of m*n auctions, where in each auction, i agents are sampled from the empirical distribution.
+	        Each sampled auction is a Market that shares the arrays of the original auction,
+	        so the virtual traders are sorted only once per auction.
+	        An auction that has a sample method (a Market or a torq_datasets_read.TorqAuction) is sampled by it;
+	        an auction whose units do not fit in the arrays of a Market is sampled as a list of traders.
+
+	>>> from traders import Trader
+	>>> auctions = [(0, [Trader.Buyer([(10**20,50)]), Trader.Seller([(10**20,10)])])]
+	>>> [list(sample) for (auctionID,sample) in sampleAuctions([3], auctions, rng=np.random.default_rng(1))]
+	[[B[(100000000000000000000, 50)], S[(100000000000000000000, 10)], S[(100000000000000000000, 10)]]]
+	"""
+	if rng is None:
+		rng = np.random.default_rng()
+	maxAgentNum = max(agentNums)
+	for auctionID,auctionTraders in auctions:
+		if hasattr(auctionTraders, "sample"):
+			market = auctionTraders
+		else:
+			auctionTraders = list(auctionTraders)
+			try:
+				market = Market(auctionTraders)
+			except OverflowError:   # the mechanisms will accumulate its Python integers
+				market = None
+		numOfTraders = len(auctionTraders)
+		if nested:
+			indices = rng.choice(numOfTraders, size=maxAgentNum)
+		for agentNum in agentNums:
+			sampleIndices = indices[:agentNum] if nested else rng.choice(numOfTraders, size=agentNum)
+			yield auctionID,(market.sample(sampleIndices) if market is not None else [auctionTraders[i] for i in sampleIndices.tolist()])
+
+
+def traderArrays(traders)->tuple:
+	"""
+	OUTPUT: (isTraderBuyer, unitsPerTrader) - arrays with an entry per trader.
+	A Market or a StreamingMarket already has them; a list of traders is read in a single pass over its valuations.
+
+	>>> from traders import Trader
+	>>> [array.tolist() for array in traderArrays([Trader.Buyer([(5,250)]), Trader.Seller([(4,100),(3,300)])])]
+	[[True, False], [5, 7]]
+	"""
+	if hasattr(traders, "traderArrays"):
+		return traders.traderArrays()
+	numOfTraders = len(traders)
+	isTraderBuyer = np.fromiter((t.isBuyer for t in traders), dtype=bool, count=numOfTraders)
+	offsets = np.concatenate(([0], np.cumsum(np.fromiter((len(t.valuations) for t in traders), dtype=np.int64, count=numOfTraders))))
+	cumulativeUnits = np.concatenate(([0], np.cumsum(np.fromiter((v[0] for t in traders for v in t.valuations), dtype=np.int64, count=offsets[-1]))))
+	return (isTraderBuyer, cumulativeUnits[offsets[1:]] - cumulativeUnits[offsets[:-1]])
+
+
+def auctionResults(traders, backend:str=None, rng:np.random.Generator=None, statistics:list=STATISTICS)->list:
+	"""
+	Simulate WALRAS and MUDA on a single auction.
+	backend - see doubleauction.walrasianEquilibrium; a StreamingMarket is simulated exactly, with any backend.
+	rng - the random Generator of MUDA (see doubleauction.MUDA).
+	statistics - the statistics of the auction (see STATISTICS), computed from its traderArrays.
+	OUTPUT: the values of statisticColumns(statistics)+MECHANISM_COLUMNS (by default, COLUMNS).
+
+	>>> from random_datasets import randomAuction
+	>>> traders = randomAuction(2000, 1, 5, 100, 50, rng=np.random.default_rng(3))
+	>>> (exact, approximate) = (auctionResults(traders, backend, rng=np.random.default_rng(1)) for backend in ("python", "approximate"))
+	>>> exact[-7:-4], approximate[-7:-4]   # the WALRAS buyers, sellers and units
+	([5049, 5049, 5049], [5049, 5049, 5049])
+	>>> abs(approximate[-4]/exact[-4] - 1) < 0.001   # the WALRAS gain
+	True
+	"""
+	(isTraderBuyer, unitsPerTrader) = traderArrays(traders)
+	auctionStatistics = [value for (columns,function) in statistics for value in function(isTraderBuyer, unitsPerTrader)]
+	if isinstance(traders, StreamingMarket):   # too large for Trader objects
+		((buyersWALRAS, sellersWALRAS, sizeWALRAS, gainWALRAS),
+		 (sizeMUDALottery, gainMUDALottery, gainMUDALottery, sizeMUDAVickrey, tradersGainMUDAVickrey, totalGainMUDAVickrey)) = streamingWALRASandMUDA(traders, rng)
+	else:
+		(buyersWALRAS, sellersWALRAS, sizeWALRAS, gainWALRAS) = WALRAS(traders, backend)
+		(sizeMUDALottery, gainMUDALottery, gainMUDALottery, sizeMUDAVickrey, tradersGainMUDAVickrey, totalGainMUDAVickrey) = MUDA(traders, Lottery=True, Vickrey=True, backend=backend, rng=rng)
+	return auctionStatistics + [
+		buyersWALRAS, sellersWALRAS, sizeWALRAS,
+		gainWALRAS, gainMUDALottery, tradersGainMUDAVickrey, totalGainMUDAVickrey]
+
+
+def _storeKey(auction, store:ResultStore, statistics:list, backend:str=None)->dict:
+	"""
+	OUTPUT: the key of a SeededAuction in the store (with the columns of its statistics, if they are not the default,
+	        and the backend, if it is "approximate"), or None.
+	"""
+	if store is None or not isinstance(auction, SeededAuction):
+		return None
+	key = auction.key()
+	if statisticColumns(statistics) != statisticColumns(STATISTICS):
+		key["statistics"] = list(statisticColumns(statistics))
+	if resolveBackend(backend) in ("approximate", "ticks"):   # the other backends give the same results ("ticks" might differ in the rounding of the gains)
+		key["backend"] = resolveBackend(backend)
+	return key
+
+
+def _simulateInWorker(auctionID, auction, backend:str, rng:np.random.Generator, statistics:list=STATISTICS)->list:
+	"""
+	Simulate an auction that was sent to a worker process: a callable auction such as a SeededAuction (which is generated here),
+	a PackedMarket or a SharedPackedMarket.
+	"""
+	if isinstance(auction, SeededAuction):
+		rng = auction.rng(MECHANISM_STREAM)
+	traders = auction() if callable(auction) else auction.traders()
+	if not traders:
+		raise ValueError("traders for auction {} is empty", auctionID)
+	return auctionResults(traders, backend, rng, statistics)
+
+
+def prefetched(items, size:int):
+	"""
+	A generator of the given items, which are produced by a background thread, at most size items ahead of the consumer:
+	when the queue is full, the thread waits until the consumer takes an item (back-pressure).
+	The production overlaps the consumption where either of them releases the GIL (e.g, reading files, or numpy operations).
+	An exception in the production is raised in the consumer.
+
+	>>> list(prefetched(iter(range(5)), 2))
+	[0, 1, 2, 3, 4]
+	"""
+	items = iter(items)
+	ahead = queue.Queue(maxsize=size)
+	stopped = threading.Event()
+	end = object()
+
+	def put(entry)->bool:
+		while not stopped.is_set():
+			try:
+				ahead.put(entry, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False   # the consumer stopped
+
+	def produce():
+		try:
+			for item in items:
+				if not put((item, None)):
+					return
+			put((end, None))
+		except BaseException as error:
+			put((end, error))
+
+	producer = threading.Thread(target=produce, daemon=True)
+	producer.start()
+	try:
+		while True:
+			(item, error) = ahead.get()
+			if item is end:
+				if error is not None:
+					raise error
+				return
+			yield item
+			del item
+	finally:
+		stopped.set()
+
+
+def _mechanismRng(auction, rng:np.random.Generator)->np.random.Generator:
+	"""
+	OUTPUT: the random Generator of the mechanisms in the given auction: the mechanism stream of a SeededAuction,
+	        a Generator spawned from rng for any other auction (in the order of the auctions, in both the serial and the parallel runs),
+	        or None (the global random module) if there is no rng.
+	"""
+	if isinstance(auction, SeededAuction):
+		return auction.rng(MECHANISM_STREAM)
+	return rng.spawn(1)[0] if rng is not None else None
+
+
+def _preparedAuctions(auctions, store:ResultStore, statistics:list=STATISTICS, rng:np.random.Generator=None, backend:str=None):
+	"""
+	A generator of (auctionID, key, auctionRow, traders, auctionRng) for the given auctions:
+	the key of the auction in the store, and either its stored row, or its traders (a generated callable auction)
+	and the random Generator of its mechanisms (or None for the default).
+	"""
+	for auctionID,traders in auctions:
+		key = _storeKey(traders, store, statistics, backend)
+		auctionRow = store.get(key) if key is not None else None
+		auctionRng = None
+		if auctionRow is not None:
+			traders = None
+		else:
+			auctionRng = _mechanismRng(traders, rng)
+			if callable(traders):
+				traders = traders()
+		yield auctionID,key,auctionRow,traders,auctionRng
+		del traders
+
+
+def _generatedAuction(auction)->PackedMarket:
+	"""
+	Generate a callable auction in the prefetching process, and pack it for sending it back.
+	A StreamingMarket cannot be sent, so it is generated again by the consumer (None).
+	"""
+	traders = auction()
+	return None if isinstance(traders, StreamingMarket) else PackedMarket.fromTraders(traders)
+
+
+def _preparedAuctionsInProcess(auctions, store:ResultStore, size:int, statistics:list=STATISTICS, rng:np.random.Generator=None, backend:str=None):
+	"""
+	Like _preparedAuctions, but the callable auctions are generated by a background process, at most size auctions ahead.
+	"""
+	pending = collections.deque()
+	with ProcessPoolExecutor(max_workers=1) as prefetcher:
+		for auctionID,auction in auctions:
+			key = _storeKey(auction, store, statistics, backend)
+			auctionRow = store.get(key) if key is not None else None
+			auctionRng = _mechanismRng(auction, rng) if auctionRow is None else None
+			generated = prefetcher.submit(_generatedAuction, auction) if callable(auction) and auctionRow is None else None
+			pending.append((auctionID,key,auctionRow,auction,auctionRng,generated))
+			while len(pending) > size:
+				yield _unpacked(*pending.popleft())
+		while pending:
+			yield _unpacked(*pending.popleft())
+
+
+def _unpacked(auctionID, key, auctionRow, auction, auctionRng, generated)->tuple:
+	if auctionRow is not None:
+		traders = None
+	elif generated is None:
+		traders = auction
+	else:
+		packed = generated.result()
+		traders = packed.traders() if packed is not None else auction()
+	return auctionID,key,auctionRow,traders,auctionRng
+
+
+def _serialAuctionRows(auctions, store:ResultStore, backend:str, rng:np.random.Generator, prefetch:int=0, prefetcher:str="thread",
+	statistics:list=STATISTICS):
+	"""
+	A generator of (auctionID, auctionRow), simulating the auctions one after the other (see simulateAuctions).
+	"""
+	if prefetch and prefetcher=="process":
+		preparedAuctions = _preparedAuctionsInProcess(auctions, store, prefetch, statistics, rng, backend)
+	elif prefetch:
+		preparedAuctions = prefetched(_preparedAuctions(auctions, store, statistics, rng, backend), prefetch)
+	else:
+		preparedAuctions = _preparedAuctions(auctions, store, statistics, rng, backend)
+	for auctionID,key,auctionRow,traders,auctionRng in preparedAuctions:
+		if auctionRow is not None:
+			print("Auction {} is in the store".format(auctionID))
+		else:
+			if not traders:
+				raise ValueError("traders for auction {} is empty", auctionID)
+			print("Simulating auction {} with {} traders".format(auctionID,len(traders)))
+			auctionRow = auctionResults(traders, backend, auctionRng, statistics)
+			if key is not None:
+				store.put(key, auctionRow)
+		del traders   # a StreamingMarket removes its files when it is garbage-collected
+		yield auctionID,auctionRow
+
+
+def _parallelAuctionRows(auctions, store:ResultStore, backend:str, rng:np.random.Generator,
+	numOfWorkers:int, sharedMemoryThreshold:int, statistics:list=STATISTICS):
+	"""
+	A generator of (auctionID, auctionRow), simulating the auctions in numOfWorkers worker processes (see simulateAuctions).
+	The rows are yielded in the order of the auctions, and at most 2*numOfWorkers auctions are in flight at any time.
+	"""
+	pending = collections.deque()   # (auctionID, key, auctionRow or None, future or None, SharedPackedMarket or None)
+
+	def finish(auctionID, key, auctionRow, future, shared):
+		try:
+			if future is not None:
+				auctionRow = future.result()
+				if key is not None:
+					store.put(key, auctionRow)
+		finally:
+			if shared is not None:
+				shared.unlink()
+		return auctionID,auctionRow
+
+	maxPending = 2*(numOfWorkers or os.cpu_count())
+	with ProcessPoolExecutor(max_workers=numOfWorkers) as pool:
+		try:
+			for auctionID,traders in auctions:
+				key = _storeKey(traders, store, statistics, backend)
+				auctionRow = store.get(key) if key is not None else None
+				(future, shared) = (None, None)
+				if auctionRow is not None:
+					print("Auction {} is in the store".format(auctionID))
+				elif isinstance(traders, StreamingMarket):   # its sorted runs belong to this process
+					print("Simulating auction {} with {} traders".format(auctionID,len(traders)))
+					auctionRow = auctionResults(traders, backend, _mechanismRng(traders, rng), statistics)
+				else:
+					auctionRng = None if isinstance(traders, SeededAuction) else _mechanismRng(traders, rng)   # a SeededAuction makes its own in the worker
+					if callable(traders):
+						auction = traders   # generated in the worker, e.g, only the parameters and seed of a SeededAuction are sent
+					else:
+						if not traders:
+							raise ValueError("traders for auction {} is empty", auctionID)
+						auction = PackedMarket.fromTraders(traders)
+						if auction.nbytes > sharedMemoryThreshold:
+							auction = shared = auction.share()
+					print("Simulating auction {} in a worker".format(auctionID))
+					future = pool.submit(_simulateInWorker, auctionID, auction, backend, auctionRng, statistics)
+				del traders
+				pending.append((auctionID, key, auctionRow, future, shared))
+				while len(pending) > maxPending or (pending and (pending[0][3] is None or pending[0][3].done())):
+					yield finish(*pending.popleft())
+			while pending:
+				yield finish(*pending.popleft())
+		finally:
+			for (auctionID, key, auctionRow, future, shared) in pending:
+				if shared is not None:
+					if future is not None:
+						future.cancel()
+						if not future.cancelled():
+							future.exception()   # wait until the worker is done with the shared memory
+					shared.unlink()
+
+
+def simulateAuctions(auctions:list, resultsFilename:str, keyColumns:list, backend:str=None,
+	bins=None, rawResults:bool=True, store:ResultStore=None, rng:np.random.Generator=None,
+	numOfWorkers:int=None, sharedMemoryThreshold:int=DEFAULT_SHARED_MEMORY_THRESHOLD, prefetch:int=0, prefetcher:str="thread", statistics:list=STATISTICS):
+	"""
+	Simulate the auctions in the given generator.
+	An auction can be a list of traders, a Market, or a StreamingMarket (see random_datasets.randomAuctions),
+	or a callable that returns one of these: a result_store.SeededAuction, which is generated only if its results are not in the store,
+	or a torq_datasets_read.TorqAuction.
+	backend - the backend of WALRAS and MUDA ("python", "numba", "approximate" or "ticks"; see doubleauction.walrasianEquilibrium).
+	      A StreamingMarket is always simulated exactly, as its WALRAS comes from the same merge of its runs as its MUDA.
+	bins - optional results_aggregation.OnlineBins (of any of the key columns or COLUMNS), that accumulates the results during the run;
+	       its table is written to resultsFilename+".bins".
+	rawResults - if False, the row of each auction is neither kept nor written, and the bin table is returned.
+	store - optional ResultStore, in which the results of the SeededAuctions are looked up before they are simulated, and saved after.
+	rng - the random Generator of the mechanisms in the auctions that are not SeededAuctions (default: the global random module):
+	      each of these auctions gets a Generator spawned from it, in the order of the auctions, so the serial and parallel runs give the same results;
+	      a SeededAuction uses the mechanism stream of its own seed, so its results do not depend on the order of the simulation.
+	numOfWorkers - if given, the auctions are simulated in this many worker processes (0 means the number of CPUs).
+	      A callable auction is generated in the worker, so e.g. only the parameters and seed of a SeededAuction are sent to it;
+	      other auctions are sent as a PackedMarket, or as a SharedPackedMarket if they are larger than sharedMemoryThreshold bytes.
+	      A StreamingMarket is simulated in this process.
+	prefetch - if positive (and there are no workers), the next prefetch auctions are generated (and looked up in the store)
+	      while the current auction is simulated, by a background thread or process (one of PREFETCHERS).
+	      A thread (see prefetched) overlaps only the parts of the generation that release the GIL, such as reading files;
+	      a process generates the callable auctions (e.g, SeededAuction or TorqAuction) in parallel, and sends them back as PackedMarkets.
+	      Note that the prefetched auctions are kept in memory together.
+	statistics - the statistics of each auction, as pairs (columns, function) (see STATISTICS); their columns come before MECHANISM_COLUMNS.
+	      With workers, the functions should be picklable (e.g, defined at the top level of a module).
+
+	>>> import contextlib, io, tempfile
+	>>> from random_datasets import randomAuction
+	>>> auctions = [((i,), randomAuction(20, 1, 4, 100, 30, rng=np.random.default_rng(i))) for i in range(3)]
+	>>> def run(**options):
+	...     with contextlib.redirect_stdout(io.StringIO()):
+	...         return simulateAuctions(auctions, os.path.join(tempfile.mkdtemp(), "results.csv"), ("auction",), rng=np.random.default_rng(1), **options)
+	>>> run().equals(run(numOfWorkers=2))
+	True
+	"""
+	columns = keyColumns+statisticColumns(statistics)+MECHANISM_COLUMNS
+	from pandas import DataFrame
+	results = DataFrame(columns=columns)
+	print("\t{}".format(columns))
+	resultsFilenameTemp = resultsFilename+".temp"
+	if numOfWorkers is None:
+		if prefetcher not in PREFETCHERS:
+			raise ValueError("prefetcher should be one of {}, not {}".format(PREFETCHERS, prefetcher))
+		auctionRows = _serialAuctionRows(auctions, store, backend, rng, prefetch, prefetcher, statistics)
+	else:
+		auctionRows = _parallelAuctionRows(auctions, store, backend, rng, numOfWorkers or None, sharedMemoryThreshold, statistics)
+	for auctionID,auctionRow in auctionRows:
+		resultsRow = [*auctionID, *auctionRow]
+		print("\t{}".format(resultsRow))
+		if bins is not None:
+			bins.add(dict(zip(columns, resultsRow)))
+		if rawResults:
+			results.loc[len(results)] = resultsRow
+			results.to_csv(resultsFilenameTemp)
+	if rawResults:
+		results.to_csv(resultsFilename)
+		os.remove(resultsFilenameTemp)
+	if bins is not None:
+		table = bins.table()
+		table.to_csv(resultsFilename+".bins")
+		if not rawResults:
+			return table
+	return results
+
+
+def torqSimulationBySymbolDate(filename, combineByOrderDate=False, replicaNums=[1], numOfWorkers:int=None):
+	"""
+	Treat each (symbol,date) combination as a separate auction.
+	numOfWorkers - if given, the auctions are simulated in worker processes (see simulateAuctions),
+	               each of which builds the traders of its auctions from the memory-mapped dataset (see torq_datasets_read.TorqArrays).
+	"""
+	datasetFilename = "datasets/"+filename+".CSV"
+	resultsFilename = "results/"+filename+("-combined" if combineByOrderDate else "")+"-x"+str(max(replicaNums))+".csv"
+	return simulateAuctions(replicaAuctions(replicaNums,
+		torq.auctionsBySymbolDate(datasetFilename, combineByOrderDate, lazy=numOfWorkers is not None)),
+		resultsFilename, keyColumns=("symbol","date"), numOfWorkers=numOfWorkers)
+
+def torqSimulateBySymbol(filename, combineByOrderDate=False, agentNums=[100], numOfWorkers:int=None):
+	"""
+	Treat all bidders for the same symbol, in ALL dates, as a distribution of values for that symbol.
+	numOfWorkers - if given, the auctions are simulated in worker processes (see torqSimulationBySymbolDate).
+	"""
+	datasetFilename = "datasets/"+filename+".CSV"
+	resultsFilename = "results/"+filename+("-combined" if combineByOrderDate else "")+"-s"+str(max(agentNums))+".csv"
+	return simulateAuctions(sampleAuctions(agentNums,
+		torq.auctionsBySymbol(datasetFilename, combineByOrderDate, lazy=numOfWorkers is not None)),
+		resultsFilename, keyColumns=("symbol",), numOfWorkers=numOfWorkers)
+
+ROUND_COLUMNS=('round', 'New orders', 'Book orders', 'Units', 'Gain', 'Orders filled', 'Latency', 'Throughput')
+
+def torqSimulateRounds(filename, ordersPerRound:int=None, roundColumn:str=None, mechanism:str="WALRAS", carryOver:bool=True, seed:int=None):
+	"""
+	Replay the orders of each (symbol,date) as a sequence of call auctions, each of which is cleared by the given mechanism
+	("WALRAS", "MUDA-lottery" or "MUDA-Vickrey"; see OrderBook.clear).
+	The orders arrive by their order dates; a round starts every ordersPerRound orders,
+	or at every new value of roundColumn (e.g, "Order date").
+	If carryOver is True, the unfilled orders remain in the book for the next rounds of the same (symbol,date).
+	Reports, for each round, the latency of updating and clearing the book (in seconds), and the throughput (in new orders per second).
+	seed - if given, the random Generator of the MUDA mechanisms of each (symbol,date) is spawned from it, so the replay is reproducible.
+	"""
+	if (ordersPerRound is None) == (roundColumn is None):
+		raise ValueError("exactly one of ordersPerRound and roundColumn should be given")
+	datasetFilename = "datasets/"+filename+".CSV"
+	resultsFilename = "results/"+filename+"-rounds-"+(str(ordersPerRound) if roundColumn is None else roundColumn.replace(" ",""))+"-"+mechanism+".csv"
+	columns = ("symbol","date")+ROUND_COLUMNS
+	from pandas import DataFrame
+	results = DataFrame(columns=columns)
+	print("\t{}".format(columns))
+	seedSequence = np.random.SeedSequence(seed) if seed is not None else None
+	for ((symbol,date),orders) in torq.ordersBySymbolDate(datasetFilename):
+		rng = np.random.default_rng(seedSequence.spawn(1)[0]) if seedSequence is not None else None
+		book = OrderBook(rng)
+		if roundColumn is None:
+			rounds = orders.groupby(np.arange(len(orders)) // ordersPerRound, sort=False)
+		else:
+			rounds = orders.groupby(roundColumn, sort=True)
+		for roundIndex,(key,roundOrders) in enumerate(rounds):
+			if not carryOver:
+				book = OrderBook(rng)
+			start = time.perf_counter()
+			for (side,price,quantity) in zip(roundOrders["Side"], roundOrders["Price"], roundOrders["Quantity"]):
+				book.add(side=="BUY", quantity, price)
+			bookSize = len(book)
+			(totalUnitsTraded, gainFromTrade, numOfOrdersFilled) = book.clear(mechanism)
+			latency = time.perf_counter() - start
+			resultsRow = [symbol, date, roundIndex, len(roundOrders), bookSize, totalUnitsTraded, gainFromTrade, numOfOrdersFilled,
+				latency, len(roundOrders)/latency if latency>0 else np.inf]
+			results.loc[len(results)] = resultsRow
+		print("\t{} {}: {} rounds, {} orders, {:.0f} orders per second".format(symbol, date, roundIndex+1, len(orders),
+			len(orders)/max(1e-9, results["Latency"].iloc[-roundIndex-1:].sum())))
+	results.to_csv(resultsFilename)
+	return results
@@ -0,0 +1,536 @@
+#!python3
+
+"""
+Streaming (chunked) simulation of WALRAS and MUDA on random markets that are too large to keep in memory as Trader objects.
+
+A market is generated chunk by chunk into columnar arrays. The chunks are sorted, and when they exceed
+the memory limit, they are spilled to disk as sorted runs (an external merge sort).
+The mechanisms are then calculated in a few passes over the k-way merge of the runs.
+The memory used for the virtual traders is bounded by the memory limit;
+the real traders are kept in a few arrays with an entry per trader.
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+
+from doubleauction import RESERVE_AGENT
+from markets import Crossing, exactDotProduct
+
+FIELDS = ("quantities", "values", "owners", "isBuyer")
+BYTES_PER_UNIT = 8+8+8+1    # quantity, value, owner, isBuyer
+RESERVE_QUANTITY = 999999999
+DEFAULT_MEMORY_LIMIT = 2**30
+MAX_RUNS = 32   # when there are more runs, they are merged into a single run on disk
+
+
+class SortedRuns:
+	"""
+	An external sort of virtual traders.
+	Appended chunks are buffered; when the buffer exceeds the memory limit, it is sorted and spilled to disk as a run.
+	The order is by descending value, where a buyer comes before a seller with the same value.
+
+	>>> runs = SortedRuns(memoryLimit=5*BYTES_PER_UNIT)
+	>>> runs.append(np.array([1,2,3]), np.array([10.,30.,20.]), np.array([0,1,2]), np.array([True,False,True]))
+	>>> runs.append(np.array([4,5,6]), np.array([25.,30.,5.]), np.array([3,4,5]), np.array([False,True,False]))
+	>>> runs.close()
+	>>> len(runs.runs)
+	2
+	>>> blocks = list(runs.merged(blockSize=2))
+	>>> np.concatenate([block[1] for block in blocks]).tolist()
+	[30.0, 30.0, 25.0, 20.0, 10.0, 5.0]
+	>>> np.concatenate([block[2] for block in blocks]).tolist()
+	[4, 1, 3, 2, 0, 5]
+	>>> np.concatenate([block[1] for block in runs.merged(blockSize=2, ascending=True)]).tolist()
+	[5.0, 10.0, 20.0, 25.0, 30.0, 30.0]
+	"""
+
+	def __init__(self, memoryLimit:int=DEFAULT_MEMORY_LIMIT, directory:str=None):
+		self.memoryLimit = memoryLimit
+		self.directory = directory
+		self.runs = []         # each run is a tuple of arrays (possibly memory-mapped), in the order of FIELDS.
+		self.buffer = []
+		self.bufferSize = 0
+		self.tempDirectory = None
+		self.numOfRunFiles = 0
+
+	def append(self, quantities:np.ndarray, values:np.ndarray, owners:np.ndarray, isBuyer:np.ndarray):
+		self.buffer.append((quantities, values, owners, isBuyer))
+		self.bufferSize += len(values)
+		if 2*self.bufferSize*BYTES_PER_UNIT > self.memoryLimit:   # the sort needs another copy of the buffer
+			self._flush(spill=True)
+
+	def close(self):
+		"""
+		Sort the remaining buffer. If nothing was spilled, the only run is kept in memory.
+		"""
+		self._flush(spill=len(self.runs)>0)
+
+	def _flush(self, spill:bool):
+		if not self.buffer:
+			return
+		columns = [np.concatenate(column) for column in zip(*self.buffer)]
+		self.buffer = []
+		self.bufferSize = 0
+		order = np.lexsort((~columns[3], -columns[1]))
+		columns = [column[order] for column in columns]
+		if spill:
+			columns = self._spill(columns)
+		self.runs.append(tuple(columns))
+		if len(self.runs) > MAX_RUNS:
+			self._consolidate()
+
+	def _newRunFiles(self)->list:
+		if self.tempDirectory is None:
+			self.tempDirectory = tempfile.mkdtemp(prefix="double-auction-runs-", dir=self.directory)
+			weakref.finalize(self, shutil.rmtree, self.tempDirectory, ignore_errors=True)
+		self.numOfRunFiles += 1
+		return [os.path.join(self.tempDirectory, "{}-{}.npy".format(self.numOfRunFiles, field)) for field in FIELDS]
+
+	def _spill(self, columns:list)->list:
+		run = []
+		for (path,column) in zip(self._newRunFiles(), columns):
+			np.save(path, column)
+			run.append(np.load(path, mmap_mode='r'))
+		return run
+
+	def _consolidate(self):
+		"""
+		Merge all runs into a single run on disk, so that the number of open runs remains bounded.
+		"""
+		length = sum(len(run[1]) for run in self.runs)
+		paths = self._newRunFiles()
+		outputs = [np.lib.format.open_memmap(path, mode='w+', dtype=column.dtype, shape=(length,))
+			for (path,column) in zip(paths, self.runs[0])]
+		blockSize = max(1024, self.memoryLimit // (4*BYTES_PER_UNIT*len(self.runs)))
+		start = 0
+		for block in _mergeRuns(self.runs, blockSize, ascending=False):
+			for (output,column) in zip(outputs, block):
+				output[start:start+len(column)] = column
+			start += len(block[1])
+		for output in outputs:
+			output.flush()
+		oldFiles = [run[0].filename for run in self.runs if isinstance(run[0], np.memmap)]
+		self.runs = [tuple(np.load(path, mmap_mode='r') for path in paths)]
+		for filename in oldFiles:   # the memory-maps of the old runs are closed when they are garbage-collected
+			prefix = filename[:-len("-quantities.npy")]
+			for field in FIELDS:
+				try:
+					os.remove(prefix+"-"+field+".npy")
+				except OSError:
+					pass
+
+	def merged(self, blockSize:int=None, ascending:bool=False):
+		"""
+		A generator of blocks (quantities, values, owners, isBuyer) in the merged order of all runs
+		(or in the reverse order, if ascending=True).
+		At most blockSize virtual traders per run are loaded at a time.
+		"""
+		if blockSize is None:
+			blockSize = max(1024, self.memoryLimit // (4*BYTES_PER_UNIT*max(1,len(self.runs))))
+		if len(self.runs)==1:
+			(run,) = self.runs
+			length = len(run[1])
+			for start in range(0, length, blockSize):
+				yield _readBlock(run, start, min(start+blockSize,length), ascending)
+			return
+		yield from _mergeRuns(self.runs, blockSize, ascending)
+
+
+def _readBlock(run:tuple, start:int, end:int, ascending:bool)->tuple:
+	"""
+	Read the virtual traders start..end of the given run (counting from its end if ascending).
+	"""
+	if ascending:
+		length = len(run[1])
+		return tuple(np.array(column[length-end:length-start])[::-1] for column in run)
+	else:
+		return tuple(np.array(column[start:end]) for column in run)
+
+
+def _mergeRuns(runs:list, blockSize:int, ascending:bool):
+	"""
+	Block-wise k-way merge: all loaded virtual traders that precede the last loaded virtual trader of every
+	partially-loaded run are sorted and emitted; then the exhausted blocks are re-loaded.
+	"""
+	sign = 1 if ascending else -1
+	def keys(block):   # (primary, secondary) sort keys
+		return (sign*block[1], block[3] if ascending else ~block[3])
+	lengths = [len(run[1]) for run in runs]
+	cursors = [0]*len(runs)
+	pending = [None]*len(runs)   # loaded and not yet emitted: (block, positions)
+	while True:
+		for r in range(len(runs)):
+			if (pending[r] is None or len(pending[r][0][1])==0) and cursors[r]<lengths[r]:
+				end = min(cursors[r]+blockSize, lengths[r])
+				pending[r] = (_readBlock(runs[r], cursors[r], end, ascending), np.arange(cursors[r], end))
+				cursors[r] = end
+		active = [r for r in range(len(runs)) if pending[r] is not None and len(pending[r][0][1])>0]
+		if not active:
+			return
+		cutoff = None   # the smallest key of a last loaded virtual trader, in a run that has more virtual traders on disk
+		for r in active:
+			if cursors[r]<lengths[r]:
+				(primary,secondary) = keys(pending[r][0])
+				last = (primary[-1], secondary[-1])
+				if cutoff is None or last<cutoff:
+					cutoff = last
+		block = tuple(np.concatenate([pending[r][0][f] for r in active]) for f in range(len(FIELDS)))
+		runIndices = np.concatenate([np.full(len(pending[r][1]), r) for r in active])
+		positions = np.concatenate([pending[r][1] for r in active])
+		(primary,secondary) = keys(block)
+		order = np.lexsort((positions, runIndices, secondary, primary))
+		if cutoff is None:
+			numToEmit = len(order)
+		else:
+			(primary,secondary) = (primary[order], secondary[order])
+			numToEmit = int(np.count_nonzero((primary<cutoff[0]) | ((primary==cutoff[0]) & (secondary<=cutoff[1]))))
+		emitted = order[:numToEmit]
+		yield tuple(column[emitted] for column in block)
+		kept = np.zeros(len(order), dtype=bool)
+		kept[order[numToEmit:]] = True
+		for r in active:
+			inRun = kept & (runIndices==r)
+			pending[r] = (tuple(column[inRun] for column in block), positions[inRun])
+
+
+
+class StreamingMarket:
+	"""
+	A market whose virtual traders are kept in SortedRuns, and whose real traders are kept in arrays:
+	  * isTraderBuyer   - True for buyers, False for sellers.
+	  * unitsPerTrader  - the total number of units of each trader.
+	  * bundlesPerTrader - the number of virtual traders of each trader.
+	  * valuePerTrader  - the total value of all units of each trader.
+	"""
+
+	def __init__(self, isTraderBuyer:np.ndarray, bundlesPerTrader:np.ndarray, runs:SortedRuns, rng:np.random.Generator=None):
+		self.isTraderBuyer = isTraderBuyer
+		self.bundlesPerTrader = bundlesPerTrader
+		self.runs = runs
+		self.rng = rng if rng is not None else np.random.default_rng()
+		numOfTraders = len(isTraderBuyer)
+		self.unitsPerTrader = np.zeros(numOfTraders, dtype=np.int64)
+		self.valuePerTrader = np.zeros(numOfTraders)
+		for (quantities, values, owners, isBuyer) in self.blocks():
+			self.unitsPerTrader += np.bincount(owners, weights=quantities, minlength=numOfTraders).astype(np.int64)
+			self.valuePerTrader += np.bincount(owners, weights=quantities*values, minlength=numOfTraders)
+
+	def blocks(self, blockSize:int=2**20):
+		"""
+		A generator of blocks (quantities, values, owners, isBuyer) of all runs, in the order in which they are stored.
+		Use it when the order does not matter, as it does not merge the runs.
+		"""
+		for run in self.runs.runs:
+			for start in range(0, len(run[1]), blockSize):
+				yield _readBlock(run, start, start+blockSize, ascending=False)
+
+	def traderArrays(self)->tuple:
+		"""
+		OUTPUT: (isTraderBuyer, unitsPerTrader) - the same as markets.Market.traderArrays.
+		"""
+		return (self.isTraderBuyer, self.unitsPerTrader)
+
+	def valueRange(self)->tuple:
+		"""
+		OUTPUT: (minValue, maxValue) of all virtual traders, read from the ends of the sorted runs.
+		"""
+		runs = [run for run in self.runs.runs if len(run[1])>0]
+		if not runs:
+			return (0, 0)
+		return (min(float(run[1][-1]) for run in runs), max(float(run[1][0]) for run in runs))
+
+	def __len__(self):
+		return len(self.isTraderBuyer)
+
+	def __repr__(self):
+		return "StreamingMarket({} buyers, {} sellers, {} runs)".format(
+			int(self.isTraderBuyer.sum()), int((~self.isTraderBuyer).sum()), len(self.runs.runs))
+
+
+def randomStreamingAuction(numOfTraders:int, minNumOfUnitsPerTrader:int, maxNumOfUnitsPerTrader:int, meanValue:float, maxNoiseSize:float, fixedNumOfVirtualTraders=False,
+	memoryLimit:int=DEFAULT_MEMORY_LIMIT, rng:np.random.Generator=None, directory:str=None)->StreamingMarket:
+	"""
+	Creates the same kind of market as random_datasets.randomAuction, as a StreamingMarket.
+	The valuations are generated in chunks, so the memory used is bounded by memoryLimit
+	(in addition to a few arrays with an entry per trader).
+
+	>>> market = randomStreamingAuction(5, 10, 30, 100, 40, rng=np.random.default_rng(1))
+	>>> market
+	StreamingMarket(5 buyers, 5 sellers, 1 runs)
+	>>> market.unitsPerTrader.tolist()
+	[30, 30, 30, 30, 30, 30, 30, 30, 30, 30]
+	>>> randomStreamingAuction(500, 100, 300, 100, 40, fixedNumOfVirtualTraders=True).unitsPerTrader.tolist()
+	[300, 300, 200, 200]
+	"""
+	if rng is None:
+		rng = np.random.default_rng()
+	bundlesPerUnit = maxNumOfUnitsPerTrader // minNumOfUnitsPerTrader
+	if fixedNumOfVirtualTraders:
+		bundlesPerPair = [bundlesPerUnit]*(numOfTraders // maxNumOfUnitsPerTrader)
+		if numOfTraders%maxNumOfUnitsPerTrader>=minNumOfUnitsPerTrader:
+			bundlesPerPair.append((numOfTraders%maxNumOfUnitsPerTrader) // minNumOfUnitsPerTrader)
+	else:
+		bundlesPerPair = [bundlesPerUnit]*numOfTraders
+	bundlesPerTrader = np.repeat(np.array(bundlesPerPair, dtype=np.int64), 2)   # a buyer and a seller, as in randomAuction
+	isTraderBuyer = np.tile(np.array([True,False]), len(bundlesPerPair))
+	ends = np.cumsum(bundlesPerTrader)
+	totalBundles = int(ends[-1]) if len(ends)>0 else 0
+
+	runs = SortedRuns(memoryLimit, directory)
+	chunkSize = max(1, memoryLimit // (4*BYTES_PER_UNIT))
+	for start in range(0, totalBundles, chunkSize):
+		end = min(start+chunkSize, totalBundles)
+		owners = np.searchsorted(ends, np.arange(start,end), side='right')
+		quantities = np.full(end-start, minNumOfUnitsPerTrader, dtype=np.int64)
+		values = meanValue + rng.uniform(-maxNoiseSize, +maxNoiseSize, size=end-start)
+		runs.append(quantities, values, owners, isTraderBuyer[owners])
+	runs.close()
+	return StreamingMarket(isTraderBuyer, bundlesPerTrader, runs, rng)
+
+
+
+### Consumers of the merged stream ###
+
+def _crossingOf(market:StreamingMarket, mask:np.ndarray)->Crossing:
+	"""
+	A Crossing of the traders of the given market in the given mask (None for all traders), from the start of the merged stream.
+	"""
+	sellers = ~market.isTraderBuyer if mask is None else mask & ~market.isTraderBuyer
+	return Crossing(int(market.bundlesPerTrader[sellers].sum()), int(market.unitsPerTrader[sellers].sum()),
+		float(market.valuePerTrader[sellers].sum()), mask=mask)
+
+
+class _VickreyCut:
+	"""
+	Calculates VickreyTradeWithExogeneousPrice on the long side of a sub-market, while the merged stream passes
+	(in descending order for buyers, ascending order for sellers).
+	Only the prefix of the losers that is needed for the Vickrey payments is kept.
+	"""
+
+	def __init__(self, market:StreamingMarket, mask:np.ndarray, price:float, isBuyer:bool, quota:int):
+		self.mask = mask & (market.isTraderBuyer==isBuyer)
+		self.price = price
+		self.isBuyer = isBuyer
+		self.quota = quota
+		self.winnerUnits = np.zeros(len(market), dtype=np.int64)
+		self.loserUnits = np.zeros(len(market), dtype=np.int64)
+		self.winnersGain = 0
+		self.losers = []
+		self.numOfLoserUnits = 0
+		self.done = quota<=0   # no winners, so no payments
+
+	def consume(self, quantities, values, owners, isBuyer):
+		relevant = self.mask[owners] & ((values>self.price) if self.isBuyer else (values<self.price))
+		(quantities, values, owners) = (quantities[relevant], values[relevant], owners[relevant])
+		if self.quota > 0:
+			cumulative = np.cumsum(quantities)
+			winning = np.minimum(quantities, np.maximum(0, self.quota - (cumulative-quantities)))
+			self.winnerUnits += np.bincount(owners, weights=winning, minlength=len(self.winnerUnits)).astype(np.int64)
+			self.winnersGain += float(exactDotProduct(winning, values-self.price if self.isBuyer else self.price-values))
+			self.quota -= int(winning.sum())
+			quantities = quantities-winning   # the last winner might win partially
+			losing = quantities>0
+			(quantities, values, owners) = (quantities[losing], values[losing], owners[losing])
+		if len(quantities)>0:
+			self.losers.append((quantities, values, owners))
+			self.numOfLoserUnits += int(quantities.sum())
+			self.loserUnits += np.bincount(owners, weights=quantities, minlength=len(self.loserUnits)).astype(np.int64)
+		if self.quota==0:
+			winners = self.winnerUnits>0
+			# each winner pays for the first losing units that are not his own:
+			self.done = not winners.any() or \
+				(self.numOfLoserUnits - self.loserUnits[winners] >= self.winnerUnits[winners]).all()
+
+	def result(self)->tuple:
+		"""
+		OUTPUT: (managerGain, winnersGain)
+		"""
+		winners = np.flatnonzero(self.winnerUnits)
+		if len(winners)==0:
+			return (0, self.winnersGain)
+		losers = self.losers + [(np.array([RESERVE_QUANTITY]), np.array([self.price]), np.array([RESERVE_AGENT]))]
+		(quantities, values, owners) = (np.concatenate(column) for column in zip(*losers))
+		payments = vickreyPayments(winners, self.winnerUnits[winners], quantities, values, owners)
+		if self.isBuyer:
+			managerGain = float(payments.sum()) - self.price*int(self.winnerUnits.sum())
+		else:
+			managerGain = self.price*int(self.winnerUnits.sum()) - float(payments.sum())
+		return (managerGain, self.winnersGain)
+
+
+def vickreyPayments(winners:np.ndarray, winnerUnits:np.ndarray, loserQuantities:np.ndarray, loserValues:np.ndarray, loserOwners:np.ndarray)->np.ndarray:
+	"""
+	Vectorized doubleauction.winnerPayment: each winner pays the value of the first winnerUnits losing units
+	that are not his own. The losers must contain enough units (e.g, a reserve agent at the end).
+
+	>>> vickreyPayments(np.array([0,1]), np.array([5,5]), np.array([2,6,999999]), np.array([200,400,500]), np.array([0,1,-1])).tolist()
+	[2000.0, 1900.0]
+	"""
+	numOfLosers = len(loserQuantities)
+	cumulativeUnits = np.cumsum(loserQuantities)
+	cumulativeValue = np.cumsum(loserQuantities*loserValues.astype(float))
+	# The losing units of each winner, sorted by (winner, position):
+	isWinner = np.zeros(max(int(winners.max()), int(loserOwners.max()))+1, dtype=bool)
+	isWinner[winners] = True
+	own = np.flatnonzero((loserOwners>=0) & isWinner[np.maximum(loserOwners,0)])
+	ownKeys = loserOwners[own]*(numOfLosers+1) + own
+	order = np.argsort(ownKeys, kind='stable')
+	(ownKeys, own) = (ownKeys[order], own[order])
+	ownUnits = np.concatenate(([0], np.cumsum(loserQuantities[own])))
+	ownValue = np.concatenate(([0], np.cumsum(loserQuantities[own]*loserValues[own].astype(float))))
+	groupStarts = np.searchsorted(ownKeys, winners*(numOfLosers+1), side='left')
+
+	def ownUpTo(position:np.ndarray, cumulative:np.ndarray)->np.ndarray:   # own units/value at positions <= position
+		ends = np.searchsorted(ownKeys, winners*(numOfLosers+1)+position, side='right')
+		return np.where(position>=0, cumulative[ends]-cumulative[groupStarts], 0)
+
+	# binary search for the first position at which the non-own units reach winnerUnits:
+	low = np.zeros(len(winners), dtype=np.int64)
+	high = np.full(len(winners), numOfLosers-1, dtype=np.int64)
+	while (low<high).any():
+		middle = (low+high)//2
+		reached = cumulativeUnits[middle] - ownUpTo(middle, ownUnits) >= winnerUnits
+		high = np.where(reached, middle, high)
+		low = np.where(reached, low, middle+1)
+	previous = low-1
+	unitsBefore = np.where(previous>=0, cumulativeUnits[np.maximum(previous,0)], 0) - ownUpTo(previous, ownUnits)
+	valueBefore = np.where(previous>=0, cumulativeValue[np.maximum(previous,0)], 0) - ownUpTo(previous, ownValue)
+	return valueBefore + (winnerUnits-unitsBefore)*loserValues[low]
+
+
+class _PartialGain:
+	"""
+	Calculates the gain of the best 'take' active units of a single trader, while the merged stream passes in descending order.
+	"""
+
+	def __init__(self, owner:int, isBuyer:bool, price:float, skip:int, take:int):
+		(self.owner, self.isBuyer, self.price, self.skip, self.take) = (owner, isBuyer, price, skip, take)
+		self.gain = 0
+		self.done = take<=0
+
+	def consume(self, quantities, values, owners, isBuyer):
+		relevant = (owners==self.owner) & ((values>self.price) if self.isBuyer else (values<self.price))
+		for (quantity,value) in zip(quantities[relevant].tolist(), values[relevant].tolist()):
+			skipped = min(quantity, self.skip)
+			self.skip -= skipped
+			taken = min(quantity-skipped, self.take)
+			self.take -= taken
+			self.gain += taken*(value-self.price if self.isBuyer else self.price-value)
+			if self.take==0:
+				self.done = True
+				return
+
+
+def _stream(market:StreamingMarket, consumers:list, ascending:bool=False):
+	consumers = [c for c in consumers if not c.done]
+	if not consumers:
+		return
+	for block in market.runs.merged(ascending=ascending):
+		for consumer in consumers:
+			if not consumer.done:
+				consumer.consume(*block)
+		if all(c.done for c in consumers):
+			return
+
+
+
+### Mechanisms ###
+
+def streamingWALRASandMUDA(market:StreamingMarket, rng:np.random.Generator=None)->tuple:
+	"""
+	Run WALRAS and MUDA (with both lottery and Vickrey) on a StreamingMarket.
+	rng - the numpy random Generator for the partition and the lottery (default: the Generator of the market).
+	OUTPUT: ((numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade),
+	         (sizeLottery, gainLottery, gainLottery, sizeVickrey, tradersGainVickrey, totalGainVickrey))
+	         - the same as WALRAS(traders) and MUDA(traders, Lottery=True, Vickrey=True).
+
+	>>> market = randomStreamingAuction(20, 1, 3, 100, 50, rng=np.random.default_rng(1))
+	>>> smallMemory = randomStreamingAuction(20, 1, 3, 100, 50, rng=np.random.default_rng(1), memoryLimit=40*BYTES_PER_UNIT)
+	>>> len(smallMemory.runs.runs) > 1
+	True
+	>>> (walras, muda) = streamingWALRASandMUDA(market)
+	>>> walras[:3], muda[0]
+	((34, 34, 34), 33)
+	>>> np.allclose(walras+muda, sum(streamingWALRASandMUDA(smallMemory), ()))   # up to the order of floating-point additions
+	True
+	"""
+	if rng is None:
+		rng = market.rng
+	left = rng.random(len(market)) < 0.5
+	halves = (left, ~left)
+	crossings = [_crossingOf(market, None), _crossingOf(market, left), _crossingOf(market, ~left)]
+	_stream(market, crossings)
+	(price, numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade) = crossings[0].result
+	walras = (numOfBuyers, numOfSellers, totalUnitsTraded, gainFromTrade)
+	prices = (crossings[2].result[0], crossings[1].result[0])   # each half trades in the price of the other half
+
+	(activeUnits, activeGain) = _activeTraders(market, halves, prices)
+
+	# Lottery: the short side trades all its active units; the long side is served in a random order of traders.
+	lotterySize = lotteryGain = 0
+	partials = []
+	vickreyCuts = []
+	vickreyShortGains = []
+	for (half, price) in zip(halves, prices):
+		buyers = half & market.isTraderBuyer
+		sellers = half & ~market.isTraderBuyer
+		(demand, supply) = (int(activeUnits[buyers].sum()), int(activeUnits[sellers].sum()))
+		buyersShort = demand < supply
+		(short, long, quota) = (buyers, sellers, demand) if buyersShort else (sellers, buyers, supply)
+		shortGain = float(activeGain[short].sum())
+		lotterySize += quota
+		candidates = rng.permutation(np.flatnonzero(long))
+		cumulative = np.cumsum(activeUnits[candidates])
+		numOfFullWinners = int(np.searchsorted(cumulative, quota, side='right'))
+		lotteryGain += shortGain + float(activeGain[candidates[:numOfFullWinners]].sum())
+		remaining = quota - (int(cumulative[numOfFullWinners-1]) if numOfFullWinners>0 else 0)
+		if remaining>0:
+			partial = int(candidates[numOfFullWinners])
+			isBuyer = not buyersShort
+			skip = 0 if isBuyer else int(activeUnits[partial])-remaining   # a seller's best units come last in descending order
+			partials.append(_PartialGain(partial, isBuyer, price, skip, remaining))
+		vickreyCuts.append(_VickreyCut(market, half, price, not buyersShort, quota))
+		vickreyShortGains.append(shortGain)
+	_stream(market, partials + [cut for cut in vickreyCuts if cut.isBuyer], ascending=False)
+	_stream(market, [cut for cut in vickreyCuts if not cut.isBuyer], ascending=True)
+	lotteryGain += sum(p.gain for p in partials)
+
+	vickreyTradersGain = vickreyTotalGain = 0
+	for (cut, shortGain) in zip(vickreyCuts, vickreyShortGains):
+		(managerGain, winnersGain) = cut.result()
+		totalGain = shortGain + winnersGain
+		vickreyTotalGain += totalGain
+		vickreyTradersGain += totalGain - managerGain
+	muda = (lotterySize, lotteryGain, lotteryGain, lotterySize, vickreyTradersGain, vickreyTotalGain)
+	return (walras, muda)
+
+
+def _activeTraders(market:StreamingMarket, halves:tuple, prices:tuple)->tuple:
+	"""
+	OUTPUT: (activeUnits, activeGain) - arrays with the number of units, and their gain, that each trader wants to trade in the price of his half.
+	"""
+	numOfTraders = len(market)
+	activeUnits = np.zeros(numOfTraders, dtype=np.int64)
+	activeGain = np.zeros(numOfTraders)
+	(left,right) = halves
+	for (quantities, values, owners, isBuyer) in market.blocks():
+		price = np.where(left[owners], prices[0], prices[1])
+		active = np.where(isBuyer, values>price, values<price)
+		(quantities, values, owners, isBuyer, price) = (quantities[active], values[active], owners[active], isBuyer[active], price[active])
+		gains = quantities*np.where(isBuyer, values-price, price-values)
+		activeUnits += np.bincount(owners, weights=quantities, minlength=numOfTraders).astype(np.int64)
+		activeGain += np.bincount(owners, weights=gains, minlength=numOfTraders)
+	return (activeUnits, activeGain)
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")
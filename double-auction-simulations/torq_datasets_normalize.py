@@ -10,33 +10,78 @@ Since : 2017-07
 import numpy as np
 import pandas as pd
 from pandas import DataFrame
-from pandas.tools import plotting
-import matplotlib.pyplot as plt
 import math
 import os
+import shutil
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
 
-from doubleauction import Trader,walrasianEquilibrium
+from doubleauction import Trader,equilibriumBySelection,walrasianEquilibrium
 from torq_datasets_read import *
 
-def calculateWalrasianPrices(filename):
+PRICE_COLUMNS = ('Symbol','Date','Walrasian Price')
+
+
+def _walrasianPrice(orders:DataFrame)->float:
+	"""
+	The Walrasian equilibrium price of the given orders, where each order is a separate trader (as in auctionsBySymbolDate).
+	The price is calculated on the columns, by selection (see doubleauction.equilibriumBySelection).
+	"""
+	quantities = orders["Quantity"].to_numpy(dtype=np.int64)
+	values = orders["Price"].to_numpy()
+	isBuyer = (orders["Side"]=="BUY").to_numpy()
+	return equilibriumBySelection(quantities, values, isBuyer)[0]
+
+
+def _symbolPrices(symbol:str, orders:DataFrame, partFilename:str)->DataFrame:
+	"""
+	Calculate the Walrasian prices of a single symbol in all dates, and save them to a part file (so that they are not re-calculated on restart).
+	"""
+	rows = [(symbol, int(date), _walrasianPrice(dateOrders)) for (date,dateOrders) in orders.groupby('Date', sort=True)]
+	prices = DataFrame(rows, columns=PRICE_COLUMNS)
+	prices.to_csv(partFilename+".temp", index=False)
+	os.replace(partFilename+".temp", partFilename)
+	print("\t{}: {} dates".format(symbol, len(prices)))
+	return prices
+
+
+def calculateWalrasianPrices(filename, numOfWorkers:int=None):
 	"""
 	Reads a dataset that contains buy and sell orders.
 
 	Calculates a dataset that contains the Walrasian equilibrium price for each symbol and day.
+	The symbols are processed in parallel by numOfWorkers processes (default: the number of CPUs),
+	and the prices are written in a single write at the end.
+	The prices of each symbol are also saved in a part file, so if the calculation is interrupted,
+	a restart calculates only the symbols that are not done yet.
 	"""
 	datasetFilename = "datasets/"+filename+".CSV"
 	pricesFilename = "datasets/"+filename+"-PRICES.CSV"
-	columns=('Symbol','Date', 'Walrasian Price')
-	results = DataFrame(columns=columns)
-	print("\t{}".format(columns))
+	partsDirectory = "datasets/"+filename+"-PRICES.parts"
+	os.makedirs(partsDirectory, exist_ok=True)
+	dataset = pd.read_csv(datasetFilename)
+	print("\t{}".format(PRICE_COLUMNS))
+
+	parts = []
+	tasks = []
+	for (symbol,orders) in dataset.groupby('Symbol', sort=True):
+		partFilename = os.path.join(partsDirectory, quote(symbol, safe='')+".csv")
+		if os.path.exists(partFilename):   # done before the restart
+			parts.append(pd.read_csv(partFilename))
+		else:
+			tasks.append((symbol, orders, partFilename))
+	if numOfWorkers==1:
+		parts += [_symbolPrices(symbol, orders, partFilename) for (symbol, orders, partFilename) in tasks]
+	elif tasks:
+		with ProcessPoolExecutor(max_workers=numOfWorkers) as executor:
+			parts += list(executor.map(_symbolPrices, *zip(*tasks)))
 
-	for symbol,date,traders in auctionsBySymbolDate(datasetFilename, combineByOrderDate=False):
-		(equilibriumPrice, numOfBuyers, numOfSellers, sizeOfTrade, gainFromTrade) = walrasianEquilibrium(traders)
-		resultsRow = [symbol,int(date),equilibriumPrice]
-		print("\t{}".format(resultsRow))
-		results.loc[len(results)] = resultsRow
-	results.to_csv(pricesFilename)
+	prices = pd.concat(parts, ignore_index=True) if parts else DataFrame(columns=PRICE_COLUMNS)
+	prices.sort_values(['Symbol','Date'], inplace=True, ignore_index=True)
+	prices.to_csv(pricesFilename)
+	shutil.rmtree(partsDirectory)
+	return prices
 
 
 def normalizePrices(filename):
@@ -45,24 +90,31 @@ def normalizePrices(filename):
 	and a dataset that contains the Walrasian prices for each symbol and day.
 	
 	Calculates a dataset that contains the buy and sell orders normalized to a percentage of the price (such that the Walrasian price is always 100).
+	The Walrasian price of each order is found by the index of its (symbol,date) group, so the dataset is not merged with the prices;
+	orders of days without a price are dropped.
 	"""
 	datasetFilename = "datasets/"+filename+".CSV"
 	pricesFilename = "datasets/"+filename+"-PRICES.CSV"
 	normalizedFilename = "datasets/"+filename+"-NORM.CSV"
 	dataset = pd.read_csv(datasetFilename)
-	prices =  pd.read_csv(pricesFilename)
-	normalized = pd.merge(dataset, prices, on=['Symbol','Date'])
-	normalized['Price'] = normalized['Price'] * 100 / normalized['Walrasian Price']
-	normalized.drop(["Walrasian Price","Unnamed: 0_x","Unnamed: 0_y"], axis=1, inplace=True)
-	normalized.to_csv(normalizedFilename)
+	dataset.drop(columns=[c for c in dataset.columns if c.startswith("Unnamed:")], inplace=True)
+	prices = pd.read_csv(pricesFilename)
+	prices['Date'] = prices['Date'].astype(np.int64)
+	grouped = dataset.groupby(['Symbol','Date'], sort=True)
+	walrasianPrices = prices.set_index(['Symbol','Date'])['Walrasian Price'].reindex(grouped.size().index).to_numpy()
+	orderPrices = walrasianPrices[grouped.ngroup().to_numpy()]
+	dataset['Price'] = dataset['Price'] * 100 / orderPrices
+	dataset = dataset[~np.isnan(orderPrices)].reset_index(drop=True)
+	dataset.to_csv(normalizedFilename)
 
 
 
 ### MAIN PROGRAM ###
 
-filename =  "910121-910121-IBM-SOD" #  "901101-910131-IBM-SOD" #"901101-910131-SOD" #    
-calculateWalrasianPrices(filename)
-normalizePrices(filename)
+if __name__ == "__main__":
+	filename =  "910121-910121-IBM-SOD" #  "901101-910131-IBM-SOD" #"901101-910131-SOD" #    
+	calculateWalrasianPrices(filename)
+	normalizePrices(filename)
 
-for (symbol,date,traders) in auctionsBySymbolDate("datasets/"+filename+"-NORM.CSV"):
-	print(traders)
+	for ((symbol,date),traders) in auctionsBySymbolDate("datasets/"+filename+"-NORM.CSV"):
+		print(traders)
@@ -3,83 +3,273 @@
 """
 Functions for reading the stock-market datasets extracted from the TORQ database.
 
+pandas is imported only inside the readers, so that importing this module (e.g. in simulation workers) is fast.
+
 Author: Erel Segal-Halevi
 Since : 2017-07
 """
 
 import numpy as np
-import pandas as pd
-from pandas import DataFrame
-from pandas.tools import plotting
-import matplotlib.pyplot as plt
+import json
 import math
 import os
-from collections import defaultdict
+import shutil
 
 from doubleauction import Trader
+from markets import Market
+
+
+
+
+ARRAYS_SUFFIX = ".arrays"   # the directory of the memory-mapped arrays of a dataset, next to its CSV file
+
+
+class TorqArrays:
+	"""
+	The orders of a TORQ dataset, in read-only arrays that are memory-mapped from .npy files.
+	The arrays are written once, to the directory filename+ARRAYS_SUFFIX (and re-written when the CSV file changes);
+	several processes may open the dataset at the same time: each writes into its own temporary directory, which is renamed atomically,
+	and a process that finds the arrays already written by another one uses them.
+	The orders are sorted by (symbol, date), keeping the order of the file within each (symbol,date),
+	so the orders of each symbol and of each (symbol,date) are contiguous, and their ranges are kept in offset arrays.
+	All the processes that open the same dataset share the pages of the files, instead of each loading its own copy;
+	a TorqArrays is pickled by its filename, so sending it to a worker process sends only the filename.
+	"""
+
+	FIELDS = ("price", "quantity", "isBuyer", "orderDate", "symbolOffsets", "groupOffsets", "groupDates")
+	_opened = {}   # filename -> TorqArrays, so each process maps a dataset once
 
+	def __init__(self, filename:str):
+		self.filename = filename
+		directory = filename+ARRAYS_SUFFIX
+		metadata = TorqArrays._metadata(filename, directory)
+		if metadata is None:
+			metadata = TorqArrays._write(filename, directory)
+		self.symbols = metadata["symbols"]
+		self.modificationTime = metadata["modificationTime"]   # of the CSV file, when the arrays were written
+		for field in TorqArrays.FIELDS:
+			setattr(self, field, np.load(os.path.join(directory, field+".npy"), mmap_mode="r"))
+		# the (symbol,date) groups of each symbol are contiguous too:
+		self.symbolGroupOffsets = np.searchsorted(self.groupOffsets, self.symbolOffsets)
 
+	@staticmethod
+	def open(filename:str)->'TorqArrays':
+		"""
+		OUTPUT: the TorqArrays of the given CSV file, opened once per process.
+		"""
+		if filename not in TorqArrays._opened:
+			TorqArrays._opened[filename] = TorqArrays(filename)
+		return TorqArrays._opened[filename]
 
+	def __reduce__(self):
+		return (TorqArrays.open, (self.filename,))
 
-def _tradersByIndices(dataset:DataFrame, indices:list, combineByOrderDate=False):
-	if combineByOrderDate:
-		#print ("\tcombineByOrderDate!")
-		orderDateToBids = {
-			"BUY":  defaultdict(list),
-			"SEL":  defaultdict(list)
+	@staticmethod
+	def _metadata(filename:str, directory:str)->dict:
+		"""
+		OUTPUT: the metadata of the arrays in the given directory, or None if they are missing or older than the CSV file.
+		"""
+		try:
+			with open(os.path.join(directory, "metadata.json")) as file:
+				metadata = json.load(file)
+		except FileNotFoundError:
+			return None
+		return metadata if metadata["modificationTime"]==os.path.getmtime(filename) else None
+
+	@staticmethod
+	def _write(filename:str, directory:str)->dict:
+		import pandas as pd
+		dataset = pd.read_csv(filename)
+		order = np.lexsort((dataset['Date'].to_numpy(), dataset['Symbol'].to_numpy()))   # stable
+		dataset = dataset.iloc[order]
+		(symbols, symbolCodes) = np.unique(dataset['Symbol'].to_numpy(), return_inverse=True)
+		dates = dataset['Date'].to_numpy()
+		newSymbol = np.r_[True, symbolCodes[1:]!=symbolCodes[:-1]]
+		newGroup = newSymbol | np.r_[True, dates[1:]!=dates[:-1]]
+		arrays = {
+			"price": dataset['Price'].to_numpy(dtype=float),
+			"quantity": dataset['Quantity'].to_numpy(),
+			"isBuyer": (dataset['Side']=="BUY").to_numpy(),
+			"orderDate": dataset['Order date'].to_numpy(),
+			"symbolOffsets": np.r_[np.flatnonzero(newSymbol), len(dataset)],
+			"groupOffsets": np.r_[np.flatnonzero(newGroup), len(dataset)],
+			"groupDates": dates[newGroup],
 		}
-		for i in indices:
-			bidRow = dataset.loc[i]
-			side = bidRow["Side"]
-			orderDate = bidRow['Order date']
-			bid = (bidRow["Quantity"], bidRow["Price"])
-			orderDateToBids[side][orderDate].append(bid)
-		traders = []
-		for bids in orderDateToBids["BUY"].values():
-			trader = Trader(True, bids) # add a buyer
-			traders.append(trader)
-		for bids in orderDateToBids["SEL"].values():
-			trader = Trader(False, bids) # add a seller
-			traders.append(trader)
-	else:
-		print ("\tadditive!")
-		traders = []
-		for i in indices:
-			bidRow = dataset.loc[i]
-			isBuyer = (bidRow["Side"]=="BUY")
-			bid = (bidRow["Quantity"], bidRow["Price"])
-			bids = [bid]
-			trader = Trader(isBuyer, bids)
-			traders.append(trader)
-	return traders
-	
-
-def auctionsBySymbolDate(filename:str, combineByOrderDate=False):
+		tempDirectory = directory+".temp{}".format(os.getpid())
+		os.makedirs(tempDirectory, exist_ok=True)
+		for (field,array) in arrays.items():
+			np.save(os.path.join(tempDirectory, field+".npy"), array)
+		metadata = {"modificationTime": os.path.getmtime(filename), "symbols": symbols.tolist()}
+		with open(os.path.join(tempDirectory, "metadata.json"), "w") as file:
+			json.dump(metadata, file)
+		while True:
+			try:
+				os.replace(tempDirectory, directory)   # fails if the directory exists (and is not empty)
+				return metadata
+			except OSError:
+				pass
+			current = TorqArrays._metadata(filename, directory)
+			if current is not None:   # another process has written the arrays first
+				shutil.rmtree(tempDirectory, ignore_errors=True)
+				return current
+			# The directory is stale (the CSV file has changed). Move it aside instead of removing it in place,
+			# so no process loads from a half-removed directory; the processes that have mapped its files keep their pages.
+			staleDirectory = directory+".stale{}".format(os.getpid())
+			try:
+				os.replace(directory, staleDirectory)
+			except FileNotFoundError:   # another process has moved it aside
+				continue
+			shutil.rmtree(staleDirectory, ignore_errors=True)
+
+	def auctions(self, bySymbolDate:bool, combineByOrderDate=False):
+		"""
+		A generator that yields, for each symbol or each (symbol,date) in the dataset, a tuple (auctionID, TorqAuction).
+		"""
+		for (symbolCode,symbol) in enumerate(self.symbols):
+			if bySymbolDate:
+				for group in range(self.symbolGroupOffsets[symbolCode], self.symbolGroupOffsets[symbolCode+1]):
+					yield ((symbol, self.groupDates[group].item()),
+						TorqAuction(self, self.groupOffsets[group].item(), self.groupOffsets[group+1].item(), combineByOrderDate))
+			else:
+				yield ((symbol,),
+					TorqAuction(self, self.symbolOffsets[symbolCode].item(), self.symbolOffsets[symbolCode+1].item(), combineByOrderDate))
+
+	def _traderRows(self, start:int, end:int, combineByOrderDate=False)->list:
+		"""
+		OUTPUT: a list with the rows of each trader in the orders start:end (in the order of the file).
+		If combineByOrderDate is true, the orders of each side with the same order date belong to the same trader,
+		and the buyers (by the first appearance of their order date) come before the sellers.
+		"""
+		if not combineByOrderDate:
+			return [[row] for row in range(start, end)]
+		traderRows = []
+		for side in (True, False):
+			rows = start + np.flatnonzero(self.isBuyer[start:end]==side)
+			(orderDates, first, inverse) = np.unique(self.orderDate[rows], return_index=True, return_inverse=True)
+			rank = np.argsort(np.argsort(first))   # the traders are ordered by the first appearance of their order date
+			rows = rows[np.argsort(rank[inverse], kind="stable")]
+			traderRows += np.split(rows, np.cumsum(np.bincount(rank[inverse]))[:-1]) if len(rows)>0 else []
+		return traderRows
+
+	def numOfTraders(self, start:int, end:int, combineByOrderDate=False)->int:
+		if not combineByOrderDate:
+			return end-start
+		return len(np.unique(np.stack((self.isBuyer[start:end], self.orderDate[start:end])), axis=1).T)
+
+	def traders(self, start:int, end:int, combineByOrderDate=False)->list:
+		"""
+		OUTPUT: a list of buyers and sellers with the orders start:end.
+		"""
+		traderRows = self._traderRows(start, end, combineByOrderDate)
+		if len(traderRows)==0:
+			return []
+		rows = np.concatenate(traderRows)
+		offsets = np.concatenate(([0], np.cumsum([len(r) for r in traderRows])))
+		return Trader.fromArrays(self.isBuyer[rows[offsets[:-1]]], offsets, self.quantity[rows], self.price[rows])
+
+
+class TorqAuction:
+	"""
+	An auction with the orders start:end of a TorqArrays (optionally, a sample or replicas of its traders),
+	whose traders are built only when it is called - e.g, in a worker process, which maps the dataset instead of receiving the traders.
+	It has the sample method of markets.Market, and can be multiplied like a list,
+	so it can be passed to simulations.sampleAuctions and simulations.replicaAuctions;
+	it then returns the same Market sample or list of traders as the list of its traders would.
+
+	>>> auctions = list(auctionsBySymbolDate("datasets/910121-910121-IBM-SOD.CSV", combineByOrderDate=True, lazy=True))
+	>>> (auctionID, auction) = auctions[0]
+	>>> auctionID, len(auction), len(2*auction), len(auction.sample([0,0,5]))
+	(('IBM', 910121), 75, 150, 3)
+	>>> sample = auction.sample([0,0,5])()
+	>>> type(sample).__name__, repr(sample[0])==repr(sample[1])==repr(auction()[0])
+	('Market', True)
+	>>> repr((2*auction)()) == repr(2*auction())
+	True
+	"""
+
+	def __init__(self, arrays:TorqArrays, start:int, end:int, combineByOrderDate=False, indices:np.ndarray=None, replicas:int=1):
+		self.arrays = arrays
+		self.start = start
+		self.end = end
+		self.combineByOrderDate = combineByOrderDate
+		self.indices = indices     # the indices of the traders in the sample; None means all the traders
+		self.replicas = replicas   # the number of copies of the traders
+
+	def __call__(self):
+		traders = self.arrays.traders(self.start, self.end, self.combineByOrderDate)
+		if self.indices is not None:
+			return Market(traders).sample(self.indices)   # as in simulations.sampleAuctions
+		return self.replicas * traders
+
+	def sample(self, indices:np.ndarray)->'TorqAuction':
+		return TorqAuction(self.arrays, self.start, self.end, self.combineByOrderDate, np.asarray(indices, dtype=np.int64))
+
+	def __mul__(self, replicas:int)->'TorqAuction':
+		return TorqAuction(self.arrays, self.start, self.end, self.combineByOrderDate, replicas=replicas*self.replicas)
+
+	__rmul__ = __mul__
+
+	def __len__(self):
+		return len(self.indices) if self.indices is not None else self.replicas*self.arrays.numOfTraders(self.start, self.end, self.combineByOrderDate)
+
+	def __repr__(self):
+		return "TorqAuction({}, {}:{}, {} traders)".format(self.arrays.filename, self.start, self.end, len(self))
+
+
+def sampledAuctionOfSymbol(filename:str, combineByOrderDate:bool, symbol:str, agentNum:int, modificationTime:float=None, rng:np.random.Generator=None)->Market:
+	"""
+	OUTPUT: a Market with agentNum traders sampled from the empirical distribution of the traders of the given symbol
+	        (as in simulations.sampleAuctions), e.g, for a result_store.SeededAuction.
+	modificationTime - if given, the modification time of the dataset that the auction should be sampled from
+	                   (so a SeededAuction with it in its parameters is keyed by the content of the dataset, and not only by its filename);
+	                   raises ValueError if the dataset was modified since.
+	"""
+	if rng is None:
+		rng = np.random.default_rng()
+	arrays = TorqArrays.open(filename)
+	if modificationTime is not None and modificationTime!=arrays.modificationTime:
+		raise ValueError("{} was modified since the auction was planned".format(filename))
+	symbolCode = arrays.symbols.index(symbol)
+	auction = TorqAuction(arrays, arrays.symbolOffsets[symbolCode].item(), arrays.symbolOffsets[symbolCode+1].item(), combineByOrderDate)
+	return auction.sample(rng.choice(len(auction), size=agentNum))()
+
+
+def auctionsBySymbolDate(filename:str, combineByOrderDate=False, lazy=False):
 	"""
 	INPUT: 
 	  *  filename - name of a CSV file that contains order-book data (TORQ SOD format), e.g, 901101-910131-SOD.CSV.
 	  *  combineByOrderDate - if true, will assume that different orders from the same day belong to the same trader.
+	  *  lazy - if true, yields a TorqAuction instead of the list of traders.
 	OUTPUT: a generator that yields, for each (symbol,date) combination in the file, a tuple (symbol,date,traders) where "traders" is list of buyers and sellers.
 	"""
-	dataset = pd.read_csv(filename)
-	grouped = dataset.groupby(['Symbol','Date'])
-	for (symbol,date),indices in grouped.groups.items():
-		traders = _tradersByIndices(dataset, indices, combineByOrderDate=combineByOrderDate)
-		yield ((symbol,date), traders)
+	for (auctionID,auction) in TorqArrays.open(filename).auctions(True, combineByOrderDate):
+		yield (auctionID, auction if lazy else auction())
 
 
-def auctionsBySymbol(filename:str, combineByOrderDate=False):
+def auctionsBySymbol(filename:str, combineByOrderDate=False, lazy=False):
 	"""
 	INPUT: 
 	  *  filename - name of a CSV file that contains order-book data, where the prices are normalized (such that the Walrasian equiilbrium price is always 100). E.g, 901101-910131-SOD-NORM.CSV.
 	  *  combineByOrderDate - if true, will assume that different orders from the same day belong to the same trader.
+	  *  lazy - if true, yields a TorqAuction instead of the list of traders.
 	OUTPUT: a generator that yields, for each symbol in the file, a tuple (symbol,traders) where "traders" is list of buyers and sellers from all dates.
 	"""
+	for (auctionID,auction) in TorqArrays.open(filename).auctions(False, combineByOrderDate):
+		yield (auctionID, auction if lazy else auction())
+
+
+
+def ordersBySymbolDate(filename:str):
+	"""
+	INPUT: filename - name of a CSV file that contains order-book data (TORQ SOD format).
+	OUTPUT: a generator that yields, for each (symbol,date) combination in the file, a tuple ((symbol,date),orders),
+	        where "orders" is a DataFrame with the orders of that day, in the order of their order dates (the order in which they arrived).
+	"""
+	import pandas as pd
 	dataset = pd.read_csv(filename)
-	grouped = dataset.groupby(['Symbol'])
-	for symbol,indices in grouped.groups.items():
-		traders = _tradersByIndices(dataset, indices, combineByOrderDate=combineByOrderDate)
-		yield ((symbol,), traders)
+	dataset = dataset.sort_values(['Symbol','Date','Order date'], kind='stable')
+	for (symbol,date),orders in dataset.groupby(['Symbol','Date'], sort=False):
+		yield ((symbol,date), orders)
 
 
 
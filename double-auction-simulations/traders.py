@@ -9,18 +9,27 @@ Since : 2018-08
 """
 
 from operator import itemgetter
+import gc
+import numpy as np
 
 class Trader:
 	"""
 	Represents a multi-unit trader with decreasing-marginal-returns (DMR).
 	"""
 
-	def __init__(self, isBuyer:bool, valuations:list, index:int=None):
+	CHECK_PRESORTED = False   # if True, presorted valuations are checked (see fromArrays)
+
+	def __init__(self, isBuyer:bool, valuations:list, index:int=None, presorted:bool=False):
 		"""
 		valuations is a list of pairs. Each pair is of the form (numUnits,value).
 		They will be sorted automatically by decreasing/increasing value for a buyer/seller resp.
+		If presorted is True, the caller guarantees that they are already sorted, and the list is used as is.
 		"""
-		self.valuations = sorted(valuations, key=itemgetter(1), reverse=isBuyer)
+		if not presorted:
+			valuations = sorted(valuations, key=itemgetter(1), reverse=isBuyer)
+		elif Trader.CHECK_PRESORTED and valuations != sorted(valuations, key=itemgetter(1), reverse=isBuyer):
+			raise ValueError("the valuations are not sorted: {}".format(valuations))
+		self.valuations = valuations
 		self.isBuyer = isBuyer
 		if index is not None:
 			self.index = index
@@ -108,6 +117,44 @@ class Trader:
 		"""
 		return Trader(False, valuations, index)
 
+	def fromArrays(isTraderBuyer, offsets, quantities, values, presorted:bool=False)->list:
+		"""
+		Create many traders at once, from flat arrays (as in packed_markets.PackedMarket):
+		isTraderBuyer has an entry per trader, and the valuations of trader i are quantities[offsets[i]:offsets[i+1]], values[offsets[i]:offsets[i+1]].
+		The valuations are sorted in bulk, with a single stable lexsort, instead of a call to sorted per trader.
+		If presorted is True, the caller guarantees that the valuations of each trader are already sorted
+		(by decreasing/increasing value for a buyer/seller), and they are not sorted again;
+		if Trader.CHECK_PRESORTED is True, this is checked in bulk.
+
+		>>> Trader.fromArrays([True, False], [0, 3, 5], [2, 3, 4, 5, 6], [100, 200, 150, 300, 100])
+		[B[(3, 200), (4, 150), (2, 100)], S[(6, 100), (5, 300)]]
+		>>> Trader.CHECK_PRESORTED = True
+		>>> Trader.fromArrays([True], [0, 2], [2, 3], [100, 200], presorted=True)
+		Traceback (most recent call last):
+		...
+		ValueError: the valuations of trader 0 are not sorted
+		>>> Trader.CHECK_PRESORTED = False
+		"""
+		(isTraderBuyer, offsets, values) = (np.asarray(isTraderBuyer, dtype=bool), np.asarray(offsets), np.asarray(values))
+		owners = np.repeat(np.arange(len(isTraderBuyer)), np.diff(offsets))
+		keys = np.where(isTraderBuyer[owners], -values, values)   # increasing within each trader
+		if not presorted:
+			order = np.lexsort((keys, owners))
+			(quantities, values) = (np.asarray(quantities)[order], values[order])
+		elif Trader.CHECK_PRESORTED:
+			unsorted = np.flatnonzero((np.diff(keys) < 0) & (owners[1:]==owners[:-1]))
+			if len(unsorted)>0:
+				raise ValueError("the valuations of trader {} are not sorted".format(owners[unsorted[0]]))
+		gcWasEnabled = gc.isenabled()
+		gc.disable()   # the new objects have no reference cycles, so collecting while they are created only wastes time
+		try:
+			valuations = list(zip(np.asarray(quantities).tolist(), values.tolist()))
+			offsets = np.asarray(offsets).tolist()
+			return [Trader(isBuyer, valuations[offsets[i]:offsets[i+1]], presorted=True) for (i,isBuyer) in enumerate(isTraderBuyer.tolist())]
+		finally:
+			if gcWasEnabled:
+				gc.enable()
+
 def virtualTraders(traders:list):
 	"""
 	INPUT: a list of traders.
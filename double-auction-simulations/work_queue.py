@@ -0,0 +1,281 @@
+#!python3
+
+"""
+A work queue on a shared filesystem, for running the shards of a sweep on any number of worker processes or nodes.
+
+The queue is a directory, with a file per task in one of its subdirectories: todo, running or failed.
+A worker claims a task by renaming its file from todo to running - an atomic operation, so each task is claimed by a single worker -
+under a name that is unique to the claim, and touches the file periodically while it runs the task (a heartbeat).
+When the task is done, its file is removed. As a worker acts only on the file of its own claim,
+a worker whose task was requeued (and claimed again by another worker) cannot remove or requeue the task of the other worker.
+A running task whose file was not touched for timeout seconds (e.g, because its worker or its node crashed)
+is requeued by any process that polls the queue. A task that raises an exception is requeued up to MAX_ATTEMPTS times,
+and then moved to failed.
+
+The workers on other nodes only need to see the same directory (e.g, on NFS), and to run in the same working directory.
+
+Author: Erel Segal-Halevi
+Since : 2018-09
+"""
+
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+TODO, RUNNING, FAILED = "todo", "running", "failed"
+MAX_ATTEMPTS = 3
+DEFAULT_TIMEOUT = 60     # seconds without a heartbeat, after which a running task is requeued
+POLL_INTERVAL = 1        # seconds between polls of an empty queue
+
+
+class WorkQueue:
+	"""
+	A queue of tasks (JSON-serializable dicts) in a directory.
+
+	>>> import tempfile
+	>>> queue = WorkQueue(tempfile.mkdtemp())
+	>>> queue.put([{"point": 1}, {"point": 2}])
+	>>> (name, task) = queue.claim()
+	>>> task, queue.counts()
+	({'point': 1}, {'todo': 1, 'running': 1, 'failed': 0})
+	>>> queue.requeueStale(timeout=0)   # e.g, the worker of point 1 crashed
+	1
+	>>> [queue.claim()[1] for i in range(3)]
+	[{'point': 1}, {'point': 2}, None]
+
+	The first worker of a requeued task does not affect the claim of the second one:
+
+	>>> queue = WorkQueue(tempfile.mkdtemp())
+	>>> queue.put([{"point": 1}])
+	>>> (first, task) = queue.claim()
+	>>> queue.requeueStale(timeout=0)
+	1
+	>>> (second, task) = queue.claim()
+	>>> queue.done(first)
+	>>> queue.counts(), queue.finished(), queue.heartbeat(first), queue.heartbeat(second)
+	({'todo': 0, 'running': 1, 'failed': 0}, False, False, True)
+
+	A restarted coordinator keeps the claims of the running workers, and retries the failed tasks:
+
+	>>> queue.put([{"point": 2}])
+	>>> queue.fail(*queue.claim(), error="MemoryError"); queue.fail(*queue.claim(), error="MemoryError"); queue.fail(*queue.claim(), error="MemoryError")
+	>>> queue.counts()
+	{'todo': 0, 'running': 1, 'failed': 1}
+	>>> queue.retryFailed(), queue.tasks()
+	(1, [{'point': 2}, {'point': 1}])
+	"""
+
+	def __init__(self, directory:str):
+		self.directory = directory
+
+	def _path(self, state:str, name:str=None)->str:
+		return os.path.join(self.directory, state) if name is None else os.path.join(self.directory, state, name)
+
+	def _names(self, state:str)->list:
+		return sorted(os.listdir(self._path(state))) if os.path.isdir(self._path(state)) else []
+
+	def _write(self, state:str, name:str, task:dict):
+		temp = self._path(state, name)+".temp{}".format(os.getpid())
+		with open(temp, "w") as file:
+			json.dump(task, file)
+		os.replace(temp, self._path(state, name))
+
+	def put(self, tasks:list):
+		for state in (TODO, RUNNING, FAILED):
+			os.makedirs(self._path(state), exist_ok=True)
+		prefix = time.time_ns()   # the tasks are claimed in the order in which they were put
+		for (i,task) in enumerate(tasks):
+			self._write(TODO, "{}-{:08d}.json".format(prefix, i), task)
+
+	def claim(self)->tuple:
+		"""
+		OUTPUT: (name, task) of a task that was moved to running, or (None, None) if there are no tasks to do.
+		        The name is that of the claim (see done, fail and heartbeat).
+		"""
+		claimant = "{}-{}-{}".format(socket.gethostname().replace(".","_"), os.getpid(), uuid.uuid4().hex[:8])
+		for name in self._names(TODO):
+			if name.endswith(".json"):
+				claim = "{}.{}.json".format(_taskName(name)[:-len(".json")], claimant)
+				try:
+					os.rename(self._path(TODO, name), self._path(RUNNING, claim))
+				except FileNotFoundError:   # claimed by another worker
+					continue
+				with open(self._path(RUNNING, claim)) as file:
+					return (claim, json.load(file))
+		return (None, None)
+
+	def done(self, name:str):
+		"""
+		Remove the task of the given claim.
+		"""
+		try:
+			os.remove(self._path(RUNNING, name))
+		except FileNotFoundError:   # it was requeued, but its results exist, so it will be skipped
+			pass
+
+	def fail(self, name:str, task:dict, error:str):
+		"""
+		Requeue the task of the given claim, which raised an exception, or move it to failed after MAX_ATTEMPTS attempts.
+		If the task was requeued meanwhile, only the number of attempts is updated.
+		"""
+		task = dict(task, attempts=task.get("attempts",0)+1, error=error)
+		try:
+			with open(self._path(RUNNING, name), "r+") as file:   # only if the claim still exists
+				json.dump(task, file)
+				file.truncate()
+			os.rename(self._path(RUNNING, name), self._path(TODO if task["attempts"]<MAX_ATTEMPTS else FAILED, _taskName(name)))
+		except FileNotFoundError:   # it was requeued, and maybe claimed by another worker
+			pass
+
+	def heartbeat(self, name:str)->bool:
+		"""
+		Touch the file of the given claim.
+		OUTPUT: False if the task was requeued (so the claim does not exist anymore).
+		"""
+		try:
+			os.utime(self._path(RUNNING, name))
+			return True
+		except FileNotFoundError:
+			return False
+
+	def requeueStale(self, timeout:float=DEFAULT_TIMEOUT)->int:
+		"""
+		Move the running tasks that had no heartbeat in the last timeout seconds back to todo.
+		OUTPUT: the number of requeued tasks.
+		"""
+		requeued = 0
+		now = time.time()
+		for name in self._names(RUNNING):
+			try:
+				if name.endswith(".json") and now - os.path.getmtime(self._path(RUNNING, name)) >= timeout:
+					os.rename(self._path(RUNNING, name), self._path(TODO, _taskName(name)))
+					requeued += 1
+			except FileNotFoundError:   # done or requeued by another process
+				pass
+		return requeued
+
+	def counts(self)->dict:
+		return {state: len([name for name in self._names(state) if name.endswith(".json")]) for state in (TODO, RUNNING, FAILED)}
+
+	def tasks(self, states:tuple=(TODO, RUNNING))->list:
+		"""
+		OUTPUT: the tasks in the given states.
+		"""
+		tasks = []
+		for state in states:
+			for name in self._names(state):
+				try:
+					if name.endswith(".json"):
+						with open(self._path(state, name)) as file:
+							tasks.append(json.load(file))
+				except FileNotFoundError:   # claimed, done or requeued by another process
+					pass
+		return tasks
+
+	def failed(self)->list:
+		return self.tasks((FAILED,))
+
+	def retryFailed(self)->int:
+		"""
+		Move the failed tasks back to todo, with a new count of attempts.
+		OUTPUT: the number of retried tasks.
+		"""
+		retried = 0
+		for name in self._names(FAILED):
+			if name.endswith(".json"):
+				with open(self._path(FAILED, name)) as file:
+					task = json.load(file)
+				task.pop("attempts", None)
+				task.pop("error", None)
+				self._write(TODO, name, task)
+				os.remove(self._path(FAILED, name))
+				retried += 1
+		return retried
+
+	def finished(self)->bool:
+		counts = self.counts()
+		return counts[TODO]==0 and counts[RUNNING]==0
+
+
+def _taskName(name:str)->str:
+	"""
+	The name of a task in todo (or failed), from the name of its claim in running.
+
+	>>> _taskName("1536000000-00000007.node_1-4242-0a1b2c3d.json"), _taskName("1536000000-00000007.json")
+	('1536000000-00000007.json', '1536000000-00000007.json')
+	"""
+	return name.split(".")[0]+".json"
+
+
+def runWorker(directory:str, function, timeout:float=DEFAULT_TIMEOUT, pollInterval:float=POLL_INTERVAL)->int:
+	"""
+	Run the tasks of the queue in the given directory, by calling function(task), until the queue is finished.
+	OUTPUT: the number of tasks that this worker completed.
+	"""
+	queue = WorkQueue(directory)
+	while not os.path.isdir(queue._path(TODO)):   # the coordinator did not create the queue yet
+		time.sleep(pollInterval)
+	numOfTasks = 0
+	while True:
+		queue.requeueStale(timeout)
+		(name, task) = queue.claim()
+		if name is None:
+			if queue.finished():
+				return numOfTasks
+			time.sleep(pollInterval)
+			continue
+		stopped = threading.Event()
+		def beat():
+			while not stopped.wait(timeout/4) and queue.heartbeat(name):
+				pass
+		heart = threading.Thread(target=beat, daemon=True)
+		heart.start()
+		try:
+			function(task)
+		except Exception:
+			print("Task {} failed:\n{}".format(task, traceback.format_exc()))
+			queue.fail(name, task, traceback.format_exc(limit=1))
+		else:
+			queue.done(name)
+			numOfTasks += 1
+		finally:
+			stopped.set()
+			heart.join()
+
+
+def runQueue(directory:str, function, numOfWorkers:int=None, timeout:float=DEFAULT_TIMEOUT, pollInterval:float=POLL_INTERVAL)->list:
+	"""
+	Coordinate the queue in the given directory: run numOfWorkers local worker processes (default: the number of CPUs;
+	0 means that only workers on other nodes run the tasks), restart the local workers that die while there are tasks,
+	and requeue the stale tasks, until the queue is finished.
+	OUTPUT: the tasks that failed.
+	"""
+	queue = WorkQueue(directory)
+	if numOfWorkers is None:
+		numOfWorkers = os.cpu_count()
+	workers = []
+	numOfStarts = 0
+	while not queue.finished():
+		workers = [worker for worker in workers if worker.is_alive()]
+		for i in range(min(numOfWorkers-len(workers), MAX_ATTEMPTS*numOfWorkers-numOfStarts)):   # a worker that keeps dying is not restarted forever
+			worker = multiprocessing.Process(target=runWorker, args=(directory, function, timeout, pollInterval))
+			worker.start()
+			workers.append(worker)
+			numOfStarts += 1
+		queue.requeueStale(timeout)
+		time.sleep(pollInterval)
+	for worker in workers:
+		worker.join()
+	return queue.failed()
+
+
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
+	print("Doctest OK!\n")